@@ -0,0 +1,165 @@
+import asyncio
+import threading
+import time
+from collections import namedtuple
+from importlib import import_module
+from typing import Optional
+from bson import ObjectId
+from channels.db import database_sync_to_async
+from django.conf import settings
+
+# Roles that may open any project, as in the REST views.
+PRIVILEGED_ROLES = ('project-manager', 'scrum-master')
+
+# The user behind an editor WebSocket (scope['user'], see ws_auth.py).
+WebSocketUser = namedtuple('WebSocketUser', ('id', 'username', 'role'))
+
+
+class ProjectAccessCache:
+    """
+    In-process cache of who may open a project's editor sockets.
+
+    Authorizing a WebSocket takes a session lookup, a MongoDB user lookup
+    and a project lookup.  After a network blip every client reconnects at
+    once, often several sockets each, so both answers are cached for `ttl`
+    seconds: session key -> user, and (project, user) -> allowed.
+    Concurrent misses for the same key share a single lookup, so a storm
+    costs one query per distinct key instead of one per socket.
+
+    Entries of a project are dropped as soon as the Project is saved or
+    deleted here (see Project.save / Project.delete); other workers and
+    logged-out sessions pick up changes when their entry expires.  Expired
+    entries are swept out at most once per `ttl`, when a new one is stored.
+    """
+
+    def __init__(self, ttl=None):
+        self.ttl = ttl if ttl is not None else getattr(
+            settings, 'EDITOR_WS_AUTH_CACHE_TTL_SECONDS', 30
+        )
+        # session key -> (WebSocketUser or None, expires)
+        self._users = {}
+        # (project_id, user_id, role) -> (bool, expires)
+        self._access = {}
+        # cache key -> Future of the lookup in flight (event loop only)
+        self._inflight = {}
+        self._lock = threading.Lock()
+        # Bumped on every invalidation so a lookup that raced with a save
+        # does not put the pre-save answer back into the cache.
+        self._generation = 0
+        self._next_sweep = 0
+        self.hits = 0
+        self.misses = 0
+        self.shared_lookups = 0
+
+    async def user_for_session(self, session_key) -> Optional[WebSocketUser]:
+        """The active user logged in with `session_key`, else None."""
+        if not session_key:
+            return None
+        # Misses are not cached: the same session may log in a moment later.
+        return await self._get(self._users, session_key, _load_session_user, session_key, cache_none=False)
+
+    async def can_access(self, project_id, user: WebSocketUser) -> bool:
+        """Whether `user` may edit files of `project_id`."""
+        key = (str(project_id), user.id, user.role)
+        return await self._get(self._access, key, _load_access, *key)
+
+    async def _get(self, table, key, load, *args, cache_none=True):
+        with self._lock:
+            entry = table.get(key)
+            if entry is not None and entry[1] > time.monotonic():
+                self.hits += 1
+                return entry[0]
+            self.misses += 1
+            generation = self._generation
+
+        inflight_key = (id(table), key)
+        future = self._inflight.get(inflight_key)
+        if future is not None:
+            self.shared_lookups += 1
+            return await asyncio.shield(future)
+
+        future = self._inflight[inflight_key] = asyncio.get_running_loop().create_future()
+        try:
+            value = await database_sync_to_async(load)(*args)
+        except Exception as e:
+            future.set_exception(e)
+            # Waiters re-raise it; nobody may be waiting.
+            future.exception()
+            raise
+        else:
+            with self._lock:
+                if generation == self._generation and (value is not None or cache_none):
+                    now = time.monotonic()
+                    if now >= self._next_sweep:
+                        self._sweep(now)
+                    table[key] = (value, now + self.ttl)
+            future.set_result(value)
+            return value
+        finally:
+            self._inflight.pop(inflight_key, None)
+
+    def invalidate(self, project_id=None):
+        """Forget one project's access entries, or everything when no id is given."""
+        with self._lock:
+            self._generation += 1
+            if project_id is None:
+                self._users.clear()
+                self._access.clear()
+            else:
+                project_id = str(project_id)
+                for key in [key for key in self._access if key[0] == project_id]:
+                    del self._access[key]
+
+    def _sweep(self, now):
+        # Called with the lock held.
+        for table in (self._users, self._access):
+            for key in [key for key, entry in table.items() if entry[1] <= now]:
+                del table[key]
+        self._next_sweep = now + self.ttl
+
+    def stats(self) -> dict:
+        with self._lock:
+            now = time.monotonic()
+            return {
+                'sessions': sum(1 for entry in self._users.values() if entry[1] > now),
+                'entries': sum(1 for entry in self._access.values() if entry[1] > now),
+                'hits': self.hits,
+                'misses': self.misses,
+                'shared_lookups': self.shared_lookups,
+                'ttl_seconds': self.ttl,
+            }
+
+
+def _load_session_user(session_key) -> Optional[WebSocketUser]:
+    # Same checks as users.authentication.MongoEngineSessionAuthentication.
+    from users.models import User
+
+    session = import_module(settings.SESSION_ENGINE).SessionStore(session_key)
+    if not session.get('is_authenticated', False):
+        return None
+    user_id = session.get('user_id')
+    username = session.get('username')
+    if not user_id or not username:
+        return None
+    user = User.objects.filter(id=user_id, username=username).only('id', 'username', 'role', 'is_active').first()
+    if user is None or not user.is_active:
+        return None
+    return WebSocketUser(str(user.id), user.username, user.role)
+
+
+def _load_access(project_id, user_id, role) -> bool:
+    # Imported here because models.py imports this module to invalidate.
+    from .models import Project
+
+    try:
+        project_oid = ObjectId(project_id)
+    except Exception:
+        return False
+    project = Project.objects.filter(id=project_oid).only('members').first()
+    if project is None:
+        return False
+    return role in PRIVILEGED_ROLES or project.is_member(ObjectId(user_id))
+
+
+# Global instance
+project_access_cache = ProjectAccessCache()
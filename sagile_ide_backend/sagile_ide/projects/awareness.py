@@ -0,0 +1,174 @@
+import asyncio
+import time
+import pycrdt
+from channels.layers import get_channel_layer
+from sagile_ide.log import get_logger
+from .metrics import BROADCASTS
+
+logger = get_logger(__name__)
+
+
+def decode_awareness_update(update):
+    """Yield (client_id, clock, state_json) entries of a Yjs awareness update."""
+    decoder = pycrdt.Decoder(update)
+    for _ in range(decoder.read_var_uint()):
+        client_id = decoder.read_var_uint()
+        clock = decoder.read_var_uint()
+        yield client_id, clock, decoder.read_var_string()
+
+
+def encode_awareness_update(entries):
+    """Encode (client_id, clock, state_json) entries as a Yjs awareness update."""
+    encoder = pycrdt.Encoder()
+    encoder.write_var_uint(len(entries))
+    for client_id, clock, state in entries:
+        encoder.write_var_uint(client_id)
+        encoder.write_var_uint(clock)
+        encoder.write_var_string(state)
+    return encoder.to_bytes()
+
+
+class AwarenessStore:
+    """
+    Server-side awareness (cursor / selection / user) state for one document.
+
+    Incoming awareness frames are decoded and merged using the Yjs clock
+    rules, so stale and duplicate entries are dropped here instead of being
+    relayed.  Accepted changes are collected and sent to the room as one
+    batched awareness message at most once per `interval` seconds, which
+    turns N clients moving their cursors into one message per client per
+    interval instead of N per keystroke.
+
+    Each client id is remembered against the connection that announced it so
+    its state can be removed (and the removal broadcast) when that
+    connection goes away.  `on_announce(channel_name, state_json)`, when
+    given, is called with the first state of each client (see presence.py).
+    """
+
+    def __init__(self, room_group_name, layer_alias, interval, timeout, doc_key=None,
+                 on_announce=None):
+        self.room_group_name = room_group_name
+        self.doc_key = doc_key
+        self.on_announce = on_announce
+        self.layer_alias = layer_alias
+        self.interval = interval
+        self.timeout = timeout
+        # client_id -> (clock, state_json, last_updated)
+        self.states = {}
+        # client_id -> channel name of the connection that owns it
+        self.owners = {}
+        # client_id -> (clock, state_json) waiting for the next batch
+        self.pending = {}
+        self.frames_in = 0
+        self.frames_out = 0
+        self.entries_dropped = 0
+        self._task = None
+
+    def apply(self, update, channel_name):
+        """Merge an awareness update received from `channel_name`."""
+        self.frames_in += 1
+        now = time.monotonic()
+        for client_id, clock, state in decode_awareness_update(update):
+            current = self.states.get(client_id)
+            is_removal = state in ('', 'null')
+            if current is not None:
+                current_clock, current_state, _ = current
+                stale = clock < current_clock
+                duplicate = clock == current_clock and not is_removal
+                if stale or duplicate:
+                    self.entries_dropped += 1
+                    continue
+            elif is_removal:
+                # Removing a client we never saw: nothing to tell anyone.
+                self.entries_dropped += 1
+                continue
+
+            if is_removal:
+                self.states.pop(client_id, None)
+                self.owners.pop(client_id, None)
+                state = 'null'
+            else:
+                if current is None and self.on_announce is not None:
+                    self.on_announce(channel_name, state)
+                self.states[client_id] = (clock, state, now)
+                self.owners[client_id] = channel_name
+            self.pending[client_id] = (clock, state)
+
+        self._expire(now)
+        self._schedule()
+
+    def remove_channel(self, channel_name):
+        """Drop every client announced by a closed connection."""
+        for client_id, owner in list(self.owners.items()):
+            if owner == channel_name:
+                self._remove(client_id)
+        self._schedule()
+
+    def _expire(self, now):
+        # Clients renew their state every ~15s; anything silent for longer
+        # than the timeout belongs to a connection that vanished uncleanly.
+        for client_id, (_, _, last_updated) in list(self.states.items()):
+            if now - last_updated > self.timeout:
+                self._remove(client_id)
+
+    def _remove(self, client_id):
+        clock, _, _ = self.states.pop(client_id)
+        self.owners.pop(client_id, None)
+        self.pending[client_id] = (clock + 1, 'null')
+
+    def full_state_message(self):
+        """Awareness message with every known client, for a joining client."""
+        if not self.states:
+            return None
+        entries = [
+            (client_id, clock, state)
+            for client_id, (clock, state, _) in self.states.items()
+        ]
+        return pycrdt.create_awareness_message(encode_awareness_update(entries))
+
+    def _schedule(self):
+        if self.pending and (self._task is None or self._task.done()):
+            self._task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        try:
+            while self.pending:
+                await asyncio.sleep(self.interval)
+                await self._send_pending()
+        except asyncio.CancelledError:
+            pass
+        except Exception:
+            logger.exception('awareness.error', 'Error broadcasting awareness', room=self.room_group_name)
+
+    async def _send_pending(self):
+        pending, self.pending = self.pending, {}
+        if not pending:
+            return
+        entries = [(client_id, clock, state) for client_id, (clock, state) in pending.items()]
+        self.frames_out += 1
+        BROADCASTS.inc(kind='awareness')
+        await get_channel_layer(self.layer_alias).group_send(
+            self.room_group_name,
+            {
+                'type': 'awareness_update',
+                'bytes_data': pycrdt.create_awareness_message(encode_awareness_update(entries)),
+                'sender_channel': 'server',
+                'doc_key': self.doc_key,
+            }
+        )
+
+    def close(self):
+        if self._task and not self._task.done():
+            self._task.cancel()
+        self.states.clear()
+        self.owners.clear()
+        self.pending.clear()
+
+    def stats(self) -> dict:
+        return {
+            'interval_ms': self.interval * 1000,
+            'clients': len(self.states),
+            'frames_in': self.frames_in,
+            'frames_out': self.frames_out,
+            'entries_dropped': self.entries_dropped,
+        }
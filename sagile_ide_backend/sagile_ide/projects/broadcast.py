@@ -0,0 +1,98 @@
+import asyncio
+import pycrdt
+from channels.layers import get_channel_layer
+from sagile_ide.log import get_logger
+from .metrics import BROADCASTS
+
+logger = get_logger(__name__)
+
+
+class UpdateCoalescer:
+    """
+    Outbound buffer for one document's CRDT updates.
+
+    Every pycrdt transaction pushes its update here instead of issuing its
+    own group_send.  Updates that arrive within `window` seconds of the first
+    pending one are merged with pycrdt.merge_updates and sent to the room as
+    a single update message; a window of 0 merges everything produced in the
+    same event-loop tick.  Flushes are sequential, so the room receives the
+    merged updates in the order they were produced.
+
+    Events carry `doc_key` so a connection subscribed to several documents
+    (ProjectConsumer) can tell which one an update belongs to, and, when a
+    `state_vector` callable is given, the document's state vector right
+    after the update, which lets a lagging client be resynced from the last
+    update it received (see outbound.py).
+    """
+
+    def __init__(self, room_group_name, layer_alias, window, doc_key=None, state_vector=None):
+        self.room_group_name = room_group_name
+        self.doc_key = doc_key
+        self.state_vector = state_vector
+        self.layer_alias = layer_alias
+        self.window = window
+        self.pending = []
+        self.messages_in = 0
+        self.messages_out = 0
+        self._task = None
+        self._sending = False
+
+    def push(self, update):
+        self.pending.append(update)
+        self.messages_in += 1
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        try:
+            while self.pending:
+                await asyncio.sleep(self.window)
+                await self._send_pending()
+        except asyncio.CancelledError:
+            pass
+        except Exception:
+            logger.exception('broadcast.error', 'Error broadcasting update', room=self.room_group_name)
+
+    async def _send_pending(self):
+        updates, self.pending = self.pending, []
+        if not updates:
+            return
+        update = updates[0] if len(updates) == 1 else pycrdt.merge_updates(*updates)
+        state_vector = self.state_vector() if self.state_vector else None
+        self.messages_out += 1
+        BROADCASTS.inc(kind='update')
+        self._sending = True
+        try:
+            await get_channel_layer(self.layer_alias).group_send(
+                self.room_group_name,
+                {
+                    'type': 'editor_update',
+                    'bytes_data': pycrdt.create_update_message(update),
+                    'sender_channel': 'server',
+                    'doc_key': self.doc_key,
+                    'state_vector': state_vector,
+                }
+            )
+        finally:
+            self._sending = False
+
+    async def flush(self):
+        """Send whatever is pending right away (used when the session closes)."""
+        task = self._task
+        if task and not task.done():
+            # Only interrupt the window sleep; a send already in flight owns
+            # the updates it popped and must be allowed to finish.
+            if not self._sending:
+                task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        await self._send_pending()
+
+    def stats(self) -> dict:
+        return {
+            'window_ms': self.window * 1000,
+            'messages_in': self.messages_in,
+            'messages_out': self.messages_out,
+        }
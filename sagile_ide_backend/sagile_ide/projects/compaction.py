@@ -0,0 +1,60 @@
+import os
+import pycrdt
+from .update_log import CRDT_SIDECAR_SUFFIXES, UpdateLog
+
+
+def compact_updates(updates):
+    """
+    Re-encode a document's persisted updates as a single update.
+
+    Only encodings of the very same CRDT state are considered (every item
+    keeps its client id and clock), so clients that are connected, or that
+    reconnect with the document they already hold, keep merging cleanly.
+    Deleted content has already been garbage-collected by the time it is
+    replayed; what shrinks is the log, superseded snapshots and the struct
+    runs that a whole-document encoding merges.  The smallest candidate that
+    replays to the same state vector and text wins.
+    """
+    doc = pycrdt.Doc()
+    for update in updates:
+        doc.apply_update(update)
+    state_vector = doc.get_state()
+    text = str(doc.get('monaco', type=pycrdt.Text))
+
+    candidates = [doc.get_update()]
+    if len(updates) > 1:
+        candidates.append(pycrdt.merge_updates(*updates))
+    for candidate in sorted(candidates, key=len):
+        check = pycrdt.Doc()
+        check.apply_update(candidate)
+        if check.get_state() == state_vector and str(check.get('monaco', type=pycrdt.Text)) == text:
+            return candidate
+    return candidates[0]
+
+
+def compact_document(full_path, dry_run=False):
+    """
+    Compact the sidecars of one document.  Blocking; returns the sidecar
+    size before and after (the estimated size after, for a dry run).
+    """
+    log = UpdateLog(full_path)
+    before = log.size()
+    if dry_run:
+        updates = log.read()
+        return before, len(compact_updates(updates)) if updates else before
+    log.rewrite(compact_updates)
+    return before, log.size()
+
+
+def find_crdt_documents(root_path):
+    """Yield the full path of every document under `root_path` with sidecars."""
+    for dirpath, dirnames, filenames in os.walk(root_path):
+        dirnames[:] = [d for d in dirnames if d != '.git']
+        seen = set()
+        for filename in filenames:
+            for suffix in CRDT_SIDECAR_SUFFIXES:
+                if filename.endswith(suffix):
+                    seen.add(filename[:-len(suffix)])
+                    break
+        for name in sorted(seen):
+            yield os.path.join(dirpath, name)
@@ -0,0 +1,50 @@
+import asyncio
+import zlib
+from urllib.parse import parse_qs
+from django.conf import settings
+
+# Frame type for a zlib-compressed y-protocol message, outside the range
+# used by y-protocols (sync 0, awareness 1, auth 2, query-awareness 3).
+# Layout: [Y_COMPRESSED_MESSAGE_TYPE][zlib(original message)]
+Y_COMPRESSED_MESSAGE_TYPE = 100
+
+# Only frames at least this large are compressed; small edits and cursor
+# moves are cheaper to send as they are.
+COMPRESS_MIN_BYTES = getattr(settings, 'EDITOR_COMPRESS_MIN_BYTES', 64 * 1024)
+COMPRESS_LEVEL = getattr(settings, 'EDITOR_COMPRESS_LEVEL', 6)
+# Upper bound for a decompressed client frame, so a tiny compressed frame
+# cannot expand into an arbitrarily large allocation.
+DECOMPRESS_MAX_BYTES = getattr(settings, 'EDITOR_DECOMPRESS_MAX_BYTES', 256 * 1024 * 1024)
+
+SUPPORTED_CODECS = ('zlib',)
+
+
+def negotiate_compression(scope) -> bool:
+    """True when the client asked for compressed frames (`?compress=zlib`)."""
+    query = parse_qs(scope.get('query_string', b'').decode('latin-1'))
+    return any(codec in SUPPORTED_CODECS for codec in query.get('compress', []))
+
+
+async def compress_frame(frame):
+    """
+    Wrap `frame` in a compressed frame if it is large enough to be worth it
+    and actually shrinks.  zlib releases the GIL, so the work runs in a
+    thread instead of stalling every other document on the event loop.
+    """
+    if len(frame) < COMPRESS_MIN_BYTES or frame[0] == Y_COMPRESSED_MESSAGE_TYPE:
+        return frame
+    compressed = await asyncio.to_thread(zlib.compress, frame, COMPRESS_LEVEL)
+    if len(compressed) + 1 >= len(frame):
+        return frame
+    return bytes((Y_COMPRESSED_MESSAGE_TYPE,)) + compressed
+
+
+def decompress_frame(frame):
+    """Undo compress_frame; other frames are returned unchanged."""
+    if not frame or frame[0] != Y_COMPRESSED_MESSAGE_TYPE:
+        return frame
+    decompressor = zlib.decompressobj()
+    data = decompressor.decompress(frame[1:], DECOMPRESS_MAX_BYTES)
+    if decompressor.unconsumed_tail:
+        raise ValueError('Compressed frame exceeds EDITOR_DECOMPRESS_MAX_BYTES')
+    return data
@@ -1,99 +1,235 @@
-import os
-import asyncio
+import json
+from urllib.parse import quote
 import pycrdt
-from bson import ObjectId
 from channels.generic.websocket import AsyncWebsocketConsumer
-from channels.db import database_sync_to_async
-from channels.layers import get_channel_layer
-from django.conf import settings
-from repositories.models import Repository
-from asgiref.sync import sync_to_async
-
-# Yjs Protocol Message Types
-Y_SYNC_MESSAGE_TYPE = 0
-Y_AWARENESS_MESSAGE_TYPE = 1
-
-# In-memory store for active documents.
-# Key: f"{project_id}:{file_path}"
-# Value: {
-#   'doc': pycrdt.Doc,
-#   'save_task': asyncio.Task | None,
-#   'users': int,
-#   'subscription': Subscription,
-#   'room_group_name': str
-# }
-active_documents: dict = {}
-
-# Per-doc locks to prevent race conditions when multiple clients connect
-# to the same document simultaneously (concurrent initialization).
-_session_locks: dict = {}
+from django.urls import reverse
+from sagile_ide.log import get_logger
+from .compression import (
+    Y_COMPRESSED_MESSAGE_TYPE,
+    compress_frame,
+    decompress_frame,
+    negotiate_compression,
+)
+from .doc_router import document_router
+from .handshake import EMPTY_STATE_VECTOR, decode_state_vector, eager_state_vector
+from .metrics import BYTES_IN, BYTES_OUT, FRAMES_IN, FRAMES_OUT, frame_type_label
+from .outbound import (
+    FRAME_AWARENESS,
+    FRAME_REPLY,
+    FRAME_UPDATE,
+    OutboundQueue,
+    sync_step1_message,
+)
+from .presence import presence_group_name, presence_user
+from .spectators import (
+    SPECTATOR_FRAMES_REJECTED,
+    is_spectator,
+    spectator_frame_allowed,
+    spectator_hub,
+)
+from .sessions import (
+    EDITOR_CHANNEL_LAYER,
+    Y_SYNC_MESSAGE_TYPE,
+    Y_AWARENESS_MESSAGE_TYPE,
+    DocumentTooLarge,
+    check_document_size,
+    document_key,
+    normalize_file_path,
+    room_group_name_for,
+    session_manager,
+)
+
+logger = get_logger(__name__)
+
+# Close code for files that are too large to edit live.
+READ_ONLY_CLOSE_CODE = 4413
+# Close code for file paths outside the project's repository.
+INVALID_PATH_CLOSE_CODE = 4400
+
+
+def read_only_fields(project_id, file_path, error):
+    """Where a client reads a file that is too large for the live editor."""
+    return {
+        'reason': 'file_too_large',
+        'size': error.size,
+        'range_url': (
+            reverse('projects:document_range', args=[project_id])
+            + '?path=' + quote(file_path)
+        ),
+    }
 
 
 class EditorConsumer(AsyncWebsocketConsumer):
+    """
+    One WebSocket per open file.
+
+    The live document may be owned by another worker; every frame goes
+    through document_router, which either handles it in-process or forwards
+    it to the owner.  Replies from a remote owner arrive as `editor.reply`.
+
+    Clients that connect with `?compress=zlib` receive large frames (such as
+    the initial sync of a big file) as compressed frames; see compression.py.
+    Clients that pass `?sv=<state vector>` or `?new=1` get the content they
+    are missing in the first frame; see handshake.py.
+
+    Outbound frames go through an OutboundQueue, so a client that cannot
+    keep up is resynced with one diff instead of queueing without bound.
+
+    `?mode=view` connects a read-only spectator: it receives the room's
+    broadcasts through spectator_hub instead of joining the room group, and
+    every frame except sync step 1 is dropped before it is decoded.
+
+    Files of EDITOR_READ_ONLY_MIN_BYTES or more are not opened: the client
+    gets a `read_only` text message pointing at the byte-range endpoint and
+    the socket is closed with READ_ONLY_CLOSE_CODE.
+    Absolute file paths and paths leading out of the repository get an
+    `error` text message and INVALID_PATH_CLOSE_CODE.
+
+    When the file is moved or renamed the connection follows it and the
+    client gets a `moved` text message with the new `file_path`; the
+    socket stays open and the document is not reloaded.
+    """
+
+    channel_layer_alias = EDITOR_CHANNEL_LAYER
 
     async def connect(self):
         self.project_id = self.scope['url_route']['kwargs']['project_id']
-        self.file_path_param = self.scope['url_route']['kwargs']['file_path']
+        self.file_path_param = normalize_file_path(self.scope['url_route']['kwargs']['file_path'])
+        self.joined = False
+        self.outbound = OutboundQueue(self.send_queued, self.resync)
+        self.spectator = is_spectator(self.scope)
+
+        if self.file_path_param is None:
+            await self.accept()
+            await self.send(text_data=json.dumps({'type': 'error', 'message': 'Invalid file path'}))
+            await self.close(code=INVALID_PATH_CLOSE_CODE)
+            return
 
-        self.room_group_name = (
-            f"editor_{self.project_id}_{self.file_path_param.replace('/', '_')}"
-        )
-        self.doc_key = f"{self.project_id}:{self.file_path_param}"
+        self.room_group_name = room_group_name_for(self.project_id, self.file_path_param)
+        self.doc_key = document_key(self.project_id, self.file_path_param)
+        self.compress = negotiate_compression(self.scope)
 
-        await self.channel_layer.group_add(
-            self.room_group_name,
-            self.channel_name
-        )
+        if session_manager.draining:
+            await self.close()
+            return
+
+        try:
+            await check_document_size(self.project_id, self.file_path_param)
+        except DocumentTooLarge as e:
+            await self.accept()
+            await self.reject_read_only(e)
+            return
+
+        document_router.ensure_started()
+
+        if self.spectator:
+            await spectator_hub.add(self.doc_key, self.room_group_name, self)
+        else:
+            await self.channel_layer.group_add(
+                self.room_group_name,
+                self.channel_name
+            )
 
         await self.accept()
 
-        print(f"[WS] Connected: {self.channel_name} → {self.doc_key}")
+        logger.info(
+            'ws.connect', 'Connected',
+            channel=self.channel_name, doc=self.doc_key, spectator=self.spectator,
+        )
 
-        await self.initialize_session()
+        # Join the session and send sync step 1 so the client can advertise
+        # its state vector and receive anything it is missing from the server,
+        # followed by the awareness state of everyone already in the room.
+        # A client that sent its state vector up front gets the missing
+        # update right away instead.
+        state_vector = eager_state_vector(self.scope)
+        try:
+            frames = await document_router.join(
+                self.doc_key,
+                self.project_id,
+                self.file_path_param,
+                self.room_group_name,
+                self.channel_name,
+                state_vector,
+                presence_user(self.scope, self.spectator),
+            )
+        except DocumentTooLarge as e:
+            await self.reject_read_only(e)
+            return
+        self.joined = True
+        for frame in frames:
+            await self.send_frame(frame)
 
-        # Send sync step 1 so the client can advertise its state vector
-        # and receive anything it is missing from the server.
-        if self.doc_key in active_documents:
-            doc = active_documents[self.doc_key]['doc']
-            sync_step1 = pycrdt.create_sync_message(doc)
-            await self.send(bytes_data=sync_step1)
+    async def reject_read_only(self, error):
+        await self.send(text_data=json.dumps({
+            'type': 'read_only',
+            **read_only_fields(self.project_id, self.file_path_param, error),
+        }))
+        await self.close(code=READ_ONLY_CLOSE_CODE)
 
     async def disconnect(self, close_code):
-        print(
-            f"[WS] Disconnected: {self.channel_name} → {self.doc_key} "
-            f"(code: {close_code})"
-        )
-        await self.channel_layer.group_discard(
-            self.room_group_name,
-            self.channel_name
+        if self.file_path_param is None:
+            # Refused in connect() before anything was joined.
+            self.outbound.close()
+            return
+        logger.info(
+            'ws.disconnect', 'Disconnected',
+            channel=self.channel_name, doc=self.doc_key, code=close_code,
         )
-        await self.cleanup_session()
+        self.outbound.close()
+        if self.spectator:
+            await spectator_hub.remove(self.doc_key, self)
+        else:
+            await self.channel_layer.group_discard(
+                self.room_group_name,
+                self.channel_name
+            )
+        if self.joined:
+            await document_router.leave(self.doc_key, self.channel_name)
 
     async def receive(self, text_data=None, bytes_data=None):
         if not bytes_data:
             return
+        frame_type = frame_type_label(bytes_data)
+        FRAMES_IN.inc(type=frame_type)
+        BYTES_IN.inc(len(bytes_data), type=frame_type)
+        if self.spectator and not spectator_frame_allowed(bytes_data):
+            SPECTATOR_FRAMES_REJECTED.inc()
+            return
 
-        message_type = bytes_data[0]
-        payload = bytes_data[1:]
+        if self.compress and bytes_data[0] == Y_COMPRESSED_MESSAGE_TYPE:
+            try:
+                bytes_data = decompress_frame(bytes_data)
+            except Exception as e:
+                logger.warning('ws.bad_frame', 'Dropping bad compressed frame', doc=self.doc_key, error=str(e))
+                return
+            if not bytes_data:
+                return
 
-        if message_type == Y_SYNC_MESSAGE_TYPE:
-            if self.doc_key in active_documents:
-                doc = active_documents[self.doc_key]['doc']
-                # handle_sync_message applies the received update/state-vector
-                # to the doc and returns a reply when needed (e.g. sync step 2).
-                reply = pycrdt.handle_sync_message(payload, doc)
-                if reply:
-                    await self.send(bytes_data=reply)
+        if bytes_data[0] not in (Y_SYNC_MESSAGE_TYPE, Y_AWARENESS_MESSAGE_TYPE):
+            return
 
-        elif message_type == Y_AWARENESS_MESSAGE_TYPE:
-            await self.channel_layer.group_send(
-                self.room_group_name,
-                {
-                    'type': 'awareness_update',
-                    'bytes_data': bytes_data,
-                    'sender_channel': self.channel_name,
-                }
-            )
+        self.outbound.note_client_frame(self.doc_key, bytes_data)
+        reply = await document_router.deliver(
+            self.doc_key, bytes_data, self.channel_name
+        )
+        if reply:
+            await self.send_frame(reply)
+
+    async def send_frame(self, frame, kind=FRAME_REPLY, state_vector=None):
+        self.outbound.put(kind, self.doc_key, frame, state_vector)
+
+    async def send_queued(self, doc_key, frame):
+        if self.compress:
+            frame = await compress_frame(frame)
+        FRAMES_OUT.inc()
+        BYTES_OUT.inc(len(frame))
+        await self.send(bytes_data=frame)
+
+    async def resync(self, doc_key, state_vector):
+        return await document_router.deliver(
+            doc_key, sync_step1_message(state_vector), self.channel_name
+        )
 
     # -------------------------------------------------------------------------
     # Channel layer message handlers
@@ -101,241 +237,295 @@ class EditorConsumer(AsyncWebsocketConsumer):
 
     async def editor_update(self, event):
         if self.channel_name != event.get('sender_channel'):
-            await self.send(bytes_data=event['bytes_data'])
+            await self.send_frame(event['bytes_data'], FRAME_UPDATE, event.get('state_vector'))
 
-    async def awareness_update(self, event):
-        if self.channel_name != event['sender_channel']:
-            await self.send(bytes_data=event['bytes_data'])
+    async def editor_reply(self, event):
+        await self.send_frame(event['bytes_data'])
 
-    # -------------------------------------------------------------------------
-    # Session management
-    # -------------------------------------------------------------------------
+    async def awareness_update(self, event):
+        if self.channel_name != event.get('sender_channel'):
+            await self.send_frame(event['bytes_data'], FRAME_AWARENESS)
 
-    async def initialize_session(self):
-        """
-        Create or join an in-memory document session.
-
-        A per-doc asyncio.Lock prevents two concurrent connections from both
-        finding the session absent and each initialising a separate document.
-        """
-        lock = _session_locks.setdefault(self.doc_key, asyncio.Lock())
-
-        async with lock:
-            if self.doc_key not in active_documents:
-                doc = pycrdt.Doc()
-
-                # --- Restore document state (before registering the observer) ---
-                # Prefer the persisted CRDT binary state because it preserves
-                # the full Yjs document identity.  Falling back to plain text
-                # creates a fresh doc history, which is fine as long as the
-                # frontend always creates a new Y.Doc on connect (which it does).
-                crdt_state = await self.read_crdt_state_from_disk()
-                if crdt_state:
-                    try:
-                        doc.apply_update(crdt_state)
-                        print(f"[WS] Restored CRDT state from disk: {self.doc_key}")
-                    except Exception as e:
-                        print(
-                            f"[WS] CRDT state restore failed ({e}), "
-                            f"falling back to text bootstrap: {self.doc_key}"
-                        )
-                        await self._bootstrap_from_text(doc)
-                else:
-                    await self._bootstrap_from_text(doc)
-
-                # --- Register observer AFTER content is loaded ---
-                # Registering before the initial insert would fire on_update
-                # and broadcast the entire file contents to the room before any
-                # client has completed the sync handshake.
-                room_group_name = self.room_group_name
-                doc_key = self.doc_key
-
-                def on_update(event: pycrdt.TransactionEvent):
-                    update = event.update
-                    message = pycrdt.create_update_message(update)
-                    layer = get_channel_layer()
-
-                    async def _broadcast():
-                        await layer.group_send(
-                            room_group_name,
-                            {
-                                'type': 'editor_update',
-                                'bytes_data': message,
-                                'sender_channel': 'server',
-                            }
-                        )
-
-                    asyncio.create_task(_broadcast())
-                    self.trigger_save()
-
-                subscription = doc.observe(on_update)
-
-                active_documents[self.doc_key] = {
-                    'doc': doc,
-                    'save_task': None,
-                    'users': 1,
-                    'subscription': subscription,
-                    'room_group_name': self.room_group_name,
-                }
-                print(f"[WS] New session created: {self.doc_key}")
-            else:
-                active_documents[self.doc_key]['users'] += 1
-                count = active_documents[self.doc_key]['users']
-                print(f"[WS] Joined existing session: {self.doc_key} (users: {count})")
-
-    async def _bootstrap_from_text(self, doc: pycrdt.Doc):
-        """Load file content from disk and insert it into a fresh Yjs doc."""
-        content = await self.read_file_from_disk()
-        if content:
-            text = doc.get('monaco', type=pycrdt.Text)
-            text.insert(0, content)
-            print(f"[WS] Bootstrapped from text: {self.doc_key}")
-
-    async def cleanup_session(self):
-        if self.doc_key not in active_documents:
+    async def document_moved(self, event):
+        """The file was moved or renamed (see DocumentSessionManager.move)."""
+        if event['old_doc_key'] != self.doc_key:
             return
+        old_key, old_room = self.doc_key, self.room_group_name
+        self.doc_key = event['doc_key']
+        self.file_path_param = event['file_path']
+        self.room_group_name = event['room_group_name']
+        self.outbound.rename(old_key, self.doc_key)
+        if not self.spectator:
+            # spectator_hub moves spectators itself.
+            await self.channel_layer.group_add(self.room_group_name, self.channel_name)
+            await self.channel_layer.group_discard(old_room, self.channel_name)
+        await self.send(text_data=json.dumps({'type': 'moved', 'file_path': self.file_path_param}))
+
+        state_vector = self.outbound.state_vectors.get(self.doc_key)
+        if event['rejoin'] and self.joined:
+            await document_router.leave(old_key, self.channel_name)
+            frames = await document_router.join(
+                self.doc_key,
+                self.project_id,
+                self.file_path_param,
+                self.room_group_name,
+                self.channel_name,
+                state_vector,
+                presence_user(self.scope, self.spectator),
+            )
+            for frame in frames:
+                await self.send_frame(frame)
+        else:
+            reply = await self.resync(self.doc_key, state_vector or EMPTY_STATE_VECTOR)
+            if reply:
+                await self.send_frame(reply)
+
+
+class ProjectConsumer(AsyncWebsocketConsumer):
+    """
+    One WebSocket per project, multiplexing every file the client has open.
+
+    Control messages are JSON text frames:
+        {"type": "subscribe", "doc": <id>, "file_path": "<path>"}
+        {"type": "unsubscribe", "doc": <id>}
+    answered with "subscribed" / "unsubscribed" / "error" messages carrying
+    the same `doc` id.  A "moved" message with the new `file_path` tells
+    the client that a subscribed file was moved or renamed; the
+    subscription follows it under the same id.  The id is a small integer chosen by the client.
+    A subscribe may carry "sv" (base64 state vector) or "new": true for the
+    one-round-trip handshake of the per-file endpoint.  Files too large for
+    live editing are refused with an "error" carrying `read_only` and the
+    byte-range URL.
+
+    Sync and awareness frames are binary: a varuint doc id followed by the
+    y-protocol message, in both directions.  Each subscription joins the
+    document exactly as an EditorConsumer would, so both kinds of client
+    can edit the same file together.  `?compress=zlib` compresses large
+    y-protocol messages after the doc id, as on the per-file endpoint.
+
+    "presence" messages (`doc` null) list who has which file of the project
+    open as {"files": {<path>: [user, ...]}}: the whole project right after
+    connecting (with "full": true), then only the files that changed.
+    """
+
+    channel_layer_alias = EDITOR_CHANNEL_LAYER
 
-        active_documents[self.doc_key]['users'] -= 1
-        remaining = active_documents[self.doc_key]['users']
-        print(f"[WS] Users remaining for {self.doc_key}: {remaining}")
-
-        if remaining > 0:
+    async def connect(self):
+        self.project_id = self.scope['url_route']['kwargs']['project_id']
+        # doc id -> (doc_key, file_path, room_group_name)
+        self.subscriptions = {}
+        # doc_key -> doc id, to route room events back to their sub-channel
+        self.doc_ids = {}
+        self.compress = negotiate_compression(self.scope)
+        self.outbound = OutboundQueue(self.send_queued, self.resync)
+
+        if session_manager.draining:
+            await self.close()
             return
 
-        # Last user left — persist and release.
-        session = active_documents[self.doc_key]
-        doc = session['doc']
-        doc.unobserve(session['subscription'])
-
-        # Cancel the pending debounced save so we can do an immediate one.
-        save_task = session.get('save_task')
-        if save_task and not save_task.done():
-            save_task.cancel()
-            try:
-                await save_task
-            except (asyncio.CancelledError, Exception):
-                pass
+        document_router.ensure_started()
+        await self.channel_layer.group_add(presence_group_name(self.project_id), self.channel_name)
+        await self.accept()
 
-        # Force a final save to ensure nothing is lost.
-        await self.save_to_disk_immediate()
+        logger.info('ws.connect', 'Connected', channel=self.channel_name, project=self.project_id)
+        await self.send_control(
+            'presence', None, full=True,
+            files=session_manager.presence.snapshot(self.project_id),
+        )
 
-        del active_documents[self.doc_key]
-        # Remove the lock so memory doesn't grow indefinitely for abandoned keys.
-        _session_locks.pop(self.doc_key, None)
-        print(f"[WS] Session ended: {self.doc_key}")
+    async def disconnect(self, close_code):
+        logger.info(
+            'ws.disconnect', 'Disconnected',
+            channel=self.channel_name, project=self.project_id,
+            documents=len(self.subscriptions), code=close_code,
+        )
+        self.outbound.close()
+        await self.channel_layer.group_discard(presence_group_name(self.project_id), self.channel_name)
+        for doc_id in list(self.subscriptions):
+            await self.unsubscribe(doc_id)
 
-    # -------------------------------------------------------------------------
-    # Disk I/O helpers
-    # -------------------------------------------------------------------------
+    async def receive(self, text_data=None, bytes_data=None):
+        if text_data:
+            await self.receive_control(text_data)
+            return
+        if not bytes_data:
+            return
 
-    @sync_to_async
-    def get_full_path(self):
         try:
+            decoder = pycrdt.Decoder(bytes_data)
+            doc_id = decoder.read_var_uint()
+            frame = bytes_data[decoder.i0:]
+        except Exception:
+            return
+        subscription = self.subscriptions.get(doc_id)
+        if subscription is None or not frame:
+            return
+        frame_type = frame_type_label(frame)
+        FRAMES_IN.inc(type=frame_type)
+        BYTES_IN.inc(len(bytes_data), type=frame_type)
+        if self.compress and frame[0] == Y_COMPRESSED_MESSAGE_TYPE:
             try:
-                project_oid = ObjectId(self.project_id)
-            except Exception:
-                project_oid = self.project_id
-
-            repo = Repository.objects.filter(project_id=project_oid).first()
-            if repo and repo.root_path:
-                return os.path.join(repo.root_path, self.file_path_param)
-        except Exception as e:
-            print(f"[WS] Error resolving path: {e}")
-        return None
-
-    async def read_file_from_disk(self) -> str:
-        full_path = await self.get_full_path()
-        if full_path and os.path.exists(full_path):
-            try:
-                def _read():
-                    with open(full_path, 'r', encoding='utf-8') as f:
-                        return f.read()
-                return await asyncio.to_thread(_read)
+                frame = decompress_frame(frame)
             except Exception as e:
-                print(f"[WS] Error reading file: {e}")
-        return ""
-
-    async def read_crdt_state_from_disk(self):
-        """
-        Read the persisted Yjs binary state from the companion .ystate file.
-        Returns raw bytes or None if the file does not exist / cannot be read.
-        """
-        full_path = await self.get_full_path()
-        if not full_path:
-            return None
-
-        state_path = full_path + '.ystate'
-        if not os.path.exists(state_path):
-            return None
+                logger.warning('ws.bad_frame', 'Dropping bad compressed frame', doc=subscription[0], error=str(e))
+                return
+            if not frame:
+                return
+        if frame[0] not in (Y_SYNC_MESSAGE_TYPE, Y_AWARENESS_MESSAGE_TYPE):
+            return
 
-        try:
-            def _read():
-                with open(state_path, 'rb') as f:
-                    return f.read()
-            data = await asyncio.to_thread(_read)
-            return data if data else None
-        except Exception as e:
-            print(f"[WS] Error reading CRDT state file: {e}")
-            return None
+        self.outbound.note_client_frame(subscription[0], frame)
+        reply = await document_router.deliver(
+            subscription[0], frame, self.channel_name
+        )
+        if reply:
+            await self.send_frame(subscription[0], reply)
 
-    # -------------------------------------------------------------------------
-    # Save / debounce
-    # -------------------------------------------------------------------------
+    async def receive_control(self, text_data):
+        try:
+            message = json.loads(text_data)
+            action = message['type']
+            doc_id = message['doc']
+        except (ValueError, TypeError, KeyError):
+            await self.send_control('error', None, message='Malformed control message')
+            return
+        if not isinstance(doc_id, int) or isinstance(doc_id, bool) or doc_id < 0:
+            await self.send_control('error', None, message='Invalid doc id')
+            return
 
-    def trigger_save(self):
-        session = active_documents.get(self.doc_key)
-        if not session:
+        if action == 'subscribe':
+            state_vector = decode_state_vector(message.get('sv'))
+            if state_vector is None and message.get('new') is True:
+                state_vector = EMPTY_STATE_VECTOR
+            await self.subscribe(doc_id, message.get('file_path'), state_vector)
+        elif action == 'unsubscribe':
+            if doc_id in self.subscriptions:
+                await self.unsubscribe(doc_id)
+            await self.send_control('unsubscribed', doc_id)
+        else:
+            await self.send_control('error', doc_id, message=f'Unknown type: {action}')
+
+    async def subscribe(self, doc_id, file_path, state_vector=None):
+        if not isinstance(file_path, str) or not file_path:
+            await self.send_control('error', doc_id, message='file_path is required')
+            return
+        file_path = normalize_file_path(file_path)
+        if file_path is None:
+            await self.send_control('error', doc_id, message='Invalid file_path')
+            return
+        if doc_id in self.subscriptions:
+            await self.send_control('error', doc_id, message='Doc id already in use')
+            return
+        doc_key = document_key(self.project_id, file_path)
+        if doc_key in self.doc_ids:
+            await self.send_control('error', doc_id, message='File already subscribed')
+            return
+        try:
+            await check_document_size(self.project_id, file_path)
+        except DocumentTooLarge as e:
+            await self.send_read_only(doc_id, file_path, e)
             return
 
-        existing = session.get('save_task')
-        if existing and not existing.done():
-            existing.cancel()
+        room_group_name = room_group_name_for(self.project_id, file_path)
+        self.subscriptions[doc_id] = (doc_key, file_path, room_group_name)
+        self.doc_ids[doc_key] = doc_id
+        await self.channel_layer.group_add(room_group_name, self.channel_name)
 
-        session['save_task'] = asyncio.create_task(
-            self.save_to_disk_debounced()
+        try:
+            frames = await document_router.join(
+                doc_key, self.project_id, file_path, room_group_name, self.channel_name,
+                state_vector, presence_user(self.scope),
+            )
+        except DocumentTooLarge as e:
+            del self.subscriptions[doc_id]
+            self.doc_ids.pop(doc_key, None)
+            await self.channel_layer.group_discard(room_group_name, self.channel_name)
+            await self.send_read_only(doc_id, file_path, e)
+            return
+        await self.send_control('subscribed', doc_id, file_path=file_path)
+        for frame in frames:
+            await self.send_frame(doc_key, frame)
+
+    async def unsubscribe(self, doc_id):
+        doc_key, _, room_group_name = self.subscriptions.pop(doc_id)
+        self.doc_ids.pop(doc_key, None)
+        self.outbound.forget(doc_key)
+        await self.channel_layer.group_discard(room_group_name, self.channel_name)
+        await document_router.leave(doc_key, self.channel_name)
+
+    async def send_frame(self, doc_key, frame, kind=FRAME_REPLY, state_vector=None):
+        self.outbound.put(kind, doc_key, frame, state_vector)
+
+    async def send_queued(self, doc_key, frame):
+        doc_id = self.doc_ids.get(doc_key)
+        if doc_id is None:
+            return
+        if self.compress:
+            frame = await compress_frame(frame)
+        frame = pycrdt.write_var_uint(doc_id) + frame
+        FRAMES_OUT.inc()
+        BYTES_OUT.inc(len(frame))
+        await self.send(bytes_data=frame)
+
+    async def resync(self, doc_key, state_vector):
+        return await document_router.deliver(
+            doc_key, sync_step1_message(state_vector), self.channel_name
         )
 
-    async def save_to_disk_debounced(self):
-        try:
-            await asyncio.sleep(2)
-            await self.save_to_disk_immediate()
-        except asyncio.CancelledError:
-            pass
-        except Exception as e:
-            print(f"[WS] Error in debounced save: {e}")
-
-    async def save_to_disk_immediate(self):
-        try:
-            session = active_documents.get(self.doc_key)
-            if not session:
-                return
+    async def send_read_only(self, doc_id, file_path, error):
+        await self.send_control(
+            'error', doc_id, message=str(error), read_only=True,
+            **read_only_fields(self.project_id, file_path, error),
+        )
 
-            doc = session['doc']
-            text = doc.get('monaco', type=pycrdt.Text)
-            text_content = str(text)
+    async def send_control(self, message_type, doc_id, **fields):
+        await self.send(text_data=json.dumps({'type': message_type, 'doc': doc_id, **fields}))
 
-            full_path = await self.get_full_path()
-            if not full_path:
-                return
+    # -------------------------------------------------------------------------
+    # Channel layer message handlers
+    # -------------------------------------------------------------------------
+
+    async def forward_event(self, event, kind):
+        doc_key = event.get('doc_key')
+        if doc_key in self.doc_ids and self.channel_name != event.get('sender_channel'):
+            await self.send_frame(doc_key, event['bytes_data'], kind, event.get('state_vector'))
+
+    async def editor_update(self, event):
+        await self.forward_event(event, FRAME_UPDATE)
 
-            def _write():
-                os.makedirs(os.path.dirname(full_path), exist_ok=True)
-
-                # Persist the human-readable text file (for git, plain access, etc.)
-                with open(full_path, 'w', encoding='utf-8') as f:
-                    f.write(text_content)
-
-                # Persist the Yjs binary state so that reconnecting clients
-                # share the same document identity and history, enabling
-                # clean CRDT merge instead of re-bootstrapping from text.
-                try:
-                    state = doc.get_update()
-                    with open(full_path + '.ystate', 'wb') as f:
-                        f.write(state)
-                except Exception as e:
-                    print(f"[WS] Warning: could not save CRDT state: {e}")
-
-            await asyncio.to_thread(_write)
-            print(f"[WS] Saved: {full_path}")
-        except Exception as e:
-            print(f"[WS] Error saving file: {e}")
+    async def editor_reply(self, event):
+        await self.forward_event(event, FRAME_REPLY)
+
+    async def awareness_update(self, event):
+        await self.forward_event(event, FRAME_AWARENESS)
+
+    async def presence_update(self, event):
+        await self.send_control('presence', None, files=event['files'])
+
+    async def document_moved(self, event):
+        """A subscribed file was moved or renamed (see DocumentSessionManager.move)."""
+        doc_id = self.doc_ids.pop(event['old_doc_key'], None)
+        if doc_id is None:
+            return
+        old_key, _, old_room = self.subscriptions[doc_id]
+        doc_key, file_path, room_group_name = event['doc_key'], event['file_path'], event['room_group_name']
+        self.subscriptions[doc_id] = (doc_key, file_path, room_group_name)
+        self.doc_ids[doc_key] = doc_id
+        self.outbound.rename(old_key, doc_key)
+        await self.channel_layer.group_add(room_group_name, self.channel_name)
+        await self.channel_layer.group_discard(old_room, self.channel_name)
+        await self.send_control('moved', doc_id, file_path=file_path)
+
+        state_vector = self.outbound.state_vectors.get(doc_key)
+        if event['rejoin']:
+            await document_router.leave(old_key, self.channel_name)
+            frames = await document_router.join(
+                doc_key, self.project_id, file_path, room_group_name, self.channel_name,
+                state_vector, presence_user(self.scope),
+            )
+            for frame in frames:
+                await self.send_frame(doc_key, frame)
+        else:
+            reply = await self.resync(doc_key, state_vector or EMPTY_STATE_VECTOR)
+            if reply:
+                await self.send_frame(doc_key, reply)
@@ -0,0 +1,303 @@
+import asyncio
+import hashlib
+from channels.layers import get_channel_layer
+from django.conf import settings
+from sagile_ide.log import get_logger
+from . import sessions
+from .presence import PRESENCE_REFRESH_SECONDS
+from .sessions import Y_SYNC_MESSAGE_TYPE, Y_AWARENESS_MESSAGE_TYPE
+from .trace import trace_recorder
+
+logger = get_logger(__name__)
+
+
+class DocumentRouter:
+    """
+    Document ownership across ASGI workers.
+
+    Every doc_key hashes to exactly one owner worker, which is the only
+    process holding the live pycrdt.Doc in `sessions.active_documents`.
+    Consumers on any other worker forward their sync and awareness frames to
+    the owner's channel on EDITOR_CHANNEL_LAYER; the owner replies on the
+    consumer's own channel.  Room broadcasts already reach every worker
+    because room groups live on the same shared layer.
+
+    Each worker's presence entries (sessions.session_manager.presence) are
+    sent to every other worker's owner channel as `presence.shard` messages,
+    so each of them can list who is in which file of a project.
+
+    With EDITOR_WORKER_COUNT = 1 (the default) every document is local and
+    no frame ever leaves the process.
+    """
+
+    def __init__(self, worker_id=None, worker_count=None, layer_alias=None):
+        self.worker_id = int(
+            worker_id if worker_id is not None
+            else getattr(settings, 'EDITOR_WORKER_ID', 0)
+        )
+        self.worker_count = max(1, int(
+            worker_count if worker_count is not None
+            else getattr(settings, 'EDITOR_WORKER_COUNT', 1)
+        ))
+        self.layer_alias = layer_alias or sessions.EDITOR_CHANNEL_LAYER
+        self._listener = None
+        self._presence_refresher = None
+        # Per-doc locks keep owner-side handling of one document in arrival
+        # order while different documents are processed concurrently.
+        # doc_key -> [lock, dispatches holding or waiting for it]
+        self._route_locks = {}
+
+    # -------------------------------------------------------------------------
+    # Ownership
+    # -------------------------------------------------------------------------
+
+    def owner_of(self, doc_key) -> int:
+        """Stable owner worker index for a document key."""
+        if self.worker_count == 1:
+            return 0
+        digest = hashlib.sha1(doc_key.encode('utf-8')).digest()
+        return int.from_bytes(digest[:8], 'big') % self.worker_count
+
+    def is_local(self, doc_key) -> bool:
+        return self.owner_of(doc_key) == self.worker_id
+
+    @staticmethod
+    def owner_channel(worker_id) -> str:
+        return f"editor-owner.{worker_id}"
+
+    @property
+    def layer(self):
+        return get_channel_layer(self.layer_alias)
+
+    # -------------------------------------------------------------------------
+    # Client-facing API (used by consumers on any worker)
+    # -------------------------------------------------------------------------
+
+    async def join(self, doc_key, project_id, file_path, room_group_name, reply_channel,
+                   state_vector=None, user=None):
+        """
+        Attach a client to a document.  Returns the initial frames (sync step 1,
+        or the missing update when the client sent its `state_vector`, and
+        current awareness) when the document is local; for remote documents
+        the owner sends them to `reply_channel` as `editor.reply` messages
+        and an empty list is returned.  `user` is the client's presence
+        entry (presence.presence_user).
+        """
+        if self.is_local(doc_key):
+            session = await sessions.session_manager.join(
+                doc_key, project_id, file_path, room_group_name, reply_channel, user
+            )
+            return session.initial_frames(state_vector)
+
+        await self._send_to_owner(doc_key, {
+            'type': 'doc.join',
+            'doc_key': doc_key,
+            'project_id': project_id,
+            'file_path': file_path,
+            'room_group_name': room_group_name,
+            'reply_channel': reply_channel,
+            'state_vector': state_vector,
+            'user': user,
+        })
+        return []
+
+    async def leave(self, doc_key, reply_channel):
+        if self.is_local(doc_key):
+            await sessions.session_manager.leave(doc_key, reply_channel)
+            return
+
+        await self._send_to_owner(doc_key, {
+            'type': 'doc.leave',
+            'doc_key': doc_key,
+            'reply_channel': reply_channel,
+        })
+
+    async def deliver(self, doc_key, bytes_data, reply_channel):
+        """
+        Hand an inbound client frame to the document owner.  Returns the reply
+        frame for local documents (None if there is nothing to answer).
+        """
+        if self.is_local(doc_key):
+            return await self._handle_frame(doc_key, bytes_data, reply_channel)
+
+        await self._send_to_owner(doc_key, {
+            'type': 'doc.frame',
+            'doc_key': doc_key,
+            'bytes_data': bytes_data,
+            'reply_channel': reply_channel,
+        })
+        return None
+
+    async def reconcile(self, doc_key):
+        """Have the owner merge the document's file after it changed on disk."""
+        if self.is_local(doc_key):
+            session = sessions.session_manager.session_for(doc_key)
+            if session:
+                await session.reconcile_with_disk()
+            return
+
+        await self._send_to_owner(doc_key, {
+            'type': 'doc.reconcile',
+            'doc_key': doc_key,
+            'reply_channel': None,
+        })
+
+    async def move(self, project_id, old_path, new_path, move_files=None):
+        """
+        Move a file or folder on disk (`move_files`, blocking) and re-key the
+        live sessions under it (see DocumentSessionManager.move).  Sessions
+        are only known to their owners, so every other worker is asked to
+        follow the move as well once the files are in place.
+        """
+        moved = await sessions.session_manager.move(
+            project_id, old_path, new_path, move_files, self.is_local
+        )
+        for worker_id in range(self.worker_count):
+            if worker_id != self.worker_id:
+                await self.layer.send(self.owner_channel(worker_id), {
+                    'type': 'doc.move',
+                    'doc_key': sessions.document_key(project_id, old_path),
+                    'project_id': str(project_id),
+                    'old_path': old_path,
+                    'new_path': new_path,
+                    'reply_channel': None,
+                })
+        return moved
+
+    async def _send_to_owner(self, doc_key, message):
+        await self.layer.send(self.owner_channel(self.owner_of(doc_key)), message)
+
+    async def replicate_presence(self, project_id, files):
+        """Send this worker's presence entries of a project to the other workers."""
+        for worker_id in range(self.worker_count):
+            if worker_id != self.worker_id:
+                await self.layer.send(self.owner_channel(worker_id), {
+                    'type': 'presence.shard',
+                    'worker_id': self.worker_id,
+                    'project_id': project_id,
+                    'files': files,
+                })
+
+    async def _refresh_presence_forever(self):
+        # Covers lost messages and drops workers that went away: their
+        # entries expire once they stop refreshing them.
+        while True:
+            await asyncio.sleep(PRESENCE_REFRESH_SECONDS)
+            try:
+                await sessions.session_manager.presence.refresh()
+            except Exception:
+                logger.exception('presence.error', 'Error refreshing presence')
+
+    # -------------------------------------------------------------------------
+    # Owner side
+    # -------------------------------------------------------------------------
+
+    async def _handle_frame(self, doc_key, bytes_data, reply_channel):
+        message_type = bytes_data[0]
+        payload = bytes_data[1:]
+
+        if message_type == Y_SYNC_MESSAGE_TYPE:
+            if sessions.session_manager.draining:
+                # Shutting down: the client pushes these edits again to the
+                # worker it reconnects to.
+                return None
+            session = sessions.session_manager.session_for(doc_key)
+            if session:
+                if trace_recorder.enabled:
+                    await session.ensure_loaded()
+                    trace_recorder.record_frame(session, reply_channel, bytes_data)
+                # handle_sync_message applies the received update/state-vector
+                # to the doc and returns a reply when needed (e.g. sync step 2).
+                return await session.handle_sync_message(payload)
+
+        elif message_type == Y_AWARENESS_MESSAGE_TYPE:
+            session = sessions.session_manager.session_for(doc_key)
+            if session:
+                # Awareness is merged server-side and fanned out in batches
+                # by the session's AwarenessStore, never relayed per frame.
+                session.handle_awareness_message(payload, reply_channel)
+        return None
+
+    def ensure_started(self):
+        """Start listening on this worker's owner channel (idempotent)."""
+        if self.worker_count == 1:
+            return
+        loop = asyncio.get_running_loop()
+        if self._listener is None or self._listener.done():
+            self._listener = loop.create_task(self._listen())
+        if self._presence_refresher is None or self._presence_refresher.done():
+            sessions.session_manager.presence.replicate = self.replicate_presence
+            self._presence_refresher = loop.create_task(self._refresh_presence_forever())
+
+    async def _listen(self):
+        channel = self.owner_channel(self.worker_id)
+        logger.info(
+            'router.listening', 'Listening for forwarded frames',
+            worker=self.worker_id, workers=self.worker_count, channel=channel,
+        )
+        while True:
+            message = await self.layer.receive(channel)
+            if message['type'] == 'presence.shard':
+                sessions.session_manager.presence.apply_remote(
+                    message['worker_id'], message['project_id'], message['files']
+                )
+                continue
+            asyncio.create_task(self._dispatch(message))
+
+    async def _dispatch(self, message):
+        doc_key = message['doc_key']
+        reply_channel = message['reply_channel']
+        # Taken before the first await, so dispatches queue on the lock in
+        # the order their messages arrived.
+        entry = self._route_locks.setdefault(doc_key, [asyncio.Lock(), 0])
+        entry[1] += 1
+        lock = entry[0]
+        try:
+            async with lock:
+                msg_type = message['type']
+                if msg_type == 'doc.join':
+                    session = await sessions.session_manager.join(
+                        doc_key,
+                        message['project_id'],
+                        message['file_path'],
+                        message['room_group_name'],
+                        reply_channel,
+                        message.get('user'),
+                    )
+                    replies = session.initial_frames(message.get('state_vector'))
+                elif msg_type == 'doc.leave':
+                    await sessions.session_manager.leave(doc_key, reply_channel)
+                    replies = []
+                elif msg_type == 'doc.move':
+                    await sessions.session_manager.move(
+                        message['project_id'], message['old_path'], message['new_path'],
+                        is_local=self.is_local,
+                    )
+                    replies = []
+                elif msg_type == 'doc.reconcile':
+                    await self.reconcile(doc_key)
+                    replies = []
+                else:
+                    reply = await self._handle_frame(
+                        doc_key, message['bytes_data'], reply_channel
+                    )
+                    replies = [reply] if reply else []
+
+                for reply in replies:
+                    await self.layer.send(reply_channel, {
+                        'type': 'editor.reply',
+                        'doc_key': doc_key,
+                        'bytes_data': reply,
+                    })
+        except Exception:
+            logger.exception('router.error', 'Error handling forwarded frame', doc=doc_key)
+        finally:
+            # Forget the lock only once no dispatch holds or awaits it: a
+            # fresh lock next to queued waiters would break the ordering.
+            entry[1] -= 1
+            if not entry[1]:
+                self._route_locks.pop(doc_key, None)
+
+
+# Global instance
+document_router = DocumentRouter()
@@ -0,0 +1,190 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from sagile_ide.log import get_logger
+from .metrics import BYTES_WRITTEN, FLUSH_SECONDS, SAVE_FAILURES, SAVES, metrics
+
+logger = get_logger(__name__)
+
+
+class WriteBehindFlusher:
+    """
+    One write-behind queue for every live document in the process.
+
+    Sessions mark themselves dirty on each update.  A document is flushed
+    once it has been quiet for `debounce` seconds, or at the latest
+    `max_staleness` seconds after it first became dirty, so a file under
+    continuous typing still reaches disk regularly.  Due documents are
+    written concurrently, each under its own write lock only, on a bounded
+    thread pool, which caps disk concurrency at `max_workers` regardless of
+    how many documents are open.
+
+    Sessions provide `write_lock`, `prepare_save()` (on the event loop,
+    returns a job with a blocking `write()` and an `is_noop` flag, or None)
+    and `finish_save(job, result)`.  No-op jobs never reach the executor.
+    A failed write is queued again via `retry()`, after a delay that doubles
+    with each consecutive failure up to `retry_max` seconds.
+    """
+
+    def __init__(self, debounce, max_staleness, max_workers, retry_max=60):
+        self.debounce = debounce
+        self.max_staleness = max_staleness
+        self.max_workers = max_workers
+        self.retry_max = retry_max
+        self.executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix='editor-flush'
+        )
+        # doc_key -> [session, first_dirty, last_dirty, not_before]
+        self._dirty = {}
+        self._task = None
+        self.flushes = 0
+        self.documents_written = 0
+        self.retries = 0
+        # Parts of a flush left out because they had not changed.
+        self.skipped_text_writes = 0
+        self.skipped_crdt_writes = 0
+        self.skipped_flushes = 0
+        self.last_flush_seconds = 0.0
+        self.max_flush_seconds = 0.0
+        self.total_flush_seconds = 0.0
+        self.max_dirty_age_seconds = 0.0
+
+    @property
+    def queue_depth(self) -> int:
+        return len(self._dirty)
+
+    def mark_dirty(self, session):
+        now = time.monotonic()
+        entry = self._dirty.get(session.doc_key)
+        if entry is None:
+            self._dirty[session.doc_key] = [session, now, now, 0.0]
+        else:
+            entry[2] = now
+        self._ensure_running()
+
+    def retry(self, session, failures):
+        """Queue a session whose write failed `failures` times in a row."""
+        delay = min(self.retry_max, self.debounce * 2 ** (failures - 1))
+        now = time.monotonic()
+        entry = self._dirty.setdefault(session.doc_key, [session, now, now, 0.0])
+        # Edits made meanwhile do not shorten the backoff.
+        entry[3] = max(entry[3], now + delay)
+        self.retries += 1
+        self._ensure_running()
+
+    def _ensure_running(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    def rekey(self, session, old_key):
+        """Carry a pending flush over to the session's new doc_key."""
+        entry = self._dirty.pop(old_key, None)
+        if entry is not None:
+            self._dirty[session.doc_key] = entry
+
+    def discard(self, session):
+        """Forget a pending flush (the caller is about to flush directly)."""
+        self._dirty.pop(session.doc_key, None)
+
+    async def _run(self):
+        tick = max(0.05, min(self.debounce, self.max_staleness) / 4)
+        while self._dirty:
+            await asyncio.sleep(tick)
+            now = time.monotonic()
+            due = []
+            for doc_key, (session, first_dirty, last_dirty, not_before) in list(self._dirty.items()):
+                if now < not_before:
+                    continue
+                if now - last_dirty >= self.debounce or now - first_dirty >= self.max_staleness:
+                    del self._dirty[doc_key]
+                    self.max_dirty_age_seconds = max(
+                        self.max_dirty_age_seconds, now - first_dirty
+                    )
+                    due.append(session)
+            if due:
+                try:
+                    await self.flush(due)
+                except Exception:
+                    logger.exception('flush.error', 'Error in write-behind flush')
+
+    async def flush(self, sessions):
+        """Write the given sessions now, concurrently on the I/O executor."""
+        started = time.monotonic()
+        results = await asyncio.gather(
+            *(self._flush_one(session) for session in sessions), return_exceptions=True
+        )
+        for session, result in zip(sessions, results):
+            if isinstance(result, Exception):
+                logger.error('flush.error', 'Error flushing document', doc=session.doc_key, error=str(result))
+
+        elapsed = time.monotonic() - started
+        self.flushes += 1
+        self.last_flush_seconds = elapsed
+        self.max_flush_seconds = max(self.max_flush_seconds, elapsed)
+        self.total_flush_seconds += elapsed
+        FLUSH_SECONDS.observe(elapsed)
+
+    async def _flush_one(self, session):
+        # Only this session's lock is held, and only for its own write:
+        # move() takes several write locks at once, so waiting for one lock
+        # while holding another could deadlock against it.
+        async with session.write_lock:
+            try:
+                job = await session.prepare_save()
+            except Exception:
+                logger.exception('flush.prepare_error', 'Error preparing save', doc=session.doc_key)
+                return
+            if job is None:
+                return
+            self.skipped_text_writes += job.text_content is None
+            self.skipped_crdt_writes += job.update is None
+            if job.is_noop:
+                self.skipped_flushes += 1
+                session.finish_save(job, None)
+                return
+
+            try:
+                result = await asyncio.get_running_loop().run_in_executor(self.executor, job.write)
+            except Exception as e:
+                result = e
+            if isinstance(result, Exception):
+                SAVE_FAILURES.inc()
+            else:
+                SAVES.inc()
+                BYTES_WRITTEN.inc(job.text_bytes, kind='text')
+                BYTES_WRITTEN.inc(job.crdt_bytes, kind='crdt')
+            self.documents_written += 1
+            session.finish_save(job, result)
+
+    async def flush_now(self, session):
+        self.discard(session)
+        await self.flush([session])
+
+    def stats(self) -> dict:
+        return {
+            'queue_depth': self.queue_depth,
+            'debounce_seconds': self.debounce,
+            'max_staleness_seconds': self.max_staleness,
+            'io_workers': self.max_workers,
+            'flushes': self.flushes,
+            'documents_written': self.documents_written,
+            'retries': self.retries,
+            'skipped_text_writes': self.skipped_text_writes,
+            'skipped_crdt_writes': self.skipped_crdt_writes,
+            'skipped_flushes': self.skipped_flushes,
+            'last_flush_seconds': self.last_flush_seconds,
+            'max_flush_seconds': self.max_flush_seconds,
+            'avg_flush_seconds': self.total_flush_seconds / self.flushes if self.flushes else 0.0,
+            'max_dirty_age_seconds': self.max_dirty_age_seconds,
+        }
+
+
+# Global instance
+write_behind_flusher = WriteBehindFlusher(
+    debounce=getattr(settings, 'EDITOR_SAVE_DEBOUNCE_SECONDS', 2),
+    max_staleness=getattr(settings, 'EDITOR_SAVE_MAX_STALENESS_SECONDS', 10),
+    max_workers=getattr(settings, 'EDITOR_FLUSH_IO_WORKERS', 4),
+    retry_max=getattr(settings, 'EDITOR_SAVE_RETRY_MAX_SECONDS', 60),
+)
+metrics.register_stats('editor_flusher', write_behind_flusher.stats)
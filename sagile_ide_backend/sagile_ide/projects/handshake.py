@@ -0,0 +1,36 @@
+import base64
+import binascii
+from urllib.parse import parse_qs
+
+# State vector of an empty document: a client that knows nothing.
+EMPTY_STATE_VECTOR = b'\x00'
+
+
+def decode_state_vector(value):
+    """Decode a base64/base64url state vector (padding optional), else None."""
+    if not isinstance(value, str) or not value:
+        return None
+    value = value.replace('+', '-').replace('/', '_')
+    try:
+        return base64.urlsafe_b64decode(value + '=' * (-len(value) % 4))
+    except (binascii.Error, ValueError):
+        return None
+
+
+def eager_state_vector(scope):
+    """
+    State vector a client sent with its connection request, if any.
+
+    `?new=1` means the client has no content (empty state vector) and
+    `?sv=<base64url>` carries the client's Y.encodeStateVector().  With
+    either, the server answers with the missing update in its first frame
+    instead of waiting for the client's sync step 1; without them the
+    regular two-step handshake is used.
+    """
+    query = parse_qs(scope.get('query_string', b'').decode('latin-1'))
+    state_vector = decode_state_vector(query.get('sv', [None])[0])
+    if state_vector is not None:
+        return state_vector
+    if query.get('new', [''])[0] in ('1', 'true'):
+        return EMPTY_STATE_VECTOR
+    return None
@@ -0,0 +1,74 @@
+import os
+import struct
+import pycrdt
+from .update_log import YHIST_SUFFIX
+
+# Record: timestamp (unix seconds), kind, payload length, then the payload.
+_RECORD_HEADER = struct.Struct('>dBI')
+_DELTA = 0
+_KEYFRAME = 1
+
+
+class DocumentHistory:
+    """
+    Version snapshots of one document, kept in its .yhist sidecar.
+
+    Each snapshot is a Yjs update: either a keyframe (the whole document) or
+    a delta holding only what changed since the previous snapshot.  The
+    version at index N is rebuilt by replaying the closest keyframe at or
+    before N and the deltas after it, so the cost of reading any version is
+    bounded by the keyframe spacing rather than by the length of the history.
+    This only reads the sidecar; the live session is never involved.
+
+    All methods do blocking file I/O.
+    """
+
+    def __init__(self, full_path):
+        self.path = full_path + YHIST_SUFFIX
+
+    def append(self, timestamp, update, keyframe):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with open(self.path, 'ab') as f:
+            f.write(_RECORD_HEADER.pack(timestamp, _KEYFRAME if keyframe else _DELTA, len(update)))
+            f.write(update)
+
+    def index(self):
+        """(timestamp, is_keyframe, offset, length) of every complete record."""
+        entries = []
+        try:
+            size = os.path.getsize(self.path)
+        except OSError:
+            return entries
+        with open(self.path, 'rb') as f:
+            offset = 0
+            while offset + _RECORD_HEADER.size <= size:
+                f.seek(offset)
+                timestamp, kind, length = _RECORD_HEADER.unpack(f.read(_RECORD_HEADER.size))
+                start = offset + _RECORD_HEADER.size
+                if start + length > size:
+                    break
+                entries.append((timestamp, kind == _KEYFRAME, start, length))
+                offset = start + length
+        return entries
+
+    def versions(self):
+        return [
+            {'version': i, 'timestamp': timestamp, 'keyframe': keyframe, 'bytes': length}
+            for i, (timestamp, keyframe, _, length) in enumerate(self.index())
+        ]
+
+    def text_at(self, version, entries=None) -> str:
+        """Text of the document as of snapshot `version`."""
+        entries = entries if entries is not None else self.index()
+        if not 0 <= version < len(entries):
+            raise IndexError(f'No snapshot {version}')
+        first = version
+        while first > 0 and not entries[first][1]:
+            first -= 1
+
+        doc = pycrdt.Doc()
+        with open(self.path, 'rb') as f:
+            for _, _, start, length in entries[first:version + 1]:
+                f.seek(start)
+                doc.apply_update(f.read(length))
+        return str(doc.get('monaco', type=pycrdt.Text))
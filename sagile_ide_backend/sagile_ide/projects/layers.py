@@ -0,0 +1,41 @@
+import msgpack
+from channels.layers import InMemoryChannelLayer
+
+
+class LocalShardChannelLayer(InMemoryChannelLayer):
+    """
+    Local stand-in for a shared channel layer (e.g. Redis) when testing
+    document ownership with several DocumentRouter instances in one process.
+
+    Every instance shares the same channels and groups, so layer aliases
+    configured for different simulated workers see each other's messages.
+    Messages are round-tripped through msgpack like a network layer would,
+    which catches payloads that only work because InMemoryChannelLayer
+    passes Python objects through untouched.
+
+        CHANNEL_LAYERS = {
+            "default": {"BACKEND": "projects.layers.LocalShardChannelLayer"},
+        }
+    """
+
+    _shared_channels = {}
+    _shared_groups = {}
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.channels = LocalShardChannelLayer._shared_channels
+        self.groups = LocalShardChannelLayer._shared_groups
+
+    async def send(self, channel, message):
+        await super().send(channel, self._roundtrip(message))
+
+    async def group_send(self, group, message):
+        await super().group_send(group, self._roundtrip(message))
+
+    async def flush(self):
+        self.channels.clear()
+        self.groups.clear()
+
+    @staticmethod
+    def _roundtrip(message):
+        return msgpack.unpackb(msgpack.packb(message, use_bin_type=True), raw=False)
@@ -0,0 +1,282 @@
+import asyncio
+import json
+import logging
+import os
+import random
+import re
+import resource
+import shutil
+import tempfile
+import time
+import pycrdt
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.core.management.base import BaseCommand
+from repositories.path_cache import repository_path_cache
+from projects.awareness import encode_awareness_update
+from projects.routing import websocket_urlpatterns
+from projects.sessions import session_manager
+
+BENCH_PROJECT_ID = 'benchload'
+# Every edit inserts a marker "\x02<client>:<seq>\x03"; receivers look for
+# markers in the text deltas they apply to time propagation end to end.
+_MARKER = re.compile('\x02(\\d+):(\\d+)\x03')
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return None
+    index = max(0, min(len(sorted_values) - 1, round(pct / 100 * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+def rss_bytes():
+    """Current resident set size (falls back to the peak where /proc is missing)."""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class BenchClient:
+    """One simulated editor: a pycrdt doc behind a WebsocketCommunicator."""
+
+    def __init__(self, client_number, app, file_path, results):
+        self.number = client_number
+        self.path = f'/ws/editor/{BENCH_PROJECT_ID}/{file_path}'
+        self.communicator = WebsocketCommunicator(app, self.path)
+        self.doc = pycrdt.Doc()
+        self.text = self.doc.get('monaco', type=pycrdt.Text)
+        self.results = results
+        self.outgoing = []
+        self.applying_remote = False
+        self.seq = 0
+        self.doc.observe(self._on_local_update)
+        self.text.observe(self._on_text_event)
+
+    def _on_local_update(self, event):
+        if not self.applying_remote:
+            self.outgoing.append(event.update)
+
+    def _on_text_event(self, event):
+        if not self.applying_remote:
+            return
+        now = time.perf_counter()
+        for op in event.delta:
+            inserted = op.get('insert')
+            if not isinstance(inserted, str):
+                continue
+            for client, seq in _MARKER.findall(inserted):
+                sent_at = self.results['sent_at'].get((int(client), int(seq)))
+                if sent_at is not None:
+                    self.results['latencies'].append(now - sent_at)
+
+    async def connect(self, initial_length):
+        connected, _ = await self.communicator.connect(timeout=60)
+        if not connected:
+            raise RuntimeError(f'Could not connect to {self.path}')
+        await self.communicator.send_to(bytes_data=pycrdt.create_sync_message(self.doc))
+        while len(self.text) < initial_length:
+            await self.handle(await self.communicator.receive_from(timeout=60))
+
+    async def handle(self, frame):
+        self.results['frames_received'] += 1
+        if frame[0] != 0:
+            return
+        self.applying_remote = True
+        try:
+            reply = pycrdt.handle_sync_message(frame[1:], self.doc)
+        finally:
+            self.applying_remote = False
+        if reply:
+            await self.communicator.send_to(bytes_data=reply)
+
+    async def receive_forever(self):
+        # Never time out here: a receive timeout tears the consumer down.
+        while True:
+            await self.handle(await self.communicator.receive_from(timeout=3600))
+
+    async def edit_forever(self, rate, rng):
+        while True:
+            await asyncio.sleep(rng.expovariate(rate))
+            self.seq += 1
+            marker = f'\x02{self.number}:{self.seq}\x03'
+            self.results['sent_at'][(self.number, self.seq)] = time.perf_counter()
+            self.text.insert(rng.randint(0, len(self.text)), marker)
+            updates, self.outgoing = self.outgoing, []
+            for update in updates:
+                await self.communicator.send_to(bytes_data=pycrdt.create_update_message(update))
+            self.results['edits_sent'] += 1
+
+    async def awareness_forever(self, rate, rng):
+        clock = 0
+        while True:
+            await asyncio.sleep(rng.expovariate(rate))
+            clock += 1
+            state = json.dumps({'cursor': rng.randint(0, max(1, len(self.text)))})
+            update = encode_awareness_update([(self.doc.client_id, clock, state)])
+            await self.communicator.send_to(bytes_data=pycrdt.create_awareness_message(update))
+            self.results['awareness_sent'] += 1
+
+
+class Command(BaseCommand):
+    help = (
+        "Run N simulated pycrdt clients against the editor WebSocket in-process "
+        "over M documents and report propagation latency (p50/p95/p99), "
+        "throughput, memory per document and CPU as JSON."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--clients', type=int, default=20)
+        parser.add_argument('--documents', type=int, default=5)
+        parser.add_argument('--duration', type=float, default=10.0, help='Seconds of load')
+        parser.add_argument('--edit-rate', type=float, default=2.0,
+                            help='Edits per second per client')
+        parser.add_argument('--awareness-rate', type=float, default=5.0,
+                            help='Awareness updates per second per client')
+        parser.add_argument('--doc-size', type=int, default=10 * 1024,
+                            help='Initial size of each document in bytes')
+        parser.add_argument('--drain-timeout', type=float, default=30.0,
+                            help='Seconds to wait for clients to converge after the load stops')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--output', default='-', help='JSON output file (default: stdout)')
+        parser.add_argument('--verbose', action='store_true', help='Keep server log output')
+
+    def handle(self, *args, **options):
+        root = tempfile.mkdtemp(prefix='bench-editor-load-')
+        repository_path_cache.prime(BENCH_PROJECT_ID, root, ttl=None)
+        try:
+            if not options['verbose']:
+                logging.disable(logging.WARNING)
+            report = asyncio.run(self.run(root, options))
+        finally:
+            logging.disable(logging.NOTSET)
+            repository_path_cache.invalidate(BENCH_PROJECT_ID)
+            shutil.rmtree(root, ignore_errors=True)
+
+        output = json.dumps(report, indent=2)
+        if options['output'] == '-':
+            self.stdout.write(output)
+        else:
+            with open(options['output'], 'w') as f:
+                f.write(output + '\n')
+            self.stdout.write(self.style.SUCCESS(f"Wrote {options['output']}"))
+
+    async def run(self, root, options):
+        rng = random.Random(options['seed'])
+        app = URLRouter(websocket_urlpatterns)
+        results = {
+            'sent_at': {}, 'latencies': [], 'edits_sent': 0,
+            'awareness_sent': 0, 'frames_received': 0,
+        }
+
+        file_paths = []
+        for i in range(options['documents']):
+            file_path = f'doc-{i}.txt'
+            line = 'lorem ipsum dolor sit amet consectetur adipiscing elit\n'
+            content = (line * (options['doc_size'] // len(line) + 1))[:options['doc_size']]
+            with open(os.path.join(root, file_path), 'w') as f:
+                f.write(content)
+            file_paths.append(file_path)
+
+        rss_before = rss_bytes()
+        clients = [
+            BenchClient(i, app, file_paths[i % len(file_paths)], results)
+            for i in range(options['clients'])
+        ]
+        connect_started = time.perf_counter()
+        for client in clients:
+            await client.connect(options['doc_size'])
+        connect_seconds = time.perf_counter() - connect_started
+        rss_loaded = rss_bytes()
+        manager_stats = session_manager.stats()
+
+        tasks = [asyncio.create_task(client.receive_forever()) for client in clients]
+        tasks += [
+            asyncio.create_task(client.edit_forever(options['edit_rate'], random.Random(rng.random())))
+            for client in clients if options['edit_rate'] > 0
+        ]
+        tasks += [
+            asyncio.create_task(client.awareness_forever(options['awareness_rate'], random.Random(rng.random())))
+            for client in clients if options['awareness_rate'] > 0
+        ]
+
+        cpu_started = time.process_time()
+        wall_started = time.perf_counter()
+        await asyncio.sleep(options['duration'])
+        edit_tasks = tasks[len(clients):]
+        for task in edit_tasks:
+            task.cancel()
+        # Let in-flight updates arrive: wait until every document's clients
+        # agree (or give up after the drain timeout).
+        load_seconds = time.perf_counter() - wall_started
+        drain_started = time.perf_counter()
+        converged = _converged(clients)
+        while not converged and time.perf_counter() - drain_started < options['drain_timeout']:
+            await asyncio.sleep(0.1)
+            converged = _converged(clients)
+        drain_seconds = time.perf_counter() - drain_started
+        wall_seconds = time.perf_counter() - wall_started
+        cpu_seconds = time.process_time() - cpu_started
+        rss_after = rss_bytes()
+
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        for client in clients:
+            await client.communicator.disconnect()
+
+        latencies = sorted(results['latencies'])
+        receivers_per_edit = [
+            sum(1 for c in clients if c.path == client.path) - 1 for client in clients
+        ]
+        expected = sum(
+            client.seq * receivers for client, receivers in zip(clients, receivers_per_edit)
+        )
+        return {
+            'config': {
+                key: options[key] for key in (
+                    'clients', 'documents', 'duration', 'edit_rate',
+                    'awareness_rate', 'doc_size', 'seed',
+                )
+            },
+            'latency_ms': {
+                'p50': _ms(percentile(latencies, 50)),
+                'p95': _ms(percentile(latencies, 95)),
+                'p99': _ms(percentile(latencies, 99)),
+                'max': _ms(latencies[-1] if latencies else None),
+                'samples': len(latencies),
+                'expected_samples': expected,
+            },
+            'throughput_per_second': {
+                'edits_sent': results['edits_sent'] / load_seconds,
+                'awareness_sent': results['awareness_sent'] / load_seconds,
+                'frames_received': results['frames_received'] / wall_seconds,
+            },
+            'memory': {
+                'rss_before_bytes': rss_before,
+                'rss_loaded_bytes': rss_loaded,
+                'rss_after_bytes': rss_after,
+                'rss_per_document_bytes': (rss_loaded - rss_before) / max(1, options['documents']),
+                'estimated_document_bytes': manager_stats['estimated_bytes'] / max(1, options['documents']),
+            },
+            'cpu': {
+                'seconds': cpu_seconds,
+                'utilisation': cpu_seconds / wall_seconds,
+            },
+            'connect_seconds': connect_seconds,
+            'drain_seconds': drain_seconds,
+            'converged': converged,
+        }
+
+
+def _converged(clients):
+    texts = {}
+    for client in clients:
+        texts.setdefault(client.path, set()).add(str(client.text))
+    return all(len(variants) == 1 for variants in texts.values())
+
+
+def _ms(seconds):
+    return None if seconds is None else round(seconds * 1000, 3)
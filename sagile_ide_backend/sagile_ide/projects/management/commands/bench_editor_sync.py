@@ -0,0 +1,149 @@
+import asyncio
+import base64
+import os
+import random
+import shutil
+import tempfile
+import time
+import pycrdt
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.core.management.base import BaseCommand
+from repositories.path_cache import repository_path_cache
+from projects.compression import decompress_frame
+from projects.routing import websocket_urlpatterns
+from projects.sessions import READ_ONLY_MIN_BYTES
+
+BENCH_PROJECT_ID = 'benchsync'
+
+
+def generate_lockfile(size_bytes, seed=0):
+    """Lockfile-like text: repetitive keys with random integrity hashes."""
+    rng = random.Random(seed)
+    lines = ['{\n  "packages": {\n']
+    total = len(lines[0])
+    i = 0
+    while total < size_bytes:
+        digest = base64.b64encode(rng.randbytes(48)).decode()
+        line = (
+            f'    "node_modules/pkg-{i}": {{\n'
+            f'      "version": "{rng.randint(0, 9)}.{rng.randint(0, 30)}.{rng.randint(0, 99)}",\n'
+            f'      "resolved": "https://registry.npmjs.org/pkg-{i}/-/pkg-{i}.tgz",\n'
+            f'      "integrity": "sha512-{digest}"\n'
+            f'    }},\n'
+        )
+        lines.append(line)
+        total += len(line)
+        i += 1
+    lines.append('  }\n}\n')
+    return ''.join(lines)
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure editor connect latency (time until the full document has "
+        "been synced, i.e. time to first render) with and without compressed "
+        "sync frames, for the two-step and the eager (?new=1) handshake.  "
+        "Sizes of EDITOR_READ_ONLY_MIN_BYTES or more are not opened live and "
+        "are reported as skipped."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', default='1,10,50',
+                            help='Comma-separated file sizes in MB (default: 1,10,50)')
+        parser.add_argument('--link-mbps', type=float, default=10.0,
+                            help='Link speed used to estimate transfer time (default: 10)')
+        parser.add_argument('--rtt-ms', type=float, default=50.0,
+                            help='Round-trip time added per handshake round trip (default: 50)')
+        parser.add_argument('--runs', type=int, default=3,
+                            help='Connects per size and mode; the median is reported')
+
+    def handle(self, *args, **options):
+        sizes = [float(s) for s in options['sizes'].split(',') if s.strip()]
+        root = tempfile.mkdtemp(prefix='bench-editor-sync-')
+        repository_path_cache.prime(BENCH_PROJECT_ID, root, ttl=None)
+        try:
+            rows = asyncio.run(self.run(root, sizes, options['runs']))
+        finally:
+            repository_path_cache.invalidate(BENCH_PROJECT_ID)
+            shutil.rmtree(root, ignore_errors=True)
+
+        link_bytes_per_second = options['link_mbps'] * 1e6 / 8
+        rtt = options['rtt_ms'] / 1000
+        self.stdout.write(
+            f"{'size':>8} {'mode':>11} {'wire bytes':>12} {'server ms':>10} "
+            f"{'est. @%gMbps/%gms ms' % (options['link_mbps'], options['rtt_ms']):>22}"
+        )
+        for size_mb, mode, wire_bytes, seconds in rows:
+            if wire_bytes is None:
+                self.stdout.write(
+                    f"{size_mb:>6g}MB {'skipped':>11}  read-only (>= {READ_ONLY_MIN_BYTES} bytes)"
+                )
+                continue
+            # WebSocket upgrade plus, for the two-step handshake, the client's
+            # sync step 1 before the server can answer with the content.
+            round_trips = 1 if mode.startswith('eager') else 2
+            estimate = seconds + wire_bytes / link_bytes_per_second + round_trips * rtt
+            self.stdout.write(
+                f"{size_mb:>6g}MB {mode:>11} {wire_bytes:>12} {seconds * 1000:>10.1f} "
+                f"{estimate * 1000:>22.1f}"
+            )
+
+    async def run(self, root, sizes, runs):
+        app = URLRouter(websocket_urlpatterns)
+        rows = []
+        for size_mb in sizes:
+            if int(size_mb * 1024 * 1024) >= READ_ONLY_MIN_BYTES:
+                rows.append((size_mb, 'read-only', None, None))
+                continue
+            file_path = f'bench-{size_mb:g}mb.json'
+            text = generate_lockfile(int(size_mb * 1024 * 1024))
+            if len(text.encode('utf-8')) >= READ_ONLY_MIN_BYTES:
+                rows.append((size_mb, 'read-only', None, None))
+                continue
+            with open(os.path.join(root, file_path), 'w') as f:
+                f.write(text)
+            # The first connect bootstraps the CRDT from plain text and
+            # writes the .ystate sidecar; measure the steady state after it.
+            await self.connect_once(app, file_path, len(text), compress=False)
+            for mode in ('plain', 'zlib', 'eager', 'eager+zlib'):
+                samples = [
+                    await self.connect_once(
+                        app, file_path, len(text),
+                        compress=mode.endswith('zlib'), eager=mode.startswith('eager'),
+                    )
+                    for _ in range(runs)
+                ]
+                samples.sort(key=lambda sample: sample[1])
+                wire_bytes, seconds = samples[len(samples) // 2]
+                rows.append((size_mb, mode, wire_bytes, seconds))
+        return rows
+
+    async def connect_once(self, app, file_path, text_length, compress, eager=False):
+        path = f'/ws/editor/{BENCH_PROJECT_ID}/{file_path}'
+        query = (['compress=zlib'] if compress else []) + (['new=1'] if eager else [])
+        if query:
+            path += '?' + '&'.join(query)
+        doc = pycrdt.Doc()
+        text = doc.get('monaco', type=pycrdt.Text)
+        communicator = WebsocketCommunicator(app, path)
+
+        started = time.perf_counter()
+        connected, _ = await communicator.connect(timeout=60)
+        if not connected:
+            raise RuntimeError(f'Could not connect to {path}')
+        if not eager:
+            await communicator.send_to(bytes_data=pycrdt.create_sync_message(doc))
+        wire_bytes = 0
+        while len(text) < text_length:
+            frame = await communicator.receive_from(timeout=120)
+            wire_bytes += len(frame)
+            frame = decompress_frame(frame)
+            if frame[0] == 0:
+                reply = pycrdt.handle_sync_message(frame[1:], doc)
+                if reply:
+                    await communicator.send_to(bytes_data=reply)
+        elapsed = time.perf_counter() - started
+
+        await communicator.disconnect()
+        return wire_bytes, elapsed
@@ -0,0 +1,74 @@
+import os
+import time
+from django.core.management.base import BaseCommand
+from repositories.models import Repository
+from projects.compaction import compact_document, find_crdt_documents
+from projects.update_log import CRDT_SIDECAR_SUFFIXES
+
+
+class Command(BaseCommand):
+    help = (
+        "Compact the .ystate/.ylog CRDT sidecars of every repository (or the "
+        "given projects) and report the bytes reclaimed per repository. "
+        "Document identity is preserved, so connected clients are unaffected. "
+        "Documents written to recently are skipped: the editor server "
+        "compacts those itself once they go idle."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--project', action='append', default=[],
+                            help='Only this project id (repeatable)')
+        parser.add_argument('--min-idle-seconds', type=int, default=600,
+                            help='Skip documents whose sidecars changed more recently (default: 600)')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Report what would be reclaimed without writing')
+
+    def handle(self, *args, **options):
+        repositories = Repository.objects.all()
+        if options['project']:
+            repositories = repositories.filter(project_id__in=options['project'])
+
+        cutoff = time.time() - options['min_idle_seconds']
+        total_before = total_after = total_documents = 0
+        for repo in repositories:
+            if not repo.root_path or not os.path.isdir(repo.root_path):
+                continue
+            before = after = documents = skipped = 0
+            for full_path in find_crdt_documents(repo.root_path):
+                if _last_modified(full_path) > cutoff:
+                    skipped += 1
+                    continue
+                try:
+                    doc_before, doc_after = compact_document(full_path, options['dry_run'])
+                except Exception as e:
+                    self.stderr.write(f"{full_path}: {e}")
+                    continue
+                before += doc_before
+                after += doc_after
+                documents += 1
+
+            if documents or skipped:
+                self.stdout.write(
+                    f"{repo.name} ({repo.project_id}): {documents} documents, "
+                    f"{before} -> {after} bytes, {before - after} reclaimed"
+                    f"{f', {skipped} recently edited skipped' if skipped else ''}"
+                )
+            total_before += before
+            total_after += after
+            total_documents += documents
+
+        self.stdout.write(self.style.SUCCESS(
+            f"{'Would reclaim' if options['dry_run'] else 'Reclaimed'} "
+            f"{total_before - total_after} bytes across {total_documents} documents "
+            f"({total_before} -> {total_after})"
+        ))
+
+
+def _last_modified(full_path):
+    mtimes = []
+    for suffix in CRDT_SIDECAR_SUFFIXES:
+        try:
+            mtimes.append(os.path.getmtime(full_path + suffix))
+        except OSError:
+            pass
+    return max(mtimes, default=0)
@@ -0,0 +1,141 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import shutil
+import tempfile
+import time
+import pycrdt
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.core.management.base import BaseCommand
+from repositories.path_cache import repository_path_cache
+from projects.routing import websocket_urlpatterns
+from projects.trace import TRACE_BASE, TRACE_CLOSE, TRACE_FRAME, read_trace
+from projects.update_log import UpdateLog
+
+REPLAY_PROJECT_ID = 'replay'
+
+
+class Command(BaseCommand):
+    help = (
+        "Replay editor traces recorded with EDITOR_TRACE_DIR through the editor "
+        "WebSocket in-process, at recorded speed or as fast as possible, and "
+        "report timing plus a hash of each resulting document as JSON."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('traces', nargs='+', help='.ytrace files')
+        parser.add_argument('--speed', type=float, default=1.0,
+                            help='Replay speed factor; 0 replays as fast as possible (default: 1)')
+        parser.add_argument('--output', default='-', help='JSON output file (default: stdout)')
+        parser.add_argument('--verbose', action='store_true', help='Keep server log output')
+
+    def handle(self, *args, **options):
+        root = tempfile.mkdtemp(prefix='replay-editor-trace-')
+        repository_path_cache.prime(REPLAY_PROJECT_ID, root, ttl=None)
+        try:
+            if not options['verbose']:
+                logging.disable(logging.WARNING)
+            report = asyncio.run(self.run(root, options))
+        finally:
+            logging.disable(logging.NOTSET)
+            repository_path_cache.invalidate(REPLAY_PROJECT_ID)
+            shutil.rmtree(root, ignore_errors=True)
+
+        output = json.dumps(report, indent=2)
+        if options['output'] == '-':
+            self.stdout.write(output)
+        else:
+            with open(options['output'], 'w') as f:
+                f.write(output + '\n')
+            self.stdout.write(self.style.SUCCESS(f"Wrote {options['output']}"))
+
+    async def run(self, root, options):
+        app = URLRouter(websocket_urlpatterns)
+        cpu_started = time.process_time()
+        started = time.perf_counter()
+        results = await asyncio.gather(*(
+            self.replay(app, root, f'trace-{i}', trace_path, options['speed'])
+            for i, trace_path in enumerate(options['traces'])
+        ))
+        wall_seconds = time.perf_counter() - started
+        frames = sum(result['frames'] for result in results)
+        return {
+            'speed': options['speed'],
+            'traces': results,
+            'frames': frames,
+            'wall_seconds': wall_seconds,
+            'frames_per_second': frames / wall_seconds if wall_seconds else None,
+            'cpu_seconds': time.process_time() - cpu_started,
+        }
+
+    async def replay(self, app, root, prefix, trace_path, speed):
+        doc_key, records = read_trace(trace_path)
+        file_path = f"{prefix}/{doc_key.split(':', 1)[-1]}"
+        full_path = os.path.join(root, file_path)
+        os.makedirs(os.path.dirname(full_path), exist_ok=True)
+
+        # Seed the file with the state the recorded frames were applied to.
+        base = next((payload for _, kind, _, payload in records if kind == TRACE_BASE), None)
+        text = ''
+        if base:
+            doc = pycrdt.Doc()
+            doc.apply_update(base)
+            text = str(doc.get('monaco', type=pycrdt.Text))
+            UpdateLog(full_path).compact(base)
+        with open(full_path, 'w', encoding='utf-8') as f:
+            f.write(text)
+
+        path = f'/ws/editor/{REPLAY_PROJECT_ID}/{file_path}'
+        connections = {}
+        drains = []
+        frames = 0
+
+        async def drain(communicator):
+            while True:
+                await communicator.receive_from(timeout=3600)
+
+        started = time.perf_counter()
+        for elapsed, kind, connection, payload in records:
+            if speed > 0:
+                delay = started + elapsed / speed - time.perf_counter()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+
+            if kind == TRACE_FRAME:
+                communicator = connections.get(connection)
+                if communicator is None:
+                    communicator = WebsocketCommunicator(app, path)
+                    connected, _ = await communicator.connect(timeout=60)
+                    if not connected:
+                        raise RuntimeError(f'Could not connect to {path}')
+                    connections[connection] = communicator
+                    drains.append(asyncio.create_task(drain(communicator)))
+                await communicator.send_to(bytes_data=payload)
+                frames += 1
+            elif kind == TRACE_CLOSE and connection in connections:
+                await connections.pop(connection).disconnect()
+
+        # Disconnecting waits for each consumer to finish its queued frames;
+        # the last one out writes the final text.
+        for communicator in connections.values():
+            await communicator.disconnect()
+        for task in drains:
+            task.cancel()
+        await asyncio.gather(*drains, return_exceptions=True)
+        replay_seconds = time.perf_counter() - started
+
+        with open(full_path, encoding='utf-8') as f:
+            final_text = f.read()
+        return {
+            'trace': trace_path,
+            'doc_key': doc_key,
+            'frames': frames,
+            'recorded_seconds': records[-1][0] if records else 0.0,
+            'replay_seconds': replay_seconds,
+            'frames_per_second': frames / replay_seconds if replay_seconds else None,
+            'final_length': len(final_text),
+            'final_sha1': hashlib.sha1(final_text.encode('utf-8')).hexdigest(),
+        }
@@ -0,0 +1,243 @@
+import bisect
+import threading
+from django.conf import settings
+from sagile_ide.log import get_logger
+
+logger = get_logger(__name__)
+
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+class _Metric:
+    kind = 'untyped'
+
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, '')) for name in self.labelnames)
+
+    def _labels(self, key):
+        return dict(zip(self.labelnames, key))
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def __init__(self, name, help_text, labelnames=()):
+        super().__init__(name, help_text, labelnames)
+        self.values = {}
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            items = list(self.values.items())
+        for key, value in items:
+            yield self.name, self._labels(key), value
+
+    def snapshot(self):
+        return [{'labels': labels, 'value': value} for _, labels, value in self.samples()]
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help_text, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # key -> [per-bucket counts (+Inf last), sum, count]
+        self.series = {}
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self.series.get(key)
+            if series is None:
+                series = self.series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def _copy(self):
+        with self._lock:
+            return [(key, list(counts), total, count) for key, (counts, total, count) in self.series.items()]
+
+    def samples(self):
+        for key, counts, total, count in self._copy():
+            labels = self._labels(key)
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += bucket_count
+                le = '+Inf' if bound == float('inf') else repr(float(bound))
+                yield f'{self.name}_bucket', {**labels, 'le': le}, cumulative
+            yield f'{self.name}_sum', labels, total
+            yield f'{self.name}_count', labels, count
+
+    def snapshot(self):
+        result = []
+        for key, counts, total, count in self._copy():
+            result.append({
+                'labels': self._labels(key),
+                'count': count,
+                'sum': total,
+                'avg': total / count if count else None,
+                'p50': _bucket_quantile(self.buckets, counts, count, 0.50),
+                'p95': _bucket_quantile(self.buckets, counts, count, 0.95),
+                'p99': _bucket_quantile(self.buckets, counts, count, 0.99),
+            })
+        return result
+
+
+class Gauge(_Metric):
+    """A value read at collection time from `collect()` (a number or {labels: value})."""
+
+    kind = 'gauge'
+
+    def __init__(self, name, help_text, collect, labelnames=()):
+        super().__init__(name, help_text, labelnames)
+        self.collect = collect
+
+    def samples(self):
+        value = self.collect()
+        if isinstance(value, dict):
+            for key, item in value.items():
+                key = key if isinstance(key, tuple) else (key,)
+                yield self.name, self._labels(key), item
+        else:
+            yield self.name, {}, value
+
+    def snapshot(self):
+        return [{'labels': labels, 'value': value} for _, labels, value in self.samples()]
+
+
+class MetricsRegistry:
+    """
+    In-process metrics for the collaborative editor.
+
+    Counters and histograms are updated on the hot paths; gauges and the
+    existing `stats()` dictionaries of the editor services are read only
+    when the metrics are collected.  Every sample carries the editor worker
+    id, since each ASGI worker reports its own documents.
+    """
+
+    def __init__(self, const_labels=None):
+        self.const_labels = const_labels or {}
+        self.metrics = {}
+        # prefix -> stats() callable whose numeric values become gauges
+        self.stats_sources = {}
+
+    def _register(self, metric):
+        self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, help_text, labelnames=()):
+        return self._register(Counter(name, help_text, labelnames))
+
+    def histogram(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram(name, help_text, labelnames, buckets))
+
+    def gauge(self, name, help_text, collect, labelnames=()):
+        return self._register(Gauge(name, help_text, collect, labelnames))
+
+    def register_stats(self, prefix, stats):
+        self.stats_sources[prefix] = stats
+
+    def _stats(self):
+        for prefix, stats in self.stats_sources.items():
+            try:
+                yield prefix, stats()
+            except Exception:
+                logger.exception('metrics.error', 'Error collecting stats', source=prefix)
+
+    def render_prometheus(self) -> str:
+        lines = []
+        for metric in self.metrics.values():
+            lines.append(f'# HELP {metric.name} {metric.help}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            for name, labels, value in metric.samples():
+                lines.append(f'{name}{_format_labels({**self.const_labels, **labels})} {_format_value(value)}')
+        for prefix, stats in self._stats():
+            for key, value in stats.items():
+                if isinstance(value, bool) or not isinstance(value, (int, float)):
+                    continue
+                name = f'{prefix}_{key}'
+                lines.append(f'# TYPE {name} gauge')
+                lines.append(f'{name}{_format_labels(self.const_labels)} {_format_value(value)}')
+        return '\n'.join(lines) + '\n'
+
+    def snapshot(self) -> dict:
+        return {
+            'labels': self.const_labels,
+            'metrics': {
+                name: {'type': metric.kind, 'help': metric.help, 'values': metric.snapshot()}
+                for name, metric in self.metrics.items()
+            },
+            'stats': dict(self._stats()),
+        }
+
+
+def _bucket_quantile(buckets, counts, count, q):
+    """Upper bound of the bucket holding the q-quantile (None past the last bucket)."""
+    if not count:
+        return None
+    rank = q * count
+    cumulative = 0
+    for bound, bucket_count in zip(buckets, counts):
+        cumulative += bucket_count
+        if cumulative >= rank:
+            return bound
+    return None
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    parts = []
+    for name, value in labels.items():
+        value = str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+        parts.append(f'{name}="{value}"')
+    return '{' + ','.join(parts) + '}'
+
+
+def _format_value(value):
+    if isinstance(value, float):
+        if value != value:
+            return 'NaN'
+        if value in (float('inf'), float('-inf')):
+            return '+Inf' if value > 0 else '-Inf'
+        return repr(value)
+    return str(value)
+
+
+# Global instance
+metrics = MetricsRegistry({'worker': str(getattr(settings, 'EDITOR_WORKER_ID', 0))})
+
+# Editor metrics updated on the hot paths.
+FRAMES_IN = metrics.counter('editor_frames_in_total', 'Frames received from clients', ('type',))
+BYTES_IN = metrics.counter('editor_bytes_in_total', 'Bytes received from clients', ('type',))
+FRAMES_OUT = metrics.counter('editor_frames_out_total', 'Frames sent to clients')
+BYTES_OUT = metrics.counter('editor_bytes_out_total', 'Bytes sent to clients (after compression)')
+DOC_UPDATES = metrics.counter('editor_doc_updates_total', 'CRDT transactions observed by on_update')
+BROADCASTS = metrics.counter('editor_broadcasts_total', 'Room broadcasts sent', ('kind',))
+SAVES = metrics.counter('editor_saves_total', 'Documents written to disk')
+SAVE_FAILURES = metrics.counter('editor_save_failures_total', 'Document writes that failed')
+BYTES_WRITTEN = metrics.counter('editor_bytes_written_total', 'Bytes written by saves', ('kind',))
+DISK_MERGES = metrics.counter('editor_disk_merges_total', 'Files changed on disk merged into live documents')
+FLUSH_SECONDS = metrics.histogram('editor_flush_seconds', 'Duration of one write-behind flush')
+SESSION_LOCK_WAIT_SECONDS = metrics.histogram(
+    'editor_session_lock_wait_seconds', 'Time spent waiting for a per-document session lock', ('op',)
+)
+
+
+def frame_type_label(frame) -> str:
+    if not frame:
+        return 'empty'
+    return {0: 'sync', 1: 'awareness', 100: 'compressed'}.get(frame[0], 'other')
@@ -1,6 +1,7 @@
 from mongoengine import Document, EmbeddedDocument, fields
 from datetime import datetime
 import bson
+from .access_cache import project_access_cache
 
 
 class ProjectMembership(EmbeddedDocument):
@@ -199,4 +200,11 @@ class Project(Document):
     def save(self, *args, **kwargs):
         """Override save to update timestamp"""
         self.updated_at = datetime.utcnow()
-        super().save(*args, **kwargs)
\ No newline at end of file
+        super().save(*args, **kwargs)
+        # Membership may have changed: editor sockets re-check it.
+        project_access_cache.invalidate(self.id)
+
+    def delete(self, *args, **kwargs):
+        """Override delete to drop cached editor access"""
+        super().delete(*args, **kwargs)
+        project_access_cache.invalidate(self.id)
\ No newline at end of file
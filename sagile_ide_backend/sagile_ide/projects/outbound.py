@@ -0,0 +1,194 @@
+import asyncio
+import collections
+import weakref
+import pycrdt
+from django.conf import settings
+from sagile_ide.log import get_logger
+from .metrics import metrics
+
+logger = get_logger(__name__)
+
+# A connection whose queued room broadcasts exceed either limit is treated as
+# too far behind: its queued broadcasts are dropped and replaced by one diff.
+OUTBOUND_QUEUE_FRAMES = getattr(settings, 'EDITOR_OUTBOUND_QUEUE_FRAMES', 256)
+OUTBOUND_QUEUE_BYTES = getattr(settings, 'EDITOR_OUTBOUND_QUEUE_BYTES', 4 * 1024 * 1024)
+
+# Frame kinds.  Only room broadcasts may be dropped; replies (sync step 2,
+# join frames) are addressed to this one client and are always delivered.
+FRAME_REPLY = 'reply'
+FRAME_UPDATE = 'update'
+FRAME_AWARENESS = 'awareness'
+_RESYNC = 'resync'
+_DROPPABLE = (FRAME_UPDATE, FRAME_AWARENESS)
+
+RESYNCS = metrics.counter(
+    'editor_client_resyncs_total', 'Slow clients whose queued updates were replaced by one diff'
+)
+FRAMES_DROPPED = metrics.counter(
+    'editor_outbound_frames_dropped_total', 'Queued broadcast frames dropped for slow clients', ('kind',)
+)
+
+_queues = weakref.WeakSet()
+
+
+def sync_step1_message(state_vector) -> bytes:
+    """Sync step 1 for `state_vector`; the owner answers with the missing diff."""
+    return bytes((0, pycrdt.YSyncMessageType.SYNC_STEP1)) + pycrdt.write_message(state_vector)
+
+
+def read_client_state_vector(frame):
+    """The state vector of a client's sync step 1 frame, else None."""
+    if len(frame) < 2 or frame[0] != 0 or frame[1] != pycrdt.YSyncMessageType.SYNC_STEP1:
+        return None
+    try:
+        return pycrdt.read_message(frame[2:])
+    except Exception:
+        return None
+
+
+class OutboundQueue:
+    """
+    Bounded send queue of one WebSocket connection.
+
+    Channel layer handlers only enqueue frames; a writer task awaits the
+    actual sends.  A client on a slow link therefore backs up here, where it
+    can be measured, instead of stalling the consumer (and with it the
+    channel layer, which silently drops group messages once a channel is
+    full).
+
+    For every document the queue remembers the newest state vector the
+    client is known to have: its own sync step 1, then the document state
+    carried by each room update once that update has been sent.  When the
+    queued broadcasts exceed OUTBOUND_QUEUE_FRAMES or OUTBOUND_QUEUE_BYTES
+    they are dropped, and `resync(doc_key, state_vector)` is awaited for each
+    affected document; it returns (or arranges for) one sync step 2 with
+    everything the client is missing.  Dropped awareness frames are not
+    replayed; clients renew their awareness state well within its timeout.
+    """
+
+    def __init__(self, send, resync, max_frames=None, max_bytes=None):
+        self._send = send
+        self._resync = resync
+        self.max_frames = max_frames or OUTBOUND_QUEUE_FRAMES
+        self.max_bytes = max_bytes or OUTBOUND_QUEUE_BYTES
+        # (kind, doc_key, frame, state_vector); resync markers have frame None
+        self.items = collections.deque()
+        self.queued_frames = 0
+        self.queued_bytes = 0
+        self.state_vectors = {}
+        self.resyncs_pending = set()
+        self.resyncs = 0
+        self._task = None
+        _queues.add(self)
+
+    def note_client_frame(self, doc_key, frame):
+        """Record the state vector of an inbound sync step 1."""
+        state_vector = read_client_state_vector(frame)
+        if state_vector is not None:
+            self.state_vectors[doc_key] = state_vector
+
+    def put(self, kind, doc_key, frame, state_vector=None):
+        if kind in _DROPPABLE:
+            if (self.queued_frames + 1 > self.max_frames
+                    or self.queued_bytes + len(frame) > self.max_bytes):
+                self._overflow(kind, doc_key)
+                return
+            self.queued_frames += 1
+            self.queued_bytes += len(frame)
+        self.items.append((kind, doc_key, frame, state_vector))
+        self._schedule()
+
+    def _overflow(self, kind, doc_key):
+        behind = {doc_key} if kind == FRAME_UPDATE else set()
+        dropped = collections.Counter({kind: 1})
+        kept = collections.deque()
+        for item in self.items:
+            if item[0] in _DROPPABLE:
+                dropped[item[0]] += 1
+                if item[0] == FRAME_UPDATE:
+                    behind.add(item[1])
+            else:
+                kept.append(item)
+        self.queued_frames = self.queued_bytes = 0
+        for dropped_kind, count in dropped.items():
+            FRAMES_DROPPED.inc(count, kind=dropped_kind)
+
+        # Resyncs go first: the diff supersedes everything that was dropped.
+        behind -= self.resyncs_pending
+        for behind_key in behind:
+            kept.appendleft((_RESYNC, behind_key, None, None))
+        self.resyncs_pending |= behind
+        self.items = kept
+        self.resyncs += len(behind)
+        RESYNCS.inc(len(behind))
+        logger.warning(
+            'ws.resync', 'Client fell behind; resyncing',
+            documents=len(behind), dropped=sum(dropped.values()),
+        )
+        self._schedule()
+
+    def rename(self, old_key, new_key):
+        """Carry everything queued for a moved document over to its new key."""
+        if old_key in self.state_vectors:
+            self.state_vectors[new_key] = self.state_vectors.pop(old_key)
+        if old_key in self.resyncs_pending:
+            self.resyncs_pending.discard(old_key)
+            self.resyncs_pending.add(new_key)
+        self.items = collections.deque(
+            (kind, new_key if doc_key == old_key else doc_key, frame, state_vector)
+            for kind, doc_key, frame, state_vector in self.items
+        )
+
+    def forget(self, doc_key):
+        """Drop everything queued for a document the connection left."""
+        self.state_vectors.pop(doc_key, None)
+        self.resyncs_pending.discard(doc_key)
+        kept = collections.deque()
+        for item in self.items:
+            if item[1] != doc_key:
+                kept.append(item)
+            elif item[0] in _DROPPABLE:
+                self.queued_frames -= 1
+                self.queued_bytes -= len(item[2])
+        self.items = kept
+
+    def _schedule(self):
+        if self.items and (self._task is None or self._task.done()):
+            self._task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        try:
+            while self.items:
+                kind, doc_key, frame, state_vector = self.items.popleft()
+                if kind in _DROPPABLE:
+                    self.queued_frames -= 1
+                    self.queued_bytes -= len(frame)
+                elif kind == _RESYNC:
+                    self.resyncs_pending.discard(doc_key)
+                    frame = await self._resync(doc_key, self.state_vectors.get(doc_key, b'\x00'))
+                    if not frame:
+                        continue
+                await self._send(doc_key, frame)
+                if state_vector is not None:
+                    self.state_vectors[doc_key] = state_vector
+        except asyncio.CancelledError:
+            pass
+        except Exception:
+            logger.exception('ws.send_error', 'Error sending queued frames')
+
+    def close(self):
+        if self._task and not self._task.done():
+            self._task.cancel()
+        self.items.clear()
+        self.queued_frames = self.queued_bytes = 0
+        _queues.discard(self)
+
+
+metrics.gauge(
+    'editor_outbound_queued_frames', 'Broadcast frames waiting in per-connection send queues',
+    lambda: sum(queue.queued_frames for queue in list(_queues)),
+)
+metrics.gauge(
+    'editor_outbound_queued_bytes', 'Bytes of broadcast frames waiting in per-connection send queues',
+    lambda: sum(queue.queued_bytes for queue in list(_queues)),
+)
@@ -0,0 +1,222 @@
+import asyncio
+import json
+import time
+from channels.layers import get_channel_layer
+from django.conf import settings
+from sagile_ide.log import get_logger
+from .access_cache import WebSocketUser
+
+logger = get_logger(__name__)
+
+# Presence changes are pushed to a project's sockets at most once per
+# interval; with several workers, each one re-sends its entries every
+# refresh interval and drops those of a worker silent for three of them.
+PRESENCE_INTERVAL_SECONDS = getattr(settings, 'EDITOR_PRESENCE_INTERVAL_MS', 250) / 1000
+PRESENCE_REFRESH_SECONDS = getattr(settings, 'EDITOR_PRESENCE_REFRESH_SECONDS', 30)
+
+# Fields of a client's awareness `user` state shown next to its name.
+_AWARENESS_USER_FIELDS = ('name', 'color')
+
+
+def presence_group_name(project_id) -> str:
+    return f"presence_{project_id}"
+
+
+def presence_user(scope, spectator=False):
+    """The user of a connection as recorded by the presence index, or None."""
+    user = scope.get('user')
+    if not isinstance(user, WebSocketUser):
+        return None
+    return {'id': user.id, 'username': user.username, 'spectator': spectator}
+
+
+class PresenceIndex:
+    """
+    Who has which file of a project open, answered from memory.
+
+    Kept by the session manager of the worker owning each document: a
+    connection is added when it joins a session and removed when it leaves,
+    follows its file when it is moved, and picks up the display name and
+    colour from the first awareness state its client announces.  Entries
+    are per connection, so one user with two tabs counts once per file.
+
+    Changes are batched per project and pushed to the `presence_<project>`
+    group, which project sockets join (ProjectConsumer), so a file
+    explorer shows badges without a socket per file or polling.  With
+    several workers the document owners are spread over all of them;
+    `replicate` (set by document_router) sends this worker's entries of a
+    project to the others whenever they change, so `snapshot()` can answer
+    for the whole project on any worker.
+    """
+
+    def __init__(self, layer_alias, interval, refresh_seconds):
+        self.layer_alias = layer_alias
+        self.interval = interval
+        self.refresh_seconds = refresh_seconds
+        # project_id -> file_path -> channel_name -> entry (documents owned here)
+        self.local = {}
+        # (worker_id, project_id) -> (files as in `local`, received at)
+        self.remote = {}
+        # project_id -> file paths changed since the last push
+        self.pending = {}
+        # async (project_id, files) -> None, only with several workers
+        self.replicate = None
+        self.updates_out = 0
+        self._task = None
+
+    # -------------------------------------------------------------------------
+    # Changes (owner side)
+    # -------------------------------------------------------------------------
+
+    def add(self, project_id, file_path, channel_name, user):
+        if user is None or channel_name is None:
+            return
+        files = self.local.setdefault(str(project_id), {})
+        files.setdefault(file_path, {})[channel_name] = dict(user)
+        self._changed(project_id, file_path)
+
+    def remove(self, project_id, file_path, channel_name):
+        files = self.local.get(str(project_id))
+        entries = files.get(file_path) if files else None
+        if not entries or entries.pop(channel_name, None) is None:
+            return
+        if not entries:
+            del files[file_path]
+            if not files:
+                del self.local[str(project_id)]
+        self._changed(project_id, file_path)
+
+    def move(self, project_id, old_file_path, new_file_path):
+        files = self.local.get(str(project_id))
+        if not files or old_file_path not in files:
+            return
+        files.setdefault(new_file_path, {}).update(files.pop(old_file_path))
+        self._changed(project_id, old_file_path)
+        self._changed(project_id, new_file_path)
+
+    def note_awareness(self, project_id, file_path, channel_name, state_json):
+        """Take name/colour from an awareness state announced by `channel_name`."""
+        entry = self.local.get(str(project_id), {}).get(file_path, {}).get(channel_name)
+        if entry is None:
+            return
+        try:
+            user = json.loads(state_json).get('user')
+        except (ValueError, AttributeError):
+            return
+        if not isinstance(user, dict):
+            return
+        fields = {
+            name: user[name] for name in _AWARENESS_USER_FIELDS
+            if isinstance(user.get(name), str)
+        }
+        if any(entry.get(name) != value for name, value in fields.items()):
+            entry.update(fields)
+            self._changed(project_id, file_path)
+
+    def apply_remote(self, worker_id, project_id, files):
+        """Replace what worker `worker_id` reported for a project."""
+        if files:
+            self.remote[(worker_id, str(project_id))] = (files, time.monotonic())
+        else:
+            self.remote.pop((worker_id, str(project_id)), None)
+
+    # -------------------------------------------------------------------------
+    # Queries
+    # -------------------------------------------------------------------------
+
+    def snapshot(self, project_id, file_paths=None) -> dict:
+        """
+        file_path -> users with the file open, for every file of the project
+        or only `file_paths` (files nobody has open map to []).  Each user
+        is {id, username, name, color, connections, spectator}; spectator is
+        true only when all of the user's connections to the file are.
+        """
+        project_id = str(project_id)
+        expires = time.monotonic() - 3 * self.refresh_seconds
+        sources = [self.local.get(project_id, {})]
+        for (_, remote_project), (files, received_at) in list(self.remote.items()):
+            if remote_project == project_id and received_at >= expires:
+                sources.append(files)
+
+        merged = {file_path: {} for file_path in file_paths or ()}
+        for files in sources:
+            for file_path, entries in list(files.items()):
+                if file_paths is not None and file_path not in merged:
+                    continue
+                users = merged.setdefault(file_path, {})
+                for entry in list(entries.values()):
+                    user = users.get(entry['id'])
+                    if user is None:
+                        users[entry['id']] = {
+                            'id': entry['id'],
+                            'username': entry['username'],
+                            'name': entry.get('name'),
+                            'color': entry.get('color'),
+                            'connections': 1,
+                            'spectator': entry['spectator'],
+                        }
+                        continue
+                    user['connections'] += 1
+                    user['spectator'] = user['spectator'] and entry['spectator']
+                    for name in _AWARENESS_USER_FIELDS:
+                        user[name] = user[name] or entry.get(name)
+        return {
+            file_path: sorted(users.values(), key=lambda user: user['username'] or '')
+            for file_path, users in merged.items()
+        }
+
+    # -------------------------------------------------------------------------
+    # Push
+    # -------------------------------------------------------------------------
+
+    def _changed(self, project_id, file_path):
+        self.pending.setdefault(str(project_id), set()).add(file_path)
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def _run(self):
+        try:
+            while self.pending:
+                await asyncio.sleep(self.interval)
+                await self._send_pending()
+        except asyncio.CancelledError:
+            pass
+        except Exception:
+            logger.exception('presence.error', 'Error pushing presence')
+
+    async def _send_pending(self):
+        pending, self.pending = self.pending, {}
+        layer = get_channel_layer(self.layer_alias)
+        for project_id, file_paths in pending.items():
+            if self.replicate is not None:
+                await self.replicate(project_id, self.local.get(project_id, {}))
+            self.updates_out += 1
+            await layer.group_send(presence_group_name(project_id), {
+                'type': 'presence_update',
+                'project_id': project_id,
+                'files': self.snapshot(project_id, file_paths),
+            })
+
+    async def refresh(self):
+        """Re-send every project's entries to the other workers, forget stale ones."""
+        if self.replicate is None:
+            return
+        expires = time.monotonic() - 3 * self.refresh_seconds
+        for key, (_, received_at) in list(self.remote.items()):
+            if received_at < expires:
+                del self.remote[key]
+        for project_id, files in list(self.local.items()):
+            await self.replicate(project_id, files)
+
+    def stats(self) -> dict:
+        return {
+            'projects': len(self.local),
+            'files': sum(len(files) for files in list(self.local.values())),
+            'connections': sum(
+                len(entries)
+                for files in list(self.local.values())
+                for entries in list(files.values())
+            ),
+            'remote_projects': len(self.remote),
+            'updates_out': self.updates_out,
+        }
@@ -1,7 +1,17 @@
+import re
 from django.urls import re_path
 from . import consumers
 
 websocket_urlpatterns = [
     re_path(r'ws/editor/(?P<project_id>\w+)/(?P<file_path>.+?)/?$', consumers.EditorConsumer.as_asgi()),
+    re_path(r'ws/project/(?P<project_id>\w+)/?$', consumers.ProjectConsumer.as_asgi()),
 ]
 
+
+# The project id of either route, for middleware running before URLRouter.
+_PROJECT_ID = re.compile(r'^/?ws/(?:editor|project)/(?P<project_id>\w+)(?:/|$)')
+
+
+def project_id_from_path(path):
+    match = _PROJECT_ID.match(path)
+    return match.group('project_id') if match else None
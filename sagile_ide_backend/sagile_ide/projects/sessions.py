@@ -0,0 +1,1199 @@
+import os
+import time
+import hashlib
+import asyncio
+import contextlib
+import pycrdt
+from channels.layers import DEFAULT_CHANNEL_LAYER, get_channel_layer
+from django.conf import settings
+from repositories.path_cache import repository_path_cache
+from sagile_ide.log import get_logger
+from .awareness import AwarenessStore
+from .broadcast import UpdateCoalescer
+from .compaction import compact_updates
+from .flusher import write_behind_flusher
+from .handshake import EMPTY_STATE_VECTOR
+from .history import DocumentHistory
+from .metrics import DISK_MERGES, DOC_UPDATES, SESSION_LOCK_WAIT_SECONDS, metrics
+from .presence import PRESENCE_INTERVAL_SECONDS, PRESENCE_REFRESH_SECONDS, PresenceIndex
+from .text_diff import apply_text_edits, text_edits
+from .trace import trace_recorder
+from .update_log import UpdateLog
+
+logger = get_logger(__name__)
+
+# Yjs Protocol Message Types
+Y_SYNC_MESSAGE_TYPE = 0
+Y_AWARENESS_MESSAGE_TYPE = 1
+
+# Channel layer carrying room broadcasts and cross-worker frame routing.
+# It must be shared by every worker (e.g. Redis) once EDITOR_WORKER_COUNT > 1.
+EDITOR_CHANNEL_LAYER = getattr(settings, 'EDITOR_CHANNEL_LAYER', DEFAULT_CHANNEL_LAYER)
+
+# Once a document's .ylog tail grows past this many bytes it is folded into
+# a fresh .ystate snapshot in the background.
+UPDATE_LOG_COMPACT_BYTES = getattr(settings, 'EDITOR_UPDATE_LOG_COMPACT_BYTES', 1024 * 1024)
+# Loaded documents with no updates for this long get their sidecars
+# compacted once (see compaction.py), without waiting for the log threshold.
+COMPACT_IDLE_SECONDS = getattr(settings, 'EDITOR_COMPACT_IDLE_SECONDS', 60)
+
+# Version snapshots (.yhist): at most one per interval while a document is
+# being edited, plus one when it goes idle or is unloaded.  Every Nth
+# snapshot is a full keyframe so any version is rebuilt from a bounded
+# number of deltas.
+SNAPSHOT_INTERVAL_SECONDS = getattr(settings, 'EDITOR_SNAPSHOT_INTERVAL_SECONDS', 300)
+SNAPSHOT_KEYFRAME_EVERY = getattr(settings, 'EDITOR_SNAPSHOT_KEYFRAME_EVERY', 20)
+
+# Size-aware open path for plain-text files.  Files of at least
+# READ_ONLY_MIN_BYTES are not edited live at all (clients get a read-only
+# notice and read them in byte ranges over REST); files of at least
+# CHUNKED_BOOTSTRAP_MIN_BYTES are inserted into the doc in chunks, yielding
+# to the event loop between them.
+READ_ONLY_MIN_BYTES = getattr(settings, 'EDITOR_READ_ONLY_MIN_BYTES', 16 * 1024 * 1024)
+CHUNKED_BOOTSTRAP_MIN_BYTES = getattr(settings, 'EDITOR_CHUNKED_BOOTSTRAP_MIN_BYTES', 1024 * 1024)
+BOOTSTRAP_CHUNK_CHARS = getattr(settings, 'EDITOR_BOOTSTRAP_CHUNK_CHARS', 256 * 1024)
+
+# Loaded documents are checked this often for their file having changed on
+# disk behind the session (git checkout, REST writes, other tools); changes
+# are merged in as a minimal diff (see DocumentSession.reconcile_with_disk).
+# 0 disables the check; explicit notifications still reconcile.
+DISK_CHECK_SECONDS = getattr(settings, 'EDITOR_DISK_CHECK_SECONDS', 5)
+
+# Updates produced within this window are merged into one room broadcast.
+# 0 still coalesces everything produced in the same event-loop tick.
+BROADCAST_WINDOW_SECONDS = getattr(settings, 'EDITOR_BROADCAST_WINDOW_MS', 10) / 1000
+
+# Awareness changes are fanned out as one batch per document per interval;
+# clients that stop renewing their awareness state are dropped after the timeout.
+AWARENESS_INTERVAL_SECONDS = getattr(settings, 'EDITOR_AWARENESS_INTERVAL_MS', 100) / 1000
+AWARENESS_TIMEOUT_SECONDS = getattr(settings, 'EDITOR_AWARENESS_TIMEOUT_SECONDS', 30)
+
+# Memory budget for loaded documents on this worker.  Documents with no
+# updates for EDITOR_IDLE_EVICT_SECONDS are flushed and unloaded; when the
+# estimated total exceeds the budget, least recently active documents go
+# first.  Unloaded documents are reloaded from disk on their next frame.
+MEMORY_BUDGET_BYTES = getattr(settings, 'EDITOR_MEMORY_BUDGET_BYTES', 256 * 1024 * 1024)
+IDLE_EVICT_SECONDS = getattr(settings, 'EDITOR_IDLE_EVICT_SECONDS', 300)
+EVICTION_SWEEP_SECONDS = getattr(settings, 'EDITOR_EVICTION_SWEEP_SECONDS', 30)
+# On shutdown, documents with unsaved changes are flushed concurrently and
+# the worker waits at most this long for them (see DocumentSessionManager.shutdown).
+SHUTDOWN_DEADLINE_SECONDS = getattr(settings, 'EDITOR_SHUTDOWN_DEADLINE_SECONDS', 10)
+# Never evict a document that changed more recently than this, even under
+# memory pressure, so hot documents are not thrashed in and out.
+_MIN_IDLE_SECONDS_UNDER_PRESSURE = 5
+
+# Bucket bounds of the editor_documents_by_users gauge.
+_DOCUMENT_USERS_BUCKETS = (1, 2, 5, 10, 25, 50)
+
+# In-memory store for the documents owned by this worker.
+# Key: f"{project_id}:{file_path}"
+# Value: DocumentSession
+active_documents: dict = {}
+
+# Per-doc locks to prevent race conditions when multiple clients connect
+# to the same document simultaneously (concurrent initialization).
+# doc_key -> [lock, callers holding or waiting for it]; see _session_lock().
+_session_locks: dict = {}
+
+
+@contextlib.asynccontextmanager
+async def _session_lock(doc_key):
+    """
+    Hold the per-doc session lock.  The lock is forgotten only once no
+    caller holds or awaits it: dropping it while joins are still queued
+    would let the next caller create a second session for the same key.
+    """
+    entry = _session_locks.setdefault(doc_key, [asyncio.Lock(), 0])
+    entry[1] += 1
+    try:
+        async with entry[0]:
+            yield
+    finally:
+        entry[1] -= 1
+        if not entry[1] and _session_locks.get(doc_key) is entry:
+            del _session_locks[doc_key]
+
+
+def document_key(project_id, file_path) -> str:
+    return f"{project_id}:{file_path}"
+
+
+def room_group_name_for(project_id, file_path) -> str:
+    return f"editor_{project_id}_{file_path.replace('/', '_')}"
+
+
+def moved_path(file_path, old_path, new_path):
+    """Where `file_path` ends up when `old_path` (a file or folder) moves to `new_path`, else None."""
+    if file_path == old_path:
+        return new_path
+    prefix = old_path.rstrip('/') + '/'
+    if file_path.startswith(prefix):
+        return new_path.rstrip('/') + '/' + file_path[len(prefix):]
+    return None
+
+
+def normalize_file_path(file_path):
+    """
+    A client-supplied file path in canonical form ('a/./b', 'a//b' and
+    'x/../a/b' all become 'a/b', so one file has one doc_key), or None when
+    it is not a relative path inside the repository: absolute paths and
+    paths that `..` leads out of the root are refused.
+    """
+    if not isinstance(file_path, str) or not file_path or '\x00' in file_path:
+        return None
+    if os.path.isabs(file_path):
+        return None
+    normalized = os.path.normpath(file_path)
+    if normalized in (os.curdir, os.pardir) or normalized.startswith(os.pardir + os.sep):
+        return None
+    return normalized
+
+
+def resolve_file_path(root_path, file_path):
+    """Full path of `file_path` inside the repository at `root_path`, or None if it escapes it."""
+    if normalize_file_path(file_path) is None:
+        return None
+    root = os.path.normpath(root_path)
+    full_path = os.path.normpath(os.path.join(root, file_path))
+    if full_path == root or os.path.commonpath([root, full_path]) != root:
+        return None
+    return full_path
+
+
+class DocumentTooLarge(Exception):
+    """The file is too large to be edited live (see READ_ONLY_MIN_BYTES)."""
+
+    def __init__(self, size):
+        super().__init__(f'File is {size} bytes; files of {READ_ONLY_MIN_BYTES} bytes or more are read-only')
+        self.size = size
+
+
+async def document_size(project_id, file_path):
+    """Size in bytes of the file on disk, or None if it cannot be found."""
+    try:
+        root_path = await repository_path_cache.aget_root_path(project_id)
+        full_path = resolve_file_path(root_path, file_path) if root_path else None
+        if not full_path:
+            return None
+        return await asyncio.to_thread(os.path.getsize, full_path)
+    except OSError:
+        return None
+    except Exception:
+        logger.exception('session.path_error', 'Error resolving path', doc=document_key(project_id, file_path))
+        return None
+
+
+async def check_document_size(project_id, file_path):
+    """Raise DocumentTooLarge unless the file may be opened for live editing."""
+    if document_key(project_id, file_path) in active_documents:
+        return
+    size = await document_size(project_id, file_path)
+    if size is not None and size >= READ_ONLY_MIN_BYTES:
+        raise DocumentTooLarge(size)
+
+
+class DocumentSession:
+    """
+    A live collaborative document held in memory by its owner worker.
+
+    Sessions are not tied to a WebSocket connection: the owner creates them
+    for its own clients as well as for clients forwarded from other workers
+    (see doc_router.py), so everything here is keyed by project and file path
+    rather than by consumer state.
+    """
+
+    def __init__(self, doc_key, project_id, file_path, room_group_name):
+        self.doc_key = doc_key
+        self.project_id = project_id
+        self.file_path = file_path
+        self.room_group_name = room_group_name
+        self.doc = pycrdt.Doc()
+        self.users = 0
+        self.subscription = None
+        self.broadcaster = UpdateCoalescer(
+            room_group_name, EDITOR_CHANNEL_LAYER, BROADCAST_WINDOW_SECONDS,
+            doc_key=doc_key, state_vector=lambda: self.doc.get_state(),
+        )
+        self.awareness = AwarenessStore(
+            room_group_name,
+            EDITOR_CHANNEL_LAYER,
+            AWARENESS_INTERVAL_SECONDS,
+            AWARENESS_TIMEOUT_SECONDS,
+            doc_key=doc_key,
+            on_announce=lambda channel_name, state: session_manager.presence.note_awareness(
+                self.project_id, self.file_path, channel_name, state
+            ),
+        )
+        # State vector covered by what is already on disk.  None means the
+        # on-disk history is missing or unrelated to this doc (text bootstrap),
+        # so the next save must write a full snapshot instead of a diff.
+        self.persisted_state_vector = None
+        # Flush bookkeeping: `dirty` is set by every doc update and cleared
+        # when a flush captures it; the text hash is that of the plain-text
+        # file as last written or read (None when unknown).
+        self.dirty = False
+        self.persisted_text_hash = None
+        # Consecutive failed writes, for the flusher's retry backoff.
+        self.save_failures = 0
+        # (mtime_ns, size) of the plain-text file as last read or written by
+        # this session; anything else on disk was changed behind its back.
+        self.disk_stat = None
+        self.reconcile_task = None
+        # Serialises saves and compaction for this document.
+        self.write_lock = asyncio.Lock()
+        self.compact_task = None
+        # True once the sidecars were compacted after the latest update.
+        self.compacted = False
+        # Version snapshot bookkeeping: the state vector the next delta is
+        # taken against (the last snapshot, or the state as loaded), whether
+        # the next snapshot must be a keyframe, when the last one was taken
+        # and how many deltas have been written since the last keyframe.
+        self.snapshot_state_vector = None
+        self.keyframe_due = True
+        self.last_snapshot_at = 0.0
+        self.deltas_since_keyframe = 0
+        self.snapshot_task = None
+        # Eviction bookkeeping (see DocumentSessionManager).
+        self.loaded = False
+        self.load_lock = asyncio.Lock()
+        self.last_activity = time.monotonic()
+        self.size_estimate = 0
+
+    def rekey(self, doc_key, file_path, room_group_name):
+        """Point the session at a moved file (see DocumentSessionManager.move)."""
+        old_key = self.doc_key
+        self.doc_key = doc_key
+        self.file_path = file_path
+        self.room_group_name = room_group_name
+        for part in (self.broadcaster, self.awareness):
+            part.doc_key = doc_key
+            part.room_group_name = room_group_name
+        write_behind_flusher.rekey(self, old_key)
+        trace_recorder.close(old_key)
+
+    async def ensure_loaded(self):
+        """Reload an evicted document from disk before it is used again."""
+        if self.loaded:
+            return
+        async with self.load_lock:
+            if not self.loaded:
+                self.doc = pycrdt.Doc()
+                self.persisted_state_vector = None
+                await self.load()
+                session_manager.rehydrations += 1
+                logger.info('session.rehydrated', 'Rehydrated evicted session', doc=self.doc_key)
+
+    async def load(self):
+        """Restore the document from disk and start observing updates."""
+        # --- Restore document state (before registering the observer) ---
+        # Prefer the persisted CRDT binary state because it preserves
+        # the full Yjs document identity.  Falling back to plain text
+        # creates a fresh doc history, which is fine as long as the
+        # frontend always creates a new Y.Doc on connect (which it does).
+        full_path = await self.get_full_path()
+        self.disk_stat = await asyncio.to_thread(_disk_stat, full_path) if full_path else None
+        crdt_updates = await self.read_crdt_state_from_disk()
+        if crdt_updates:
+            try:
+                for update in crdt_updates:
+                    self.doc.apply_update(update)
+                self.persisted_state_vector = self.doc.get_state()
+                self.size_estimate = sum(len(update) for update in crdt_updates)
+                logger.info(
+                    'session.restored', 'Restored CRDT state from disk',
+                    doc=self.doc_key, logged_updates=len(crdt_updates) - 1,
+                )
+            except Exception as e:
+                self.doc = pycrdt.Doc()
+                logger.warning(
+                    'session.restore_failed', 'CRDT state restore failed, falling back to text bootstrap',
+                    doc=self.doc_key, error=str(e),
+                )
+                await self._bootstrap_from_text()
+        else:
+            await self._bootstrap_from_text()
+
+        # --- Register observer AFTER content is loaded ---
+        # Registering before the initial insert would fire on_update
+        # and broadcast the entire file contents to the room before any
+        # client has completed the sync handshake.
+        self.subscription = self.doc.observe(self.on_update)
+        if self.snapshot_state_vector is None:
+            self.snapshot_state_vector = self.doc.get_state()
+        self.loaded = True
+        self.last_activity = time.monotonic()
+
+        # The sidecars may be older than the file (e.g. a git checkout while
+        # the document was closed or evicted): let the file win.
+        if crdt_updates:
+            await self.reconcile_with_disk()
+
+    def on_update(self, event: pycrdt.TransactionEvent):
+        self.last_activity = time.monotonic()
+        self.size_estimate += len(event.update)
+        self.dirty = True
+        DOC_UPDATES.inc()
+        self.compacted = False
+        self.broadcaster.push(event.update)
+        self.trigger_save()
+
+    async def _bootstrap_from_text(self):
+        """Load file content from disk and insert it into a fresh Yjs doc."""
+        # A fresh history: earlier snapshots share no CRDT ids with it.
+        self.snapshot_state_vector = None
+        self.keyframe_due = True
+        size = await document_size(self.project_id, self.file_path) or 0
+        if size >= CHUNKED_BOOTSTRAP_MIN_BYTES:
+            inserted = await self._bootstrap_in_chunks()
+        else:
+            content = await self.read_file_from_disk()
+            self.persisted_text_hash = _text_hash(content)
+            if content:
+                self.doc.get('monaco', type=pycrdt.Text).insert(0, content)
+            inserted = len(content.encode('utf-8'))
+        if inserted:
+            # A Yjs text item costs several times its UTF-8 payload in memory.
+            self.size_estimate = inserted * 2
+            logger.info(
+                'session.bootstrapped', 'Bootstrapped from text',
+                doc=self.doc_key, bytes=inserted, chunked=size >= CHUNKED_BOOTSTRAP_MIN_BYTES,
+            )
+
+    async def _bootstrap_in_chunks(self) -> int:
+        """
+        Stream the file into the doc BOOTSTRAP_CHUNK_CHARS at a time, one
+        transaction per chunk, reading on a thread and yielding to the event
+        loop in between so other documents keep being served.  The doc is
+        not observed yet and the session is not visible to clients, so
+        nobody sees a partial text.  Returns the number of bytes inserted.
+        """
+        full_path = await self.get_full_path()
+        text = self.doc.get('monaco', type=pycrdt.Text)
+        digest = hashlib.sha1()
+        inserted = 0
+        try:
+            f = await asyncio.to_thread(open, full_path, 'r', encoding='utf-8')
+            try:
+                while True:
+                    chunk = await asyncio.to_thread(f.read, BOOTSTRAP_CHUNK_CHARS)
+                    if not chunk:
+                        break
+                    encoded = chunk.encode('utf-8')
+                    digest.update(encoded)
+                    inserted += len(encoded)
+                    text.insert(len(text), chunk)
+                    await asyncio.sleep(0)
+            finally:
+                f.close()
+        except Exception:
+            logger.exception('session.read_error', 'Error reading file', doc=self.doc_key)
+            # Same outcome as a failed read on the small-file path.
+            self.doc = pycrdt.Doc()
+            self.persisted_text_hash = _text_hash('')
+            return 0
+        self.persisted_text_hash = digest.digest()
+        return inserted
+
+    async def reconcile_with_disk(self) -> bool:
+        """
+        Merge the file on disk into the live doc when it was changed behind
+        the session.  The file wins: the difference between the live text
+        and the file is computed as a minimal diff (see text_diff.py) on a
+        thread and applied as one transaction, which is broadcast to the
+        room and saved like any client edit.  Returns True if the doc changed.
+        """
+        if not self.loaded or self.subscription is None:
+            return False
+        full_path = await self.get_full_path()
+        if not full_path:
+            return False
+
+        try:
+            async with self.write_lock:
+                if not self.loaded:
+                    return False
+                on_disk = await asyncio.to_thread(_read_text_with_stat, full_path)
+                if on_disk is None:
+                    return False  # deleted: nothing to merge
+                content, self.disk_stat = on_disk
+                content_hash = _text_hash(content)
+                if content_hash == self.persisted_text_hash:
+                    return False
+
+                text = self.doc.get('monaco', type=pycrdt.Text)
+                for _ in range(3):
+                    state = self.doc.get_state()
+                    edits = await asyncio.to_thread(text_edits, str(text), content)
+                    if self.doc.get_state() == state:
+                        break
+                else:
+                    # Clients kept editing meanwhile; diff without yielding.
+                    edits = text_edits(str(text), content)
+
+                # The file already holds the result, so the save this
+                # triggers only appends to the CRDT log.
+                self.persisted_text_hash = content_hash
+                if not edits:
+                    return False
+                with self.doc.transaction():
+                    apply_text_edits(text, edits)
+            DISK_MERGES.inc()
+            logger.info('doc.disk_merged', 'Merged file changed on disk', doc=self.doc_key, edits=len(edits))
+            return True
+        except Exception:
+            logger.exception('doc.merge_error', 'Error merging file changed on disk', doc=self.doc_key)
+            return False
+
+    def schedule_reconcile(self):
+        if self.reconcile_task is None or self.reconcile_task.done():
+            self.reconcile_task = asyncio.create_task(self.reconcile_with_disk())
+
+    async def handle_sync_message(self, payload):
+        """
+        Apply a sync frame (state vector or update) from a client and return
+        the reply to send back to that client, if any (e.g. sync step 2).
+        """
+        await self.ensure_loaded()
+        return pycrdt.handle_sync_message(payload, self.doc)
+
+    def create_sync_message(self):
+        """Sync step 1 advertising the server's state vector."""
+        return pycrdt.create_sync_message(self.doc)
+
+    def initial_frames(self, state_vector=None):
+        """
+        Frames sent to a client right after it joins.  Given the client's
+        state vector (see handshake.py), the first frame is the sync step 2
+        it is missing; the server's sync step 1 follows only if the client
+        may hold changes the server lacks.
+        """
+        frames = []
+        if state_vector is not None:
+            try:
+                update = self.doc.get_update(state_vector)
+            except Exception:
+                state_vector = None  # malformed: fall back to the regular handshake
+            else:
+                frames.append(
+                    bytes((Y_SYNC_MESSAGE_TYPE, pycrdt.YSyncMessageType.SYNC_STEP2))
+                    + pycrdt.write_message(update)
+                )
+        if state_vector != EMPTY_STATE_VECTOR:
+            frames.append(self.create_sync_message())
+        awareness = self.awareness.full_state_message()
+        if awareness:
+            frames.append(awareness)
+        return frames
+
+    def handle_awareness_message(self, payload, channel_name):
+        """Merge an awareness frame from `channel_name` into the store."""
+        update = pycrdt.Decoder(payload).read_message()
+        if update:
+            self.awareness.apply(update, channel_name)
+
+    async def close(self):
+        """Stop observing, cancel the pending save and persist one last time."""
+        self.awareness.close()
+        await self.unload()
+
+    async def unload(self):
+        """
+        Flush and drop the in-memory doc while keeping the session (users,
+        room, awareness) alive; ensure_loaded() brings it back from disk.
+        """
+        async with self.load_lock:
+            if not self.loaded:
+                return
+            self.loaded = False
+            self.doc.unobserve(self.subscription)
+            await self.broadcaster.flush()
+
+            # Force a final save (replacing any pending write-behind flush)
+            # to ensure nothing is lost.
+            await self.save_to_disk_immediate()
+
+            # Record the final version, and let running background writes
+            # finish so they are not cut off mid-write.
+            await self.take_snapshot()
+            for task in (self.compact_task, self.snapshot_task):
+                if task and not task.done():
+                    try:
+                        await task
+                    except Exception:
+                        pass
+
+            self.doc = pycrdt.Doc()
+            self.subscription = None
+            self.size_estimate = 0
+
+    # -------------------------------------------------------------------------
+    # Disk I/O helpers
+    # -------------------------------------------------------------------------
+
+    async def get_full_path(self):
+        try:
+            root_path = await repository_path_cache.aget_root_path(self.project_id)
+            if root_path:
+                return resolve_file_path(root_path, self.file_path)
+        except Exception:
+            logger.exception('session.path_error', 'Error resolving path', doc=self.doc_key)
+        return None
+
+    async def read_file_from_disk(self) -> str:
+        full_path = await self.get_full_path()
+        if full_path and os.path.exists(full_path):
+            try:
+                def _read():
+                    with open(full_path, 'r', encoding='utf-8') as f:
+                        return f.read()
+                return await asyncio.to_thread(_read)
+            except Exception:
+                logger.exception('session.read_error', 'Error reading file', doc=self.doc_key)
+        return ""
+
+    async def read_crdt_state_from_disk(self):
+        """
+        Read the persisted Yjs state: the .ystate snapshot followed by every
+        update appended to the .ylog tail since.  Returns a list of updates
+        to apply in order, or None if nothing is persisted / readable.
+        """
+        full_path = await self.get_full_path()
+        if not full_path:
+            return None
+
+        try:
+            updates = await asyncio.to_thread(UpdateLog(full_path).read)
+            return updates or None
+        except Exception:
+            logger.exception('session.read_error', 'Error reading CRDT state', doc=self.doc_key)
+            return None
+
+    # -------------------------------------------------------------------------
+    # Save (write-behind)
+    # -------------------------------------------------------------------------
+
+    def trigger_save(self):
+        write_behind_flusher.mark_dirty(self)
+
+    async def save_to_disk_immediate(self):
+        try:
+            await write_behind_flusher.flush_now(self)
+        except Exception:
+            logger.exception('doc.save_failed', 'Error saving file', doc=self.doc_key)
+
+    async def prepare_save(self):
+        """
+        Capture what needs writing while on the event loop (pycrdt docs are
+        not shared with the I/O threads).  Called by the flusher with
+        write_lock held; returns None when there is nowhere to write.
+
+        Parts that did not change are left out of the job: the CRDT log when
+        no update happened since the last flush (e.g. awareness-only
+        activity), the text file when its content hash matches what is on
+        disk (e.g. an edit undone back to the saved content).
+        """
+        # No live doc: never loaded, or already unloaded after its final save.
+        if self.subscription is None:
+            return None
+
+        full_path = await self.get_full_path()
+        if not full_path:
+            return None
+
+        base = self.persisted_state_vector
+        if not self.dirty and base is not None:
+            return _SaveJob(full_path)
+
+        doc = self.doc
+        text_content = str(doc.get('monaco', type=pycrdt.Text))
+        text_hash = _text_hash(text_content)
+        self.dirty = False
+
+        # Persist only what changed since the last save.  The diff against
+        # the persisted state vector carries the new structs plus the delete
+        # set, so deletions are captured as well.
+        return _SaveJob(
+            full_path,
+            text_content=text_content if text_hash != self.persisted_text_hash else None,
+            text_hash=text_hash,
+            update=doc.get_update(base) if base is not None else doc.get_update(),
+            snapshot=base is None,
+            state_vector=doc.get_state(),
+            disk_stat=self.disk_stat,
+        )
+
+    def finish_save(self, job, result):
+        """Record the outcome of a job written by the flusher."""
+        if isinstance(result, Exception):
+            # Whatever the job carried is not on disk: queue the document
+            # again, backing off while the failure persists.
+            self.dirty = True
+            self.save_failures += 1
+            logger.error(
+                'doc.save_failed', 'Error saving file',
+                doc=self.doc_key, path=job.full_path, error=str(result), failures=self.save_failures,
+            )
+            write_behind_flusher.retry(self, self.save_failures)
+            return
+        self.save_failures = 0
+
+        if job.disk_changed:
+            # The file was changed behind the session and was left alone;
+            # merge it into the doc instead.
+            logger.warning('doc.disk_changed', 'File changed on disk; merging instead of overwriting', doc=self.doc_key)
+            self.schedule_reconcile()
+        elif job.text_content is not None:
+            self.persisted_text_hash = job.text_hash
+            self.disk_stat = job.disk_stat
+        if job.update is None:
+            return
+
+        self.persisted_state_vector = job.state_vector
+        logger.info(
+            'doc.saved', 'Saved',
+            doc=self.doc_key, crdt_bytes=len(job.update),
+            text_written=job.text_content is not None,
+        )
+
+        if result > UPDATE_LOG_COMPACT_BYTES:
+            self.schedule_compaction()
+        if time.time() - self.last_snapshot_at >= SNAPSHOT_INTERVAL_SECONDS:
+            self.schedule_snapshot()
+
+    def schedule_compaction(self):
+        if self.compact_task is None or self.compact_task.done():
+            self.compact_task = asyncio.create_task(self.compact_update_log())
+
+    def schedule_snapshot(self):
+        if self.snapshot_task is None or self.snapshot_task.done():
+            self.snapshot_task = asyncio.create_task(self.take_snapshot())
+
+    def has_unsnapshotted_changes(self) -> bool:
+        # No subscription: unloaded, and the doc is an empty placeholder.
+        return self.subscription is not None and self.doc.get_state() != self.snapshot_state_vector
+
+    async def take_snapshot(self):
+        """Append the current version to the .yhist sidecar if it changed."""
+        try:
+            if not self.has_unsnapshotted_changes():
+                return
+
+            async with self.write_lock:
+                # Resolved under the lock: the file may have moved meanwhile.
+                full_path = await self.get_full_path()
+                if not full_path:
+                    return
+                state_vector = self.doc.get_state()
+                keyframe = (
+                    self.keyframe_due
+                    or self.deltas_since_keyframe + 1 >= SNAPSHOT_KEYFRAME_EVERY
+                )
+                update = (
+                    self.doc.get_update() if keyframe
+                    else self.doc.get_update(self.snapshot_state_vector)
+                )
+                timestamp = time.time()
+                await asyncio.get_running_loop().run_in_executor(
+                    write_behind_flusher.executor,
+                    DocumentHistory(full_path).append, timestamp, update, keyframe,
+                )
+                self.snapshot_state_vector = state_vector
+                self.keyframe_due = False
+                self.last_snapshot_at = timestamp
+                self.deltas_since_keyframe = 0 if keyframe else self.deltas_since_keyframe + 1
+        except Exception:
+            logger.exception('snapshot.error', 'Error writing version snapshot', doc=self.doc_key)
+
+    async def compact_update_log(self):
+        """Fold the sidecars into one compact .ystate snapshot (see compaction.py)."""
+        try:
+            async with self.write_lock:
+                full_path = await self.get_full_path()
+                if not full_path:
+                    return
+                log = UpdateLog(full_path)
+                loop = asyncio.get_running_loop()
+                executor = write_behind_flusher.executor
+                before = await loop.run_in_executor(executor, log.size)
+                await loop.run_in_executor(executor, log.rewrite, compact_updates)
+                after = await loop.run_in_executor(executor, log.size)
+                # The rewrite covers what was on disk; changes made since are
+                # still marked dirty and reach the new snapshot's log as usual.
+                self.compacted = not self.dirty
+            session_manager.bytes_compacted += max(0, before - after)
+            logger.info(
+                'doc.compacted', 'Compacted CRDT history',
+                doc=self.doc_key, bytes_before=before, bytes_after=after,
+            )
+        except Exception:
+            logger.exception('compact.error', 'Error compacting update log', doc=self.doc_key)
+
+
+def _text_hash(text_content):
+    return hashlib.sha1(text_content.encode('utf-8')).digest()
+
+
+def _disk_stat(full_path):
+    """(mtime_ns, size) of a file, or None if it does not exist."""
+    try:
+        st = os.stat(full_path)
+    except OSError:
+        return None
+    return (st.st_mtime_ns, st.st_size)
+
+
+def _read_text_with_stat(full_path):
+    """Blocking read of (text, stat) of a file, or None if it does not exist."""
+    stat = _disk_stat(full_path)
+    if stat is None:
+        return None
+    with open(full_path, 'r', encoding='utf-8') as f:
+        return f.read(), stat
+
+
+class _SaveJob:
+    """
+    Everything one flush writes for a document, ready for an I/O thread.
+    `text_content` / `update` are None for the parts that are skipped.
+    `disk_stat` is the file's stat as the session last saw it; if the file
+    no longer matches, the text is not written (see finish_save).
+    """
+
+    def __init__(self, full_path, text_content=None, text_hash=None,
+                 update=None, snapshot=False, state_vector=None, disk_stat=None):
+        self.full_path = full_path
+        self.text_content = text_content
+        self.text_hash = text_hash
+        self.update = update
+        self.snapshot = snapshot
+        self.state_vector = state_vector
+        self.disk_stat = disk_stat
+        self.disk_changed = False
+        # Bytes actually written, filled in by write().
+        self.text_bytes = 0
+        self.crdt_bytes = 0
+
+    @property
+    def is_noop(self) -> bool:
+        return self.text_content is None and self.update is None
+
+    def write(self) -> int:
+        """Blocking write; returns the update log size afterwards."""
+        os.makedirs(os.path.dirname(self.full_path), exist_ok=True)
+
+        # Persist the human-readable text file (for git, plain access, etc.)
+        if self.text_content is not None:
+            if self.disk_stat is not None and _disk_stat(self.full_path) != self.disk_stat:
+                self.disk_changed = True
+            else:
+                with open(self.full_path, 'w', encoding='utf-8') as f:
+                    f.write(self.text_content)
+                    self.text_bytes = f.tell()
+                self.disk_stat = _disk_stat(self.full_path)
+
+        # Persist the Yjs state so that reconnecting clients share the same
+        # document identity and history, enabling clean CRDT merge instead
+        # of re-bootstrapping from text.
+        if self.update is None:
+            return 0
+        self.crdt_bytes = len(self.update)
+        log = UpdateLog(self.full_path)
+        if self.snapshot:
+            log.compact(self.update)
+            return 0
+        return log.append(self.update)
+
+
+# -----------------------------------------------------------------------------
+# Session lifecycle
+# -----------------------------------------------------------------------------
+
+class DocumentSessionManager:
+    """
+    Owns the lifecycle of the sessions in `active_documents`.
+
+    Besides create/join/leave it enforces a memory budget: a periodic sweep
+    unloads documents that have been idle for `idle_seconds` (after a final
+    flush) and, while the estimated total is still over `budget_bytes`,
+    the least recently active ones.  This also covers sessions kept alive
+    by leaked connections or crashed clients whose user count never drops
+    to zero.  Unloaded sessions reload themselves on their next frame.
+
+    `presence` records which connections (and users) are in which of
+    these documents, per project; see presence.py.
+
+    `shutdown()` drains the worker: see shutdown.py for the server hooks.
+    """
+
+    def __init__(self, budget_bytes, idle_seconds, sweep_seconds):
+        self.budget_bytes = budget_bytes
+        self.idle_seconds = idle_seconds
+        self.sweep_seconds = sweep_seconds
+        self.evictions = 0
+        self.rehydrations = 0
+        self.bytes_compacted = 0
+        # Set once the worker is shutting down: no new clients or sync frames.
+        self.draining = False
+        # Old doc_key -> new doc_key of sessions re-keyed by move(), for
+        # frames and leaves still in flight from clients not yet switched.
+        self.moved_keys = {}
+        self.presence = PresenceIndex(
+            EDITOR_CHANNEL_LAYER, PRESENCE_INTERVAL_SECONDS, PRESENCE_REFRESH_SECONDS
+        )
+        self._sweeper = None
+        self._disk_checker = None
+
+    def ensure_started(self):
+        loop = asyncio.get_running_loop()
+        if self._sweeper is None or self._sweeper.done():
+            self._sweeper = loop.create_task(self._sweep_forever())
+        if DISK_CHECK_SECONDS and (self._disk_checker is None or self._disk_checker.done()):
+            self._disk_checker = loop.create_task(self._check_disk_forever())
+
+    def session_for(self, doc_key):
+        """The live session for `doc_key`, following moves, or None."""
+        session = active_documents.get(doc_key)
+        if session is None and doc_key in self.moved_keys:
+            session = active_documents.get(self.moved_keys[doc_key])
+        return session
+
+    async def join(self, doc_key, project_id, file_path, room_group_name,
+                   channel_name=None, user=None):
+        """
+        Create or join an in-memory document session.  The connection
+        `channel_name` of `user` (see presence.presence_user) is added to
+        the presence index.
+
+        A per-doc asyncio.Lock prevents two concurrent connections from both
+        finding the session absent and each initialising a separate document.
+        """
+        self.ensure_started()
+
+        waited_from = time.perf_counter()
+        async with _session_lock(doc_key):
+            SESSION_LOCK_WAIT_SECONDS.observe(time.perf_counter() - waited_from, op='join')
+            session = active_documents.get(doc_key)
+            if session is None:
+                await check_document_size(project_id, file_path)
+                session = DocumentSession(doc_key, project_id, file_path, room_group_name)
+                await session.load()
+                session.users = 1
+                active_documents[doc_key] = session
+                self.moved_keys.pop(doc_key, None)
+                logger.info('session.created', 'New session created', doc=doc_key)
+            else:
+                await session.ensure_loaded()
+                session.users += 1
+                logger.info('session.users', 'Joined existing session', doc=doc_key, users=session.users)
+            self.presence.add(session.project_id, session.file_path, channel_name, user)
+            return session
+
+    async def leave(self, doc_key, channel_name):
+        """Drop one user from a session, persisting and releasing it on the last."""
+        session = self.session_for(doc_key)
+        if session is not None:
+            doc_key = session.doc_key
+
+        waited_from = time.perf_counter()
+        async with _session_lock(doc_key):
+            SESSION_LOCK_WAIT_SECONDS.observe(time.perf_counter() - waited_from, op='leave')
+            session = active_documents.get(doc_key)
+            if session is None:
+                return
+
+            session.awareness.remove_channel(channel_name)
+            self.presence.remove(session.project_id, session.file_path, channel_name)
+            trace_recorder.connection_closed(doc_key, channel_name)
+            session.users -= 1
+            remaining = session.users
+            logger.info('session.users', 'User left', doc=doc_key, users=remaining)
+
+            if remaining > 0:
+                return
+
+            # Last user left — persist and release.
+            await session.close()
+            del active_documents[doc_key]
+            trace_recorder.close(doc_key)
+            for old_key in [k for k, v in self.moved_keys.items() if v == doc_key]:
+                del self.moved_keys[old_key]
+
+        logger.info('session.ended', 'Session ended', doc=doc_key)
+
+    # -------------------------------------------------------------------------
+    # Eviction
+    # -------------------------------------------------------------------------
+
+    def memory_usage(self) -> int:
+        return sum(s.size_estimate for s in active_documents.values() if s.loaded)
+
+    async def _sweep_forever(self):
+        while True:
+            await asyncio.sleep(self.sweep_seconds)
+            try:
+                await self.sweep()
+            except Exception:
+                logger.exception('sweep.error', 'Error sweeping idle sessions')
+
+    async def sweep(self):
+        """
+        Unload idle documents, then LRU documents while over budget.  Documents
+        that stay loaded but have gone quiet get a version snapshot and their
+        sidecars compacted.
+        """
+        now = time.monotonic()
+        loaded = sorted(
+            (s for s in active_documents.values() if s.loaded),
+            key=lambda s: s.last_activity,
+        )
+        usage = sum(s.size_estimate for s in loaded)
+
+        for session in loaded:
+            idle = now - session.last_activity
+            over_budget = usage > self.budget_bytes
+            if idle < self.idle_seconds and not (
+                over_budget and idle >= _MIN_IDLE_SECONDS_UNDER_PRESSURE
+            ):
+                if idle >= COMPACT_IDLE_SECONDS:
+                    if session.has_unsnapshotted_changes():
+                        session.schedule_snapshot()
+                    if not session.compacted:
+                        session.schedule_compaction()
+                continue
+            size = session.size_estimate
+            await session.unload()
+            usage -= size
+            self.evictions += 1
+            logger.info(
+                'session.evicted', 'Evicted session',
+                doc=session.doc_key, idle_seconds=round(idle), bytes=size, users=session.users,
+            )
+
+    # -------------------------------------------------------------------------
+    # Moves
+    # -------------------------------------------------------------------------
+
+    async def move(self, project_id, old_path, new_path, move_files=None, is_local=None):
+        """
+        Follow a file or folder moved from `old_path` to `new_path` without
+        tearing its live sessions down.
+
+        `move_files` (blocking, optional) performs the move on disk while
+        the affected sessions' write locks are held, so no save lands on
+        either path half-way.  Each session is then re-keyed in place: its
+        doc, users and awareness stay, only the key, file path and room
+        change.  A session whose new key belongs to another worker
+        (`is_local(new_key)` is false) cannot move there; it keeps its key,
+        saves to the new path and is flushed, and its clients rejoin the
+        new owner, which loads the moved sidecars.
+
+        Every client of a moved document is told through the old room
+        (`document_moved`), switches rooms and resyncs from its last known
+        state vector, which covers broadcasts sent while it was switching.
+        Returns the number of sessions moved.
+        """
+        project_id = str(project_id)
+        moves = []
+        for session in list(active_documents.values()):
+            new_file_path = moved_path(session.file_path, old_path, new_path)
+            if session.project_id == project_id and new_file_path is not None:
+                moves.append((session, new_file_path))
+        moves.sort(key=lambda move: move[0].doc_key)
+
+        events = []
+        handed_over = []
+        locked = []
+        try:
+            for session, _ in moves:
+                await session.write_lock.acquire()
+                locked.append(session)
+            if move_files:
+                await asyncio.to_thread(move_files)
+
+            for session, new_file_path in moves:
+                old_key, old_room = session.doc_key, session.room_group_name
+                new_key = document_key(project_id, new_file_path)
+                new_room = room_group_name_for(project_id, new_file_path)
+                rejoin = (is_local is not None and not is_local(new_key)) or new_key in active_documents
+                self.presence.move(project_id, session.file_path, new_file_path)
+                if rejoin:
+                    session.file_path = new_file_path
+                    handed_over.append(session)
+                else:
+                    # Updates still pending belong to the old room's clients.
+                    await session.broadcaster.flush()
+                    session.rekey(new_key, new_file_path, new_room)
+                    active_documents[new_key] = active_documents.pop(old_key)
+                    for key, target in list(self.moved_keys.items()):
+                        if target == old_key:
+                            self.moved_keys[key] = new_key
+                    self.moved_keys[old_key] = new_key
+                events.append((old_room, {
+                    'type': 'document_moved',
+                    'old_doc_key': old_key,
+                    'doc_key': new_key,
+                    'file_path': new_file_path,
+                    'room_group_name': new_room,
+                    'rejoin': rejoin,
+                }))
+                logger.info(
+                    'session.moved', 'Moved live document',
+                    doc=old_key, to=new_key, rejoin=rejoin, users=session.users,
+                )
+        finally:
+            for session in locked:
+                session.write_lock.release()
+
+        for session in handed_over:
+            await session.save_to_disk_immediate()
+        layer = get_channel_layer(EDITOR_CHANNEL_LAYER)
+        for room_group_name, event in events:
+            await layer.group_send(room_group_name, event)
+        return len(events)
+
+    # -------------------------------------------------------------------------
+    # External changes
+    # -------------------------------------------------------------------------
+
+    async def _check_disk_forever(self):
+        while True:
+            await asyncio.sleep(DISK_CHECK_SECONDS)
+            try:
+                await self.check_disk()
+            except Exception:
+                logger.exception('disk_check.error', 'Error checking files for changes')
+
+    async def check_disk(self):
+        """
+        Merge files changed on disk into their loaded documents.  One stat()
+        per document, all on a single thread; only documents whose stat moved
+        are read and diffed.
+        """
+        loaded = [s for s in active_documents.values() if s.loaded]
+        paths = [await s.get_full_path() for s in loaded]
+        stats = await asyncio.to_thread(lambda: [_disk_stat(p) if p else None for p in paths])
+        for session, stat in zip(loaded, stats):
+            if stat is not None and stat != session.disk_stat:
+                session.schedule_reconcile()
+
+    # -------------------------------------------------------------------------
+    # Shutdown
+    # -------------------------------------------------------------------------
+
+    async def shutdown(self, deadline=None) -> dict:
+        """
+        Persist every live document before the worker exits.
+
+        From here on new connections and sync frames are refused; their
+        clients reconnect to another worker and send their unsaved edits
+        there.  Every document with unsaved changes (or a write in flight) is
+        flushed as its own task, so one slow write delays only its own
+        document while the flusher's thread pool bounds disk concurrency.
+        Gives up after `deadline` seconds and returns the doc keys that were
+        saved, failed or timed out.
+        """
+        deadline = SHUTDOWN_DEADLINE_SECONDS if deadline is None else deadline
+        self.draining = True
+        for task in (self._sweeper, self._disk_checker):
+            if task is not None:
+                task.cancel()
+
+        started = time.monotonic()
+        pending = [
+            session for session in active_documents.values()
+            if session.subscription is not None
+            and (session.dirty or session.write_lock.locked())
+        ]
+        tasks = {
+            asyncio.create_task(write_behind_flusher.flush_now(session)): session
+            for session in pending
+        }
+        done, not_done = set(), set()
+        if tasks:
+            done, not_done = await asyncio.wait(tasks, timeout=deadline)
+        for task in not_done:
+            task.cancel()
+
+        result = {'saved': [], 'failed': [], 'timed_out': []}
+        for task, session in tasks.items():
+            if task in not_done:
+                result['timed_out'].append(session.doc_key)
+            elif task.exception() is not None or session.dirty:
+                result['failed'].append(session.doc_key)
+            else:
+                result['saved'].append(session.doc_key)
+
+        logger.info(
+            'shutdown.flushed', 'Flushed live documents for shutdown',
+            documents=len(active_documents), saved=len(result['saved']),
+            failed=len(result['failed']), timed_out=len(result['timed_out']),
+            seconds=round(time.monotonic() - started, 3), saved_documents=result['saved'],
+        )
+        for outcome in ('failed', 'timed_out'):
+            for doc_key in result[outcome]:
+                logger.error('shutdown.not_saved', 'Document not saved before shutdown', doc=doc_key, outcome=outcome)
+        return result
+
+    def stats(self) -> dict:
+        loaded = [s for s in active_documents.values() if s.loaded]
+        return {
+            'documents': len(active_documents),
+            'loaded': len(loaded),
+            'estimated_bytes': sum(s.size_estimate for s in loaded),
+            'budget_bytes': self.budget_bytes,
+            'evictions': self.evictions,
+            'rehydrations': self.rehydrations,
+            'bytes_compacted': self.bytes_compacted,
+        }
+
+
+def _documents_by_users():
+    # Cumulative buckets, so the series stay fixed however many files are open.
+    users = [session.users for session in list(active_documents.values())]
+    buckets = {
+        str(bound): sum(1 for count in users if count <= bound)
+        for bound in _DOCUMENT_USERS_BUCKETS
+    }
+    buckets['+Inf'] = len(users)
+    return buckets
+
+
+def _part_totals(part, keys):
+    # Counters of one per-session part summed over the documents held here.
+    totals = dict.fromkeys(keys, 0)
+    for session in list(active_documents.values()):
+        stats = getattr(session, part).stats()
+        for key in keys:
+            totals[key] += stats[key]
+    return totals
+
+
+# Global instance
+session_manager = DocumentSessionManager(
+    MEMORY_BUDGET_BYTES, IDLE_EVICT_SECONDS, EVICTION_SWEEP_SECONDS
+)
+
+metrics.gauge(
+    'editor_active_documents', 'Documents held by this worker',
+    lambda: len(active_documents),
+)
+metrics.gauge(
+    'editor_document_users', 'Users connected to documents held by this worker',
+    lambda: sum(session.users for session in list(active_documents.values())),
+)
+metrics.gauge(
+    'editor_documents_by_users', 'Documents with at most `le` connected users',
+    _documents_by_users,
+    ('le',),
+)
+metrics.register_stats('editor_sessions', session_manager.stats)
+metrics.register_stats(
+    'editor_broadcast',
+    lambda: _part_totals('broadcaster', ('messages_in', 'messages_out')),
+)
+metrics.register_stats(
+    'editor_awareness',
+    lambda: _part_totals('awareness', ('clients', 'frames_in', 'frames_out', 'entries_dropped')),
+)
+metrics.register_stats('editor_presence', session_manager.presence.stats)
+metrics.register_stats('editor_path_cache', repository_path_cache.stats)
@@ -0,0 +1,52 @@
+import asyncio
+import sys
+from sagile_ide.log import get_logger
+from .sessions import session_manager
+
+logger = get_logger(__name__)
+
+_installed = False
+
+
+async def flush_for_shutdown():
+    try:
+        await session_manager.shutdown()
+    except Exception:
+        logger.exception('shutdown.error', 'Error flushing documents for shutdown')
+
+
+def install_shutdown_hook():
+    """
+    Run session_manager.shutdown() when daphne stops (idempotent).
+
+    Daphne does not implement the ASGI lifespan protocol; on SIGTERM it
+    stops the Twisted reactor, which first fires the "before shutdown"
+    triggers and waits for the Deferreds they return.  The reactor runs on
+    this asyncio loop, so the flush can run there as a plain coroutine.
+    Must be called from inside the running server (the reactor has to be
+    installed already), e.g. on the first ASGI call.
+    """
+    global _installed
+    if _installed:
+        return
+    _installed = True
+    reactor = sys.modules.get('twisted.internet.reactor')
+    if reactor is None:
+        return
+    from twisted.internet.defer import Deferred
+    reactor.addSystemEventTrigger(
+        'before', 'shutdown',
+        lambda: Deferred.fromFuture(asyncio.ensure_future(flush_for_shutdown())),
+    )
+
+
+async def lifespan(scope, receive, send):
+    """ASGI lifespan handler for servers that speak it (uvicorn, hypercorn)."""
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await flush_for_shutdown()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
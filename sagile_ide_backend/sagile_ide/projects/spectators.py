@@ -0,0 +1,167 @@
+import asyncio
+from urllib.parse import parse_qs
+import pycrdt
+from channels.layers import get_channel_layer
+from sagile_ide.log import get_logger
+from .compression import compress_frame
+from .metrics import metrics
+from .outbound import FRAME_AWARENESS, FRAME_UPDATE
+from .sessions import EDITOR_CHANNEL_LAYER, Y_SYNC_MESSAGE_TYPE
+
+logger = get_logger(__name__)
+
+SPECTATOR_FRAMES_REJECTED = metrics.counter(
+    'editor_spectator_frames_rejected_total', 'Frames from read-only spectators that were dropped'
+)
+
+_EVENT_KINDS = {
+    'editor_update': FRAME_UPDATE,
+    'awareness_update': FRAME_AWARENESS,
+}
+
+
+def is_spectator(scope) -> bool:
+    """True when the client connected read-only (`?mode=view`)."""
+    query = parse_qs(scope.get('query_string', b'').decode('latin-1'))
+    return 'view' in query.get('mode', [])
+
+
+def spectator_frame_allowed(frame) -> bool:
+    """Spectators may only ask for state (sync step 1), never send changes."""
+    return (
+        len(frame) >= 2
+        and frame[0] == Y_SYNC_MESSAGE_TYPE
+        and frame[1] == pycrdt.YSyncMessageType.SYNC_STEP1
+    )
+
+
+class _SpectatorRoom:
+    def __init__(self, doc_key, room_group_name):
+        self.doc_key = doc_key
+        self.room_group_name = room_group_name
+        self.spectators = set()
+        self.channel = None
+        self.task = None
+
+
+class SpectatorHub:
+    """
+    Fan-out of room broadcasts to the read-only spectators on this worker.
+
+    Editing connections join the room group, so every broadcast is copied
+    through the channel layer once per member.  Spectators do not: per
+    document, the hub joins the room with a single channel of its own and
+    hands each broadcast (compressed at most once) to every local
+    spectator's OutboundQueue, so hundreds of viewers cost the channel
+    layer one delivery per worker.  Each spectator keeps its own bounded
+    queue and is resynced like any other slow client.
+    """
+
+    def __init__(self, layer_alias):
+        self.layer_alias = layer_alias
+        self.rooms = {}
+        self.events_in = 0
+        self.frames_out = 0
+
+    @property
+    def layer(self):
+        return get_channel_layer(self.layer_alias)
+
+    async def add(self, doc_key, room_group_name, consumer):
+        room = self.rooms.get(doc_key)
+        if room is not None:
+            room.spectators.add(consumer)
+            return
+        room = self.rooms[doc_key] = _SpectatorRoom(doc_key, room_group_name)
+        room.spectators.add(consumer)
+
+        channel = await self.layer.new_channel('editor-spectators.')
+        await self.layer.group_add(room_group_name, channel)
+        room.channel = channel
+        if self.rooms.get(doc_key) is not room:
+            # Everyone left while the room was being set up.
+            await self.layer.group_discard(room_group_name, channel)
+            return
+        room.task = asyncio.create_task(self._listen(room))
+
+    async def remove(self, doc_key, consumer):
+        room = self.rooms.get(doc_key)
+        if room is None:
+            return
+        room.spectators.discard(consumer)
+        if room.spectators:
+            return
+        del self.rooms[doc_key]
+        if room.task:
+            room.task.cancel()
+        if room.channel:
+            await self.layer.group_discard(room.room_group_name, room.channel)
+
+    async def _listen(self, room):
+        try:
+            while True:
+                event = await self.layer.receive(room.channel)
+                if event.get('type') == 'document_moved':
+                    if not await self._move(room, event):
+                        return
+                    continue
+                kind = _EVENT_KINDS.get(event.get('type'))
+                if kind is None:
+                    continue
+                self.events_in += 1
+                frame = event['bytes_data']
+                compressed = None
+                for spectator in list(room.spectators):
+                    if spectator.compress:
+                        if compressed is None:
+                            compressed = await compress_frame(frame)
+                        out = compressed
+                    else:
+                        out = frame
+                    spectator.outbound.put(kind, room.doc_key, out, event.get('state_vector'))
+                    self.frames_out += 1
+        except asyncio.CancelledError:
+            pass
+        except Exception:
+            logger.exception('spectators.error', 'Error fanning out to spectators', doc=room.doc_key)
+
+    async def _move(self, room, event):
+        """
+        Follow a moved document (see DocumentSessionManager.move) and pass
+        the event on to each spectator.  Returns False when the room was
+        merged into one already open for the new path.
+        """
+        old_room_group = room.room_group_name
+        if self.rooms.get(room.doc_key) is room:
+            del self.rooms[room.doc_key]
+        target = self.rooms.get(event['doc_key'])
+        if target is not None:
+            target.spectators |= room.spectators
+        else:
+            room.doc_key = event['doc_key']
+            room.room_group_name = event['room_group_name']
+            self.rooms[room.doc_key] = room
+            await self.layer.group_add(room.room_group_name, room.channel)
+
+        # In the new room before the spectators resync, so nothing is missed.
+        for spectator in list(room.spectators):
+            await self.layer.send(spectator.channel_name, event)
+        await self.layer.group_discard(old_room_group, room.channel)
+        return target is None
+
+    def spectator_count(self) -> int:
+        return sum(len(room.spectators) for room in self.rooms.values())
+
+    def stats(self) -> dict:
+        return {
+            'documents': len(self.rooms),
+            'spectators': self.spectator_count(),
+            'events_in': self.events_in,
+            'frames_out': self.frames_out,
+        }
+
+
+# Global instance
+spectator_hub = SpectatorHub(EDITOR_CHANNEL_LAYER)
+
+metrics.register_stats('editor_spectators', spectator_hub.stats)
@@ -0,0 +1,113 @@
+import difflib
+from django.conf import settings
+
+# Changed regions spanning more lines than this (old + new) are replaced as a
+# whole instead of being diffed line by line, which keeps reconciling a huge
+# rewrite linear in the file size.
+LINE_DIFF_MAX_LINES = getattr(settings, 'EDITOR_RECONCILE_LINE_DIFF_MAX_LINES', 20000)
+
+_BLOCK = 4096
+
+
+def _common_prefix_length(a, b, limit):
+    """Length of the common prefix of a and b, at most `limit`."""
+    i = 0
+    # Compare block-wise first: slice comparison is a memcmp.
+    while i + _BLOCK <= limit and a[i:i + _BLOCK] == b[i:i + _BLOCK]:
+        i += _BLOCK
+    while i < limit and a[i] == b[i]:
+        i += 1
+    return i
+
+
+def _common_suffix_length(a, b, limit):
+    """Length of the common suffix of a and b, at most `limit`."""
+    la, lb = len(a), len(b)
+    i = 0
+    while i + _BLOCK <= limit and a[la - i - _BLOCK:la - i] == b[lb - i - _BLOCK:lb - i]:
+        i += _BLOCK
+    while i < limit and a[la - i - 1] == b[lb - i - 1]:
+        i += 1
+    return i
+
+
+def _lines(text):
+    """Split on '\\n' only, keeping the line ends (unlike str.splitlines)."""
+    parts = text.split('\n')
+    lines = [part + '\n' for part in parts[:-1]]
+    if parts[-1]:
+        lines.append(parts[-1])
+    return lines
+
+
+def _utf8_len(text):
+    return len(text.encode('utf-8'))
+
+
+def _trimmed_edit(offset, old, new):
+    """One edit replacing `old` at byte `offset` by `new`, minus their common ends."""
+    prefix = _common_prefix_length(old, new, min(len(old), len(new)))
+    suffix = _common_suffix_length(old, new, min(len(old), len(new)) - prefix)
+    return (
+        offset + _utf8_len(old[:prefix]),
+        _utf8_len(old[prefix:len(old) - suffix]),
+        new[prefix:len(new) - suffix],
+    )
+
+
+def text_edits(old, new):
+    """
+    Edits turning `old` into `new`, as (byte offset, byte length, insert)
+    triples in ascending order of offset into `old`.  Offsets are UTF-8
+    byte offsets, the unit pycrdt.Text indexes by.
+
+    The common prefix and suffix are skipped first, so a small change to a
+    large file costs a couple of memcmp passes.  The region in between is
+    diffed line by line (difflib) when it spans at most LINE_DIFF_MAX_LINES
+    lines, each changed run trimmed again down to the characters that differ;
+    larger regions become a single replacement.
+    """
+    limit = min(len(old), len(new))
+    prefix = _common_prefix_length(old, new, limit)
+    if prefix == len(old) == len(new):
+        return []
+    suffix = _common_suffix_length(old, new, limit - prefix)
+
+    # Widen the changed region to whole lines so the line diff aligns.
+    prefix = old.rfind('\n', 0, prefix) + 1
+    if suffix:
+        tail = old[len(old) - suffix:]
+        newline = tail.find('\n')
+        suffix = suffix - newline - 1 if newline != -1 else 0
+
+    old_mid = old[prefix:len(old) - suffix]
+    new_mid = new[prefix:len(new) - suffix]
+    offset = _utf8_len(old[:prefix])
+
+    old_lines = _lines(old_mid)
+    new_lines = _lines(new_mid)
+    if len(old_lines) + len(new_lines) > LINE_DIFF_MAX_LINES:
+        return [_trimmed_edit(offset, old_mid, new_mid)]
+
+    line_offsets = [offset]
+    for line in old_lines:
+        line_offsets.append(line_offsets[-1] + _utf8_len(line))
+
+    edits = []
+    matcher = difflib.SequenceMatcher(None, old_lines, new_lines, autojunk=False)
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == 'equal':
+            continue
+        edits.append(_trimmed_edit(
+            line_offsets[i1], ''.join(old_lines[i1:i2]), ''.join(new_lines[j1:j2])
+        ))
+    return edits
+
+
+def apply_text_edits(text, edits):
+    """Apply `text_edits()` output to a pycrdt.Text (inside a transaction)."""
+    for offset, length, insert in reversed(edits):
+        if length:
+            del text[offset:offset + length]
+        if insert:
+            text.insert(offset, insert)
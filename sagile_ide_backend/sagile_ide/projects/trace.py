@@ -0,0 +1,136 @@
+import os
+import re
+import time
+import pycrdt
+from django.conf import settings
+from sagile_ide.log import get_logger
+
+logger = get_logger(__name__)
+
+# Trace file layout:
+#   TRACE_MAGIC, varuint len + doc_key (utf-8), then records of
+#   kind (1 byte), varuint microseconds since the previous record,
+#   varuint connection number, varuint len + payload.
+TRACE_MAGIC = b'YTRACE1\n'
+TRACE_SUFFIX = '.ytrace'
+TRACE_BASE = 0      # payload: full document state when recording started
+TRACE_FRAME = 1     # payload: inbound y-protocol sync frame
+TRACE_CLOSE = 2     # connection went away (empty payload)
+
+
+class _TraceWriter:
+    def __init__(self, path, doc_key, base_state):
+        self.file = open(path, 'ab', buffering=64 * 1024)
+        self.last = time.monotonic()
+        self.connections = {}
+        self.file.write(TRACE_MAGIC + pycrdt.write_var_uint(len(doc_key.encode('utf-8'))))
+        self.file.write(doc_key.encode('utf-8'))
+        self.write(TRACE_BASE, 0, base_state)
+
+    def connection(self, channel_name):
+        number = self.connections.get(channel_name)
+        if number is None:
+            number = self.connections[channel_name] = len(self.connections) + 1
+        return number
+
+    def write(self, kind, connection, payload):
+        now = time.monotonic()
+        delta_us = int((now - self.last) * 1_000_000)
+        self.last = now
+        self.file.write(
+            bytes((kind,))
+            + pycrdt.write_var_uint(delta_us)
+            + pycrdt.write_var_uint(connection)
+            + pycrdt.write_var_uint(len(payload))
+        )
+        self.file.write(payload)
+
+
+class TraceRecorder:
+    """
+    Opt-in recorder of inbound sync frames, one trace file per document.
+
+    Frames are recorded on the owner worker, right before the session
+    applies them, so every trace starts with the document state they were
+    applied to and can be replayed deterministically on an empty server
+    (see `manage.py replay_editor_trace`).  Enabled by pointing
+    EDITOR_TRACE_DIR at a directory; writes are buffered and the file is
+    closed when the document's last user leaves.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self._writers = {}
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.directory)
+
+    def record_frame(self, session, channel_name, frame):
+        if not self.enabled or not frame or frame[0] != 0:
+            return
+        try:
+            writer = self._writers.get(session.doc_key)
+            if writer is None:
+                os.makedirs(self.directory, exist_ok=True)
+                name = re.sub(r'[^A-Za-z0-9._-]', '_', session.doc_key)
+                path = os.path.join(self.directory, f"{name}-{int(time.time() * 1000)}{TRACE_SUFFIX}")
+                writer = self._writers[session.doc_key] = _TraceWriter(
+                    path, session.doc_key, session.doc.get_update()
+                )
+            writer.write(TRACE_FRAME, writer.connection(channel_name), frame)
+        except Exception:
+            logger.exception('trace.error', 'Error recording trace', doc=session.doc_key)
+
+    def connection_closed(self, doc_key, channel_name):
+        writer = self._writers.get(doc_key)
+        if writer is not None and channel_name in writer.connections:
+            writer.write(TRACE_CLOSE, writer.connections[channel_name], b'')
+
+    def close(self, doc_key):
+        writer = self._writers.pop(doc_key, None)
+        if writer is not None:
+            writer.file.close()
+
+
+def read_trace(path):
+    """Return (doc_key, [(seconds_since_start, kind, connection, payload)])."""
+    with open(path, 'rb') as f:
+        data = f.read()
+    if not data.startswith(TRACE_MAGIC):
+        raise ValueError(f'{path} is not an editor trace')
+
+    length, offset = _read_var_uint(data, len(TRACE_MAGIC))
+    doc_key = data[offset:offset + length].decode('utf-8')
+    offset += length
+    records = []
+    elapsed = 0.0
+    while offset < len(data):
+        try:
+            kind = data[offset]
+            delta_us, start = _read_var_uint(data, offset + 1)
+            connection, start = _read_var_uint(data, start)
+            length, start = _read_var_uint(data, start)
+        except IndexError:
+            break  # torn tail
+        if start + length > len(data):
+            break
+        elapsed += delta_us / 1_000_000
+        records.append((elapsed, kind, connection, data[start:start + length]))
+        offset = start + length
+    return doc_key, records
+
+
+def _read_var_uint(data, offset):
+    value = shift = 0
+    while True:
+        byte = data[offset]
+        offset += 1
+        value |= (byte & 0x7F) << shift
+        shift += 7
+        if byte < 0x80:
+            return value, offset
+
+
+# Global instance
+trace_recorder = TraceRecorder(getattr(settings, 'EDITOR_TRACE_DIR', None))
@@ -0,0 +1,142 @@
+import os
+import struct
+
+# Sidecar files kept next to every file edited in the real-time editor.
+#   .ystate  full Yjs state snapshot
+#   .ylog    append-only tail of incremental updates since the snapshot
+#   .ylog.compacting  log detached by an in-progress rewrite()
+#   .yhist   version snapshots (see history.py)
+YSTATE_SUFFIX = '.ystate'
+YLOG_SUFFIX = '.ylog'
+YLOG_COMPACTING_SUFFIX = '.ylog.compacting'
+YHIST_SUFFIX = '.yhist'
+CRDT_SIDECAR_SUFFIXES = (YSTATE_SUFFIX, YLOG_SUFFIX, YLOG_COMPACTING_SUFFIX, YHIST_SUFFIX)
+
+_RECORD_HEADER = struct.Struct('>I')
+
+
+class UpdateLog:
+    """
+    Snapshot + append-only update log for one document.
+
+    Saves append only the updates produced since the previous save, so the
+    cost of a flush follows the size of the edit instead of the size of the
+    document history.  Once the tail grows past a threshold the owner folds
+    it into a fresh snapshot with compact().
+
+    All methods do blocking file I/O and are meant to run in a worker thread.
+    """
+
+    def __init__(self, full_path):
+        self.snapshot_path = full_path + YSTATE_SUFFIX
+        self.log_path = full_path + YLOG_SUFFIX
+        self.compacting_path = full_path + YLOG_COMPACTING_SUFFIX
+
+    def read(self):
+        """
+        Return the updates to replay, snapshot first, or [] if nothing has
+        been persisted.  A torn record at the end of the log (crash mid-append)
+        is ignored; every complete record before it is still returned.
+        """
+        updates = []
+        if os.path.exists(self.snapshot_path):
+            with open(self.snapshot_path, 'rb') as f:
+                snapshot = f.read()
+            if snapshot:
+                updates.append(snapshot)
+        # A log detached by an interrupted rewrite() is older than the
+        # current log, so it is replayed first.
+        updates.extend(_read_records(self.compacting_path))
+        updates.extend(_read_records(self.log_path))
+        return updates
+
+    def append(self, update) -> int:
+        """Append one update and return the size of the log afterwards."""
+        os.makedirs(os.path.dirname(self.log_path), exist_ok=True)
+        with open(self.log_path, 'ab') as f:
+            f.write(_RECORD_HEADER.pack(len(update)))
+            f.write(update)
+            return f.tell()
+
+    def log_size(self) -> int:
+        try:
+            return os.path.getsize(self.log_path)
+        except OSError:
+            return 0
+
+    def size(self) -> int:
+        """Total bytes of every sidecar of this document."""
+        total = 0
+        for path in (self.snapshot_path, self.compacting_path, self.log_path):
+            try:
+                total += os.path.getsize(path)
+            except OSError:
+                pass
+        return total
+
+    def compact(self, state):
+        """
+        Replace the snapshot with `state` (the full document update) and drop
+        the log, including one detached by an interrupted rewrite().  The
+        snapshot is swapped in atomically before the logs are removed, so a
+        crash in between only leaves records that are already contained in
+        the snapshot and replay stays idempotent.
+        """
+        os.makedirs(os.path.dirname(self.snapshot_path), exist_ok=True)
+        tmp_path = self.snapshot_path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(state)
+        os.replace(tmp_path, self.snapshot_path)
+        for path in (self.compacting_path, self.log_path):
+            if os.path.exists(path):
+                os.remove(path)
+
+    def rewrite(self, transform):
+        """
+        Replace the snapshot with `transform(updates)` without holding up
+        writers in other processes.
+
+        The log is first renamed aside, so appends that happen meanwhile go
+        to a fresh log and are kept.  Only the snapshot and the detached log
+        are rewritten; the detached log is removed once the new snapshot is
+        in place.  A crash at any point leaves files that read() still
+        replays to the same state.
+        """
+        if not os.path.exists(self.compacting_path) and os.path.exists(self.log_path):
+            os.replace(self.log_path, self.compacting_path)
+
+        updates = []
+        if os.path.exists(self.snapshot_path):
+            with open(self.snapshot_path, 'rb') as f:
+                snapshot = f.read()
+            if snapshot:
+                updates.append(snapshot)
+        updates.extend(_read_records(self.compacting_path))
+        if not updates:
+            return
+
+        state = transform(updates)
+        tmp_path = self.snapshot_path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(state)
+        os.replace(tmp_path, self.snapshot_path)
+        if os.path.exists(self.compacting_path):
+            os.remove(self.compacting_path)
+
+
+def _read_records(path):
+    """Complete length-prefixed records of a log file (none if it is missing)."""
+    if not os.path.exists(path):
+        return []
+    with open(path, 'rb') as f:
+        data = f.read()
+    records = []
+    offset = 0
+    while offset + _RECORD_HEADER.size <= len(data):
+        (length,) = _RECORD_HEADER.unpack_from(data, offset)
+        start = offset + _RECORD_HEADER.size
+        if start + length > len(data):
+            break
+        records.append(data[start:start + length])
+        offset = start + length
+    return records
@@ -10,6 +10,7 @@ urlpatterns = [
     # Project search and user-specific endpoints (must come before <str:pk>/)
     path('search/', views.project_search_view, name='project_search'),
     path('my-projects/', views.user_projects_view, name='user_projects'),
+    path('editor-metrics/', views.editor_metrics_view, name='editor_metrics'),
     
     # Project detail endpoint (must come after specific patterns)
     path('<str:pk>/', views.project_detail_view, name='project_detail'),
@@ -23,4 +24,14 @@ urlpatterns = [
     # Git Integration
     path('<str:project_id>/git/commit/', views.git_commit_view, name='git_commit'),
     path('<str:project_id>/git/status/', views.git_status_view, name='git_status'),
+
+    # Document history (version snapshots of files edited live)
+    path('<str:project_id>/history/', views.document_history_view, name='document_history'),
+    path('<str:project_id>/history/<int:version>/', views.document_version_view, name='document_version'),
+
+    # Byte ranges of files too large for the live editor
+    path('<str:project_id>/file-range/', views.document_range_view, name='document_range'),
+
+    # Who has which file open in the live editor
+    path('<str:project_id>/presence/', views.project_presence_view, name='project_presence'),
 ]
@@ -1,14 +1,24 @@
+import hmac
 import pdb
+import re
 import subprocess
 import os
 from rest_framework import status, permissions
 from rest_framework.decorators import api_view, permission_classes
 from rest_framework.response import Response
 from django.db.models import Q
+from django.http import HttpResponse
 from bson import ObjectId
 from .models import Project, ProjectMembership
 from users.models import User
 from repositories.models import Repository
+from repositories.path_cache import repository_path_cache
+from .history import DocumentHistory
+from .metrics import metrics
+from .sessions import resolve_file_path, session_manager
+from sagile_ide.log import get_logger
+
+logger = get_logger(__name__)
 
 
 # ============================================================================
@@ -114,6 +124,7 @@ def project_list_view(request):
     except User.DoesNotExist:
         return Response({'error': 'User not found'}, status=status.HTTP_404_NOT_FOUND)
     except Exception as e:
+        logger.exception('api.error', 'Unhandled error', view='project_list_view')
         return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 
@@ -213,6 +224,7 @@ def project_detail_view(request, pk):
     except User.DoesNotExist:
         return Response({'error': 'User not found'}, status=status.HTTP_404_NOT_FOUND)
     except Exception as e:
+        logger.exception('api.error', 'Unhandled error', view='project_detail_view')
         return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 
@@ -263,6 +275,7 @@ def project_membership_view(request, project_id):
     except User.DoesNotExist:
         return Response({'error': 'User not found'}, status=status.HTTP_404_NOT_FOUND)
     except Exception as e:
+        logger.exception('api.error', 'Unhandled error', view='project_membership_view')
         return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 
@@ -333,6 +346,7 @@ def project_membership_detail_view(request, project_id, pk):
     except User.DoesNotExist:
         return Response({'error': 'User not found'}, status=status.HTTP_404_NOT_FOUND)
     except Exception as e:
+        logger.exception('api.error', 'Unhandled error', view='project_membership_detail_view')
         return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 
@@ -463,6 +477,7 @@ def add_project_member_view(request, project_id):
             status=status.HTTP_404_NOT_FOUND
         )
     except Exception as e:
+        logger.exception('api.error', 'Unhandled error', view='add_project_member_view')
         return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 
@@ -503,6 +518,7 @@ def remove_project_member_view(request, project_id, user_id):
             status=status.HTTP_404_NOT_FOUND
         )
     except Exception as e:
+        logger.exception('api.error', 'Unhandled error', view='remove_project_member_view')
         return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 
@@ -516,33 +532,35 @@ def git_commit_view(request, project_id):
     """View for committing changes to git"""
     try:
         # Find repository/project path
-        repo = Repository.objects.filter(project_id=ObjectId(project_id)).first()
+        root_path = repository_path_cache.get_root_path(ObjectId(project_id))
         
-        if not repo or not repo.root_path:
+        if not root_path:
              return Response({'error': 'Repository not found or path missing'}, status=status.HTTP_404_NOT_FOUND)
              
         commit_message = request.data.get('commit_message')
         if not commit_message:
              return Response({'error': 'Commit message is required'}, status=status.HTTP_400_BAD_REQUEST)
 
-        git_dir = os.path.join(repo.root_path, '.git')
-        git_base = ['git', '--git-dir', git_dir, '--work-tree', repo.root_path]
+        git_dir = os.path.join(root_path, '.git')
+        git_base = ['git', '--git-dir', git_dir, '--work-tree', root_path]
 
         # Stage only the requested files, or everything if no list is provided
         files_to_stage = request.data.get('files', [])
         if files_to_stage:
-            subprocess.run(git_base + ['add', '--'] + list(files_to_stage), cwd=repo.root_path, check=True)
+            subprocess.run(git_base + ['add', '--'] + list(files_to_stage), cwd=root_path, check=True)
         else:
-            subprocess.run(git_base + ['add', '.'], cwd=repo.root_path, check=True)
+            subprocess.run(git_base + ['add', '.'], cwd=root_path, check=True)
 
         # Run git commit
-        subprocess.run(git_base + ['commit', '-m', commit_message], cwd=repo.root_path, check=True)
+        subprocess.run(git_base + ['commit', '-m', commit_message], cwd=root_path, check=True)
         
         return Response({'message': 'Changes committed successfully'})
         
     except subprocess.CalledProcessError as e:
+        logger.error('git.error', 'Git command failed', view='git_commit_view', error=str(e))
         return Response({'error': f'Git command failed: {str(e)}'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
     except Exception as e:
+        logger.exception('api.error', 'Unhandled error', view='git_commit_view')
         return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 from django.conf import settings
@@ -553,13 +571,14 @@ def git_status_view(request, project_id):
     """View for getting git status"""
     try:
         # Find repository/project path
-        repo = Repository.objects.filter(project_id=ObjectId(project_id)).first()
-        
-        if not repo:
-             return Response({'error': 'Repository not found'}, status=status.HTTP_404_NOT_FOUND)
+        root_path = repository_path_cache.get_root_path(ObjectId(project_id))
 
         # Self-healing: Initialize repository if root_path is missing
-        if not repo.root_path:
+        if not root_path:
+            repo = Repository.objects.filter(project_id=ObjectId(project_id)).first()
+            if not repo:
+                return Response({'error': 'Repository not found'}, status=status.HTTP_404_NOT_FOUND)
+
             base_storage = settings.BASE_DIR / 'projects_storage'
             repo_path = base_storage / str(project_id)
             
@@ -573,27 +592,27 @@ def git_status_view(request, project_id):
                 subprocess.run(['git', 'config', 'user.email', 'sagile@example.com'], cwd=repo_path, check=True)
                 subprocess.run(['git', 'config', 'user.name', 'SAgile IDE'], cwd=repo_path, check=True)
 
-            repo.root_path = str(repo_path)
+            repo.root_path = root_path = str(repo_path)
             repo.save()
             
         # Verify path exists and has its own git repo initialized.
         # Without a .git directory here, git would walk up and expose the
         # parent workspace repo, leaking changes outside projects_storage.
-        git_dir = os.path.join(repo.root_path, '.git')
-        if not os.path.exists(repo.root_path):
-            os.makedirs(repo.root_path, exist_ok=True)
-            subprocess.run(['git', 'init'], cwd=repo.root_path, check=True)
-            subprocess.run(['git', 'config', 'user.email', 'sagile@example.com'], cwd=repo.root_path, check=True)
-            subprocess.run(['git', 'config', 'user.name', 'SAgile IDE'], cwd=repo.root_path, check=True)
+        git_dir = os.path.join(root_path, '.git')
+        if not os.path.exists(root_path):
+            os.makedirs(root_path, exist_ok=True)
+            subprocess.run(['git', 'init'], cwd=root_path, check=True)
+            subprocess.run(['git', 'config', 'user.email', 'sagile@example.com'], cwd=root_path, check=True)
+            subprocess.run(['git', 'config', 'user.name', 'SAgile IDE'], cwd=root_path, check=True)
         elif not os.path.exists(git_dir):
-            subprocess.run(['git', 'init'], cwd=repo.root_path, check=True)
-            subprocess.run(['git', 'config', 'user.email', 'sagile@example.com'], cwd=repo.root_path, check=True)
-            subprocess.run(['git', 'config', 'user.name', 'SAgile IDE'], cwd=repo.root_path, check=True)
+            subprocess.run(['git', 'init'], cwd=root_path, check=True)
+            subprocess.run(['git', 'config', 'user.email', 'sagile@example.com'], cwd=root_path, check=True)
+            subprocess.run(['git', 'config', 'user.name', 'SAgile IDE'], cwd=root_path, check=True)
 
         # Run git status --porcelain scoped strictly to this repo
         result = subprocess.run(
-            ['git', '--git-dir', git_dir, '--work-tree', repo.root_path, 'status', '--porcelain'],
-            cwd=repo.root_path, capture_output=True, text=True, check=True,
+            ['git', '--git-dir', git_dir, '--work-tree', root_path, 'status', '--porcelain'],
+            cwd=root_path, capture_output=True, text=True, check=True,
         )
         
         status_lines = result.stdout.strip().split('\n') if result.stdout else []
@@ -612,8 +631,8 @@ def git_status_view(request, project_id):
 
         # Get branch name
         branch_res = subprocess.run(
-            ['git', '--git-dir', git_dir, '--work-tree', repo.root_path, 'rev-parse', '--abbrev-ref', 'HEAD'],
-            cwd=repo.root_path, capture_output=True, text=True,
+            ['git', '--git-dir', git_dir, '--work-tree', root_path, 'rev-parse', '--abbrev-ref', 'HEAD'],
+            cwd=root_path, capture_output=True, text=True,
         )
         branch = branch_res.stdout.strip() if branch_res.returncode == 0 else 'main'
 
@@ -626,6 +645,218 @@ def git_status_view(request, project_id):
         })
         
     except subprocess.CalledProcessError as e:
+        logger.error('git.error', 'Git command failed', view='git_status_view', error=str(e))
         return Response({'error': f'Git command failed: {str(e)}'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
     except Exception as e:
+        logger.exception('api.error', 'Unhandled error', view='git_status_view')
+        return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+# ============================================================================
+# DOCUMENT HISTORY VIEWS
+# ============================================================================
+
+def _document_path_for(request, project_id):
+    """Resolve the full path of ?path= in the project, or return an error Response."""
+    project = Project.objects.get(id=ObjectId(project_id))
+    user_id = ObjectId(request.user.id)
+    user = User.objects.get(id=user_id)
+    if not (user.role in ['project-manager', 'scrum-master'] or
+            project.is_member(user_id)):
+        return None, Response({'error': 'You do not have access to this project'}, status=status.HTTP_403_FORBIDDEN)
+
+    file_path = request.query_params.get('path')
+    if not file_path:
+        return None, Response({'error': 'path is required'}, status=status.HTTP_400_BAD_REQUEST)
+
+    root_path = repository_path_cache.get_root_path(project.id)
+    if not root_path:
+        return None, Response({'error': 'Repository not found or path missing'}, status=status.HTTP_404_NOT_FOUND)
+    full_path = resolve_file_path(root_path, file_path)
+    if full_path is None:
+        return None, Response({'error': 'Invalid path'}, status=status.HTTP_400_BAD_REQUEST)
+    return full_path, None
+
+
+@api_view(['GET'])
+@permission_classes([permissions.IsAuthenticated])
+def document_history_view(request, project_id):
+    """List the version snapshots of a file (?path=<file path>)"""
+    try:
+        full_path, error = _document_path_for(request, project_id)
+        if error:
+            return error
+        history = DocumentHistory(full_path)
+        return Response({'path': request.query_params['path'], 'versions': history.versions()})
+    except Project.DoesNotExist:
+        return Response({'error': 'Project not found'}, status=status.HTTP_404_NOT_FOUND)
+    except User.DoesNotExist:
+        return Response({'error': 'User not found'}, status=status.HTTP_404_NOT_FOUND)
+    except Exception as e:
+        logger.exception('api.error', 'Unhandled error', view='document_history_view')
+        return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+@api_view(['GET'])
+@permission_classes([permissions.IsAuthenticated])
+def document_version_view(request, project_id, version):
+    """Text of a file as of one version snapshot (?path=<file path>)"""
+    try:
+        full_path, error = _document_path_for(request, project_id)
+        if error:
+            return error
+        history = DocumentHistory(full_path)
+        entries = history.index()
+        if version >= len(entries):
+            return Response({'error': 'Version not found'}, status=status.HTTP_404_NOT_FOUND)
+        return Response({
+            'path': request.query_params['path'],
+            'version': version,
+            'timestamp': entries[version][0],
+            'text': history.text_at(version, entries),
+        })
+    except Project.DoesNotExist:
+        return Response({'error': 'Project not found'}, status=status.HTTP_404_NOT_FOUND)
+    except User.DoesNotExist:
+        return Response({'error': 'User not found'}, status=status.HTTP_404_NOT_FOUND)
+    except Exception as e:
+        logger.exception('api.error', 'Unhandled error', view='document_version_view')
+        return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+# ============================================================================
+# LARGE FILE VIEW
+# ============================================================================
+
+_RANGE_HEADER = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+def _requested_range(request, size):
+    """(start, end) inclusive from a Range header or ?offset=&length=, else None."""
+    max_bytes = getattr(settings, 'EDITOR_RANGE_MAX_BYTES', 1024 * 1024)
+    header = request.headers.get('Range')
+    if header:
+        match = _RANGE_HEADER.match(header.strip())
+        if not match or match.groups() == ('', ''):
+            return None
+        first, last = match.groups()
+        if first:
+            start = int(first)
+            end = int(last) if last else size - 1
+        else:
+            start = max(0, size - int(last))  # suffix range: the last N bytes
+            end = size - 1
+    else:
+        try:
+            start = int(request.query_params.get('offset', 0))
+            length = int(request.query_params.get('length', max_bytes))
+        except ValueError:
+            return None
+        if start < 0 or length <= 0:
+            return None
+        end = start + length - 1
+    end = min(end, size - 1, start + max_bytes - 1)
+    if start >= size or end < start:
+        return None
+    return start, end
+
+
+@api_view(['GET'])
+@permission_classes([permissions.IsAuthenticated])
+def document_range_view(request, project_id):
+    """
+    Byte range of a file (?path=<file path>), for files too large for the
+    live editor.  The range comes from a Range header (bytes=start-end) or
+    ?offset=&length=, capped at EDITOR_RANGE_MAX_BYTES.
+    """
+    try:
+        full_path, error = _document_path_for(request, project_id)
+        if error:
+            return error
+        if not os.path.isfile(full_path):
+            return Response({'error': 'File not found'}, status=status.HTTP_404_NOT_FOUND)
+
+        size = os.path.getsize(full_path)
+        byte_range = _requested_range(request, size)
+        if byte_range is None:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = f'bytes */{size}'
+            return response
+        start, end = byte_range
+        with open(full_path, 'rb') as f:
+            f.seek(start)
+            data = f.read(end - start + 1)
+
+        response = HttpResponse(data, status=206, content_type='application/octet-stream')
+        response['Content-Range'] = f'bytes {start}-{start + len(data) - 1}/{size}'
+        response['Accept-Ranges'] = 'bytes'
+        return response
+    except Project.DoesNotExist:
+        return Response({'error': 'Project not found'}, status=status.HTTP_404_NOT_FOUND)
+    except User.DoesNotExist:
+        return Response({'error': 'User not found'}, status=status.HTTP_404_NOT_FOUND)
+    except Exception as e:
+        logger.exception('api.error', 'Unhandled error', view='document_range_view')
+        return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+# ============================================================================
+# PRESENCE VIEWS
+# ============================================================================
+
+@api_view(['GET'])
+@permission_classes([permissions.IsAuthenticated])
+def project_presence_view(request, project_id):
+    """Who has which file of the project open in the live editor (from memory)"""
+    try:
+        project = Project.objects.get(id=ObjectId(project_id))
+        user_id = ObjectId(request.user.id)
+        user = User.objects.get(id=user_id)
+        if not (user.role in ['project-manager', 'scrum-master'] or
+                project.is_member(user_id)):
+            return Response({'error': 'You do not have access to this project'}, status=status.HTTP_403_FORBIDDEN)
+        return Response({
+            'project_id': str(project.id),
+            'files': session_manager.presence.snapshot(project.id),
+        })
+    except Project.DoesNotExist:
+        return Response({'error': 'Project not found'}, status=status.HTTP_404_NOT_FOUND)
+    except User.DoesNotExist:
+        return Response({'error': 'User not found'}, status=status.HTTP_404_NOT_FOUND)
+    except Exception as e:
+        logger.exception('api.error', 'Unhandled error', view='project_presence_view')
+        return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+# ============================================================================
+# EDITOR METRICS VIEWS
+# ============================================================================
+
+def editor_metrics_prometheus_view(request):
+    """Editor metrics in the Prometheus text format (plain Django view for scrapers)"""
+    token = getattr(settings, 'EDITOR_METRICS_TOKEN', None)
+    if not token:
+        # Closed unless a scrape token is configured.
+        return HttpResponse('Metrics token not configured', status=403, content_type='text/plain')
+    if not hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {token}'):
+        return HttpResponse('Unauthorized', status=401, content_type='text/plain')
+    return HttpResponse(
+        metrics.render_prometheus(),
+        content_type='text/plain; version=0.0.4; charset=utf-8',
+    )
+
+
+@api_view(['GET'])
+@permission_classes([permissions.IsAuthenticated])
+def editor_metrics_view(request):
+    """Editor metrics and service stats as JSON (staff only)"""
+    try:
+        user = User.objects.get(id=ObjectId(request.user.id))
+        if not user.is_staff:
+            return Response({'error': 'Only staff can view editor metrics'}, status=status.HTTP_403_FORBIDDEN)
+        return Response(metrics.snapshot())
+    except User.DoesNotExist:
+        return Response({'error': 'User not found'}, status=status.HTTP_404_NOT_FOUND)
+    except Exception as e:
+        logger.exception('api.error', 'Unhandled error', view='editor_metrics_view')
         return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
@@ -0,0 +1,65 @@
+from channels.middleware import BaseMiddleware
+from channels.sessions import CookieMiddleware
+from django.conf import settings
+from sagile_ide.log import get_logger
+from .access_cache import project_access_cache
+from .metrics import metrics
+from .routing import project_id_from_path
+
+logger = get_logger(__name__)
+
+# Close codes of refused editor sockets: not logged in / not a member.
+UNAUTHENTICATED_CLOSE_CODE = 4401
+FORBIDDEN_CLOSE_CODE = 4403
+
+WS_AUTH_DENIED = metrics.counter(
+    'editor_ws_auth_denied_total', 'Editor WebSockets refused by EditorAuthMiddleware', ('reason',)
+)
+
+
+class EditorAuthMiddleware(BaseMiddleware):
+    """
+    Authorize editor WebSockets before they reach a consumer.
+
+    The user is resolved from the Django session cookie the same way the
+    REST API does (users/authentication.py) and must be allowed into the
+    project in the socket's path: a project member or a project manager /
+    scrum master.  Both lookups go through project_access_cache.  Allowed
+    sockets carry the user in scope['user'] (a WebSocketUser); refused
+    ones are accepted and closed at once with UNAUTHENTICATED_CLOSE_CODE or
+    FORBIDDEN_CLOSE_CODE, since a close before accept reaches browsers as
+    an opaque 403 without the reason.
+    """
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'websocket':
+            return await super().__call__(scope, receive, send)
+
+        project_id = project_id_from_path(scope['path'])
+        session_key = scope.get('cookies', {}).get(settings.SESSION_COOKIE_NAME)
+        try:
+            user = await project_access_cache.user_for_session(session_key)
+            if user is None:
+                return await self.refuse(scope, receive, send, UNAUTHENTICATED_CLOSE_CODE, 'unauthenticated')
+            if project_id is None or not await project_access_cache.can_access(project_id, user):
+                return await self.refuse(scope, receive, send, FORBIDDEN_CLOSE_CODE, 'forbidden', user=user.id)
+        except Exception:
+            logger.exception('ws.auth_error', 'Error authorizing WebSocket', path=scope['path'])
+            return await self.refuse(scope, receive, send, FORBIDDEN_CLOSE_CODE, 'error')
+
+        return await super().__call__(dict(scope, user=user), receive, send)
+
+    async def refuse(self, scope, receive, send, code, reason, **fields):
+        WS_AUTH_DENIED.inc(reason=reason)
+        logger.warning('ws.denied', 'Refused WebSocket', path=scope['path'], reason=reason, **fields)
+        message = await receive()
+        if message['type'] == 'websocket.connect':
+            await send({'type': 'websocket.accept'})
+            await send({'type': 'websocket.close', 'code': code})
+
+
+def EditorAuthMiddlewareStack(inner):
+    return CookieMiddleware(EditorAuthMiddleware(inner))
+
+
+metrics.register_stats('editor_ws_auth', project_access_cache.stats)
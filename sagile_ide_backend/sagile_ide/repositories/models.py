@@ -1,6 +1,7 @@
 from mongoengine import Document, EmbeddedDocument, fields
 from datetime import datetime
 import bson
+from .path_cache import repository_path_cache
 
 
 class RepositoryFile(EmbeddedDocument):
@@ -261,4 +262,14 @@ class Repository(Document):
     def save(self, *args, **kwargs):
         """Override save to update timestamp"""
         self.updated_at = datetime.utcnow()
-        super().save(*args, **kwargs)
\ No newline at end of file
+        super().save(*args, **kwargs)
+        # root_path may have changed (or the repository was just created);
+        # store the saved value so views that save and then resolve the
+        # path do not go back to the database for it.
+        repository_path_cache.invalidate(self.project_id)
+        repository_path_cache.prime(self.project_id, self.root_path or None)
+
+    def delete(self, *args, **kwargs):
+        """Override delete to drop the cached root path"""
+        super().delete(*args, **kwargs)
+        repository_path_cache.invalidate(self.project_id)
\ No newline at end of file
@@ -0,0 +1,114 @@
+import threading
+import time
+from typing import Optional
+from asgiref.sync import sync_to_async
+from bson import ObjectId
+from django.conf import settings
+
+
+class RepositoryPathCache:
+    """
+    In-process cache of project_id -> repository root_path.
+
+    The real-time editor resolves a file's path on every read and save, and
+    each lookup used to be a MongoDB query behind a thread hop.  Entries
+    expire after `ttl` seconds and are dropped immediately whenever a
+    Repository is saved or deleted (see Repository.save / Repository.delete),
+    so a repository created, re-rooted or removed is picked up at once.
+    Projects without a repository are cached too (as None) so a missing
+    repository does not cost a query per keystroke either.
+
+    Invalidation is per process; other workers pick up a change when their
+    entry expires.
+    """
+
+    _MISSING = object()
+
+    def __init__(self, ttl=None):
+        self.ttl = ttl if ttl is not None else getattr(
+            settings, 'REPOSITORY_PATH_CACHE_TTL_SECONDS', 300
+        )
+        self._entries = {}
+        self._lock = threading.Lock()
+        # Bumped on every invalidation so a lookup that raced with a save
+        # does not put the pre-save value back into the cache.
+        self._generation = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get_cached(self, project_id, default=_MISSING):
+        """Return the cached root path without touching the database."""
+        key = str(project_id)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] > time.monotonic():
+                self.hits += 1
+                return entry[0]
+            self.misses += 1
+        return default
+
+    def get_root_path(self, project_id) -> Optional[str]:
+        """Return the root path, loading it from MongoDB on a miss."""
+        root_path = self.get_cached(project_id)
+        if root_path is self._MISSING:
+            root_path = self._load(project_id)
+        return root_path
+
+    async def aget_root_path(self, project_id) -> Optional[str]:
+        """Async variant that only leaves the event loop on a cache miss."""
+        root_path = self.get_cached(project_id)
+        if root_path is self._MISSING:
+            root_path = await sync_to_async(self._load)(project_id)
+        return root_path
+
+    def _load(self, project_id) -> Optional[str]:
+        # Imported here because models.py imports this module to invalidate.
+        from .models import Repository
+
+        generation = self._generation
+        try:
+            project_oid = ObjectId(project_id)
+        except Exception:
+            project_oid = project_id
+
+        repo = Repository.objects.filter(project_id=project_oid).only('root_path').first()
+        root_path = repo.root_path if repo and repo.root_path else None
+        with self._lock:
+            if generation == self._generation:
+                self._entries[str(project_id)] = (root_path, time.monotonic() + self.ttl)
+        return root_path
+
+    def prime(self, project_id, root_path, ttl=_MISSING):
+        """
+        Store a root path directly (also used by tools running without
+        MongoDB).  The entry lives for `ttl` seconds (default: the cache
+        TTL); with ttl=None it only goes away when invalidated, so a long
+        replay or load run never falls back to the database.
+        """
+        if ttl is self._MISSING:
+            ttl = self.ttl
+        expires = float('inf') if ttl is None else time.monotonic() + ttl
+        with self._lock:
+            self._entries[str(project_id)] = (root_path, expires)
+
+    def invalidate(self, project_id=None):
+        """Forget one project's root path, or every entry when no id is given."""
+        with self._lock:
+            self._generation += 1
+            if project_id is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(str(project_id), None)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'ttl_seconds': self.ttl,
+            }
+
+
+# Global instance
+repository_path_cache = RepositoryPathCache()
@@ -3,6 +3,10 @@ import os
 import re
 from typing import Dict, List, Optional
 from pathlib import Path
+from sagile_ide.log import get_logger
+
+logger = get_logger(__name__)
+
 
 class ProjectTemplateService:
     """Service for managing project templates"""
@@ -23,8 +27,8 @@ class ProjectTemplateService:
                     template_data = json.load(f)
                     template_id = template_file.stem
                     self._templates_cache[template_id] = template_data
-            except (json.JSONError, IOError) as e:
-                print(f"Error loading template {template_file}: {e}")
+            except (json.JSONError, IOError):
+                logger.exception('template.error', 'Error loading template', template=str(template_file))
     
     def get_all_templates(self) -> List[Dict]:
         """Get all available templates"""
@@ -105,8 +109,8 @@ class ProjectTemplateService:
             
             return True
             
-        except Exception as e:
-            print(f"Error applying template to repository: {e}")
+        except Exception:
+            logger.exception('template.error', 'Error applying template to repository')
             return False
     
     def _replace_template_variables(self, content: str, variables: Dict[str, str]) -> str:
@@ -197,8 +201,8 @@ class ProjectTemplateService:
             self._templates_cache[template_id] = template_data
             return True
             
-        except IOError as e:
-            print(f"Error saving template: {e}")
+        except IOError:
+            logger.exception('template.error', 'Error saving template', template=template_id)
             return False
 
 
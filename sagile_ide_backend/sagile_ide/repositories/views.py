@@ -7,11 +7,19 @@ from rest_framework.decorators import api_view, permission_classes
 from rest_framework.response import Response
 from bson import ObjectId
 from datetime import datetime
+from asgiref.sync import async_to_sync
 from .models import Repository, RepositoryFile
+from .path_cache import repository_path_cache
 from .template_service import template_service
 # Serializers removed - using manual data construction instead
+from projects.doc_router import document_router
 from projects.models import Project
+from projects.sessions import document_key
+from projects.update_log import CRDT_SIDECAR_SUFFIXES
 from users.models import User
+from sagile_ide.log import get_logger
+
+logger = get_logger(__name__)
 
 
 # ============================================================================
@@ -153,6 +161,7 @@ def repository_list_view(request):
     except User.DoesNotExist:
         return Response({'error': 'User not found'}, status=status.HTTP_404_NOT_FOUND)
     except Exception as e:
+        logger.exception('api.error', 'Unhandled error', view='repository_list_view')
         return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 
@@ -261,6 +270,7 @@ def repository_detail_view(request, pk):
     except User.DoesNotExist:
         return Response({'error': 'User not found'}, status=status.HTTP_404_NOT_FOUND)
     except Exception as e:
+        logger.exception('api.error', 'Unhandled error', view='repository_detail_view')
         return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 
@@ -316,6 +326,7 @@ def repository_by_project_view(request, project_id):
     except User.DoesNotExist:
         return Response({'error': 'User not found'}, status=status.HTTP_404_NOT_FOUND)
     except Exception as e:
+        logger.exception('api.error', 'Unhandled error', view='repository_by_project_view')
         return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 
@@ -323,6 +334,19 @@ def repository_by_project_view(request, project_id):
 # REPOSITORY FILE MANAGEMENT VIEWS
 # ============================================================================
 
+def _root_path(repository):
+    """The repository's root path, read through the cache the editor uses."""
+    return repository_path_cache.get_root_path(repository.project_id)
+
+
+def _merge_into_live_document(project_id, file_path):
+    """Merge a file just written here into its live editor session, if any."""
+    try:
+        async_to_sync(document_router.reconcile)(document_key(str(project_id), file_path))
+    except Exception:
+        logger.exception('editor.merge_error', 'Error merging file into live document', path=file_path)
+
+
 @api_view(['POST'])
 @permission_classes([permissions.IsAuthenticated])
 def add_repository_file_view(request, repository_id):
@@ -362,16 +386,18 @@ def add_repository_file_view(request, repository_id):
         repository.save()
 
         # Write the actual file to disk so Git can track it
-        if repository.root_path:
-            full_path = os.path.normpath(os.path.join(repository.root_path, file_path))
+        root_path = _root_path(repository)
+        if root_path:
+            full_path = os.path.normpath(os.path.join(root_path, file_path))
             # Guard against path traversal
-            if full_path.startswith(os.path.normpath(repository.root_path)):
+            if full_path.startswith(os.path.normpath(root_path)):
                 dir_path = os.path.dirname(full_path)
                 if dir_path:
                     os.makedirs(dir_path, exist_ok=True)
                 content = request.data.get('content', '')
                 with open(full_path, 'w', encoding='utf-8') as f:
                     f.write(content)
+                _merge_into_live_document(repository.project_id, file_path)
 
         # Return success message with repository info
         return Response({
@@ -388,6 +414,7 @@ def add_repository_file_view(request, repository_id):
     except User.DoesNotExist:
         return Response({'error': 'User not found'}, status=status.HTTP_404_NOT_FOUND)
     except Exception as e:
+        logger.exception('api.error', 'Unhandled error', view='add_repository_file_view')
         return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 
@@ -441,21 +468,28 @@ def update_repository_file_view(request, repository_id, file_path):
         repository.save()
 
         # Rename the actual file on disk if the path changed
-        if repository.root_path and old_file_path != target_file.file_path:
-            root = os.path.normpath(repository.root_path)
+        root_path = _root_path(repository)
+        if root_path and old_file_path != target_file.file_path:
+            root = os.path.normpath(root_path)
             old_full_path = os.path.normpath(os.path.join(root, old_file_path))
             new_full_path = os.path.normpath(os.path.join(root, target_file.file_path))
             # Guard against path traversal
             if old_full_path.startswith(root) and new_full_path.startswith(root):
-                if os.path.exists(old_full_path):
-                    new_dir = os.path.dirname(new_full_path)
-                    if new_dir:
-                        os.makedirs(new_dir, exist_ok=True)
-                    os.rename(old_full_path, new_full_path)
-                    # Also move the CRDT state file used by the real-time editor
-                    old_ystate = old_full_path + '.ystate'
-                    if os.path.exists(old_ystate):
-                        os.rename(old_ystate, new_full_path + '.ystate')
+                def rename_files():
+                    if os.path.exists(old_full_path):
+                        new_dir = os.path.dirname(new_full_path)
+                        if new_dir:
+                            os.makedirs(new_dir, exist_ok=True)
+                        os.rename(old_full_path, new_full_path)
+                        # Also move the CRDT state files used by the real-time editor
+                        for suffix in CRDT_SIDECAR_SUFFIXES:
+                            if os.path.exists(old_full_path + suffix):
+                                os.rename(old_full_path + suffix, new_full_path + suffix)
+
+                # Open editors follow the file instead of writing to the old path.
+                async_to_sync(document_router.move)(
+                    str(repository.project_id), old_file_path, target_file.file_path, rename_files
+                )
 
         # Return success message
         return Response({
@@ -476,6 +510,7 @@ def update_repository_file_view(request, repository_id, file_path):
     except User.DoesNotExist:
         return Response({'error': 'User not found'}, status=status.HTTP_404_NOT_FOUND)
     except Exception as e:
+        logger.exception('api.error', 'Unhandled error', view='update_repository_file_view')
         return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 
@@ -513,8 +548,9 @@ def delete_repository_file_view(request, repository_id, file_path):
         repository.save()
 
         # Remove the corresponding path(s) from disk
-        if repository.root_path:
-            root = os.path.normpath(repository.root_path)
+        root_path = _root_path(repository)
+        if root_path:
+            root = os.path.normpath(root_path)
             full_path = os.path.normpath(os.path.join(root, file_path))
             # Guard against path traversal
             if full_path.startswith(root):
@@ -522,10 +558,10 @@ def delete_repository_file_view(request, repository_id, file_path):
                     shutil.rmtree(full_path)
                 elif os.path.isfile(full_path):
                     os.remove(full_path)
-                    # Also remove the CRDT state file used by the real-time editor
-                    ystate_path = full_path + '.ystate'
-                    if os.path.exists(ystate_path):
-                        os.remove(ystate_path)
+                    # Also remove the CRDT state files used by the real-time editor
+                    for suffix in CRDT_SIDECAR_SUFFIXES:
+                        if os.path.exists(full_path + suffix):
+                            os.remove(full_path + suffix)
 
         # HTTP 204 should not have a response body
         return Response(status=status.HTTP_204_NO_CONTENT)
@@ -535,6 +571,7 @@ def delete_repository_file_view(request, repository_id, file_path):
     except User.DoesNotExist:
         return Response({'error': 'User not found'}, status=status.HTTP_404_NOT_FOUND)
     except Exception as e:
+        logger.exception('api.error', 'Unhandled error', view='delete_repository_file_view')
         return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 
@@ -559,11 +596,12 @@ def repository_files_view(request, repository_id):
         # Porcelain format: "XY filename" where X=index status, Y=worktree status.
         # This is best-effort — if git isn't available the files still load.
         git_status_map = {}
-        if repository.root_path and os.path.exists(repository.root_path):
+        root_path = _root_path(repository)
+        if root_path and os.path.exists(root_path):
             try:
                 result = subprocess.run(
                     ['git', 'status', '--porcelain'],
-                    cwd=repository.root_path,
+                    cwd=root_path,
                     capture_output=True,
                     text=True,
                 )
@@ -614,6 +652,7 @@ def repository_files_view(request, repository_id):
     except User.DoesNotExist:
         return Response({'error': 'User not found'}, status=status.HTTP_404_NOT_FOUND)
     except Exception as e:
+        logger.exception('api.error', 'Unhandled error', view='repository_files_view')
         return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 
@@ -669,20 +708,28 @@ def move_repository_file_view(request, repository_id, file_path):
         repository.save()
 
         # Move the actual path(s) on disk
-        if repository.root_path:
-            root = os.path.normpath(repository.root_path)
+        root_path = _root_path(repository)
+        if root_path:
+            root = os.path.normpath(root_path)
             old_full = os.path.normpath(os.path.join(root, file_path))
             new_full = os.path.normpath(os.path.join(root, new_path))
             if old_full.startswith(root) and new_full.startswith(root):
-                if os.path.exists(old_full):
-                    new_dir = os.path.dirname(new_full)
-                    if new_dir:
-                        os.makedirs(new_dir, exist_ok=True)
-                    shutil.move(old_full, new_full)
-                    # Also move the CRDT state file if it exists alongside a file
-                    old_ystate = old_full + '.ystate'
-                    if os.path.isfile(old_ystate):
-                        shutil.move(old_ystate, new_full + '.ystate')
+                def move_files():
+                    if os.path.exists(old_full):
+                        new_dir = os.path.dirname(new_full)
+                        if new_dir:
+                            os.makedirs(new_dir, exist_ok=True)
+                        shutil.move(old_full, new_full)
+                        # Also move the CRDT state files if they exist alongside a file
+                        for suffix in CRDT_SIDECAR_SUFFIXES:
+                            if os.path.isfile(old_full + suffix):
+                                shutil.move(old_full + suffix, new_full + suffix)
+
+                # Open editors under the moved path follow it (see
+                # DocumentSessionManager.move): no flush, reload or resync.
+                async_to_sync(document_router.move)(
+                    str(repository.project_id), file_path, new_path, move_files
+                )
 
         return Response({'message': 'Moved successfully', 'new_path': new_path})
 
@@ -691,6 +738,7 @@ def move_repository_file_view(request, repository_id, file_path):
     except User.DoesNotExist:
         return Response({'error': 'User not found'}, status=status.HTTP_404_NOT_FOUND)
     except Exception as e:
+        logger.exception('api.error', 'Unhandled error', view='move_repository_file_view')
         return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 
@@ -718,6 +766,7 @@ def get_project_templates_view(request):
         return JsonResponse({'templates': templates})
         
     except Exception as e:
+        logger.exception('api.error', 'Unhandled error', view='get_project_templates_view')
         import traceback
         return JsonResponse({
             'error': str(e),
@@ -743,6 +792,7 @@ def get_template_preview_view(request, template_id):
         return Response({'preview': preview})
         
     except Exception as e:
+        logger.exception('api.error', 'Unhandled error', view='get_template_preview_view')
         return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 
@@ -776,4 +826,5 @@ def create_custom_template_view(request):
     except User.DoesNotExist:
         return Response({'error': 'User not found'}, status=status.HTTP_404_NOT_FOUND)
     except Exception as e:
+        logger.exception('api.error', 'Unhandled error', view='create_custom_template_view')
         return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
\ No newline at end of file
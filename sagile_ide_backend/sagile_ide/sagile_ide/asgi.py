@@ -1,7 +1,6 @@
 import os
 from django.core.asgi import get_asgi_application
 from channels.routing import ProtocolTypeRouter, URLRouter
-from channels.auth import AuthMiddlewareStack
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'sagile_ide.settings')
 
@@ -10,12 +9,27 @@ os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'sagile_ide.settings')
 django_asgi_app = get_asgi_application()
 
 from projects.routing import websocket_urlpatterns
+from projects.doc_router import document_router
+from projects.shutdown import install_shutdown_hook, lifespan
+from projects.ws_auth import EditorAuthMiddlewareStack
 
-application = ProtocolTypeRouter({
+protocol_router = ProtocolTypeRouter({
     "http": django_asgi_app,
-    "websocket": AuthMiddlewareStack(
+    # Session user and project membership are checked before any consumer runs.
+    "websocket": EditorAuthMiddlewareStack(
         URLRouter(
             websocket_urlpatterns
         )
     ),
 })
+
+
+async def application(scope, receive, send):
+    # Live documents are flushed before the server exits (SIGTERM, deploys).
+    install_shutdown_hook()
+    if scope['type'] == 'lifespan':
+        return await lifespan(scope, receive, send)
+    # Start listening for frames forwarded by other workers as soon as this
+    # worker serves anything, not only once one of its own clients connects.
+    document_router.ensure_started()
+    return await protocol_router(scope, receive, send)
@@ -0,0 +1,143 @@
+"""
+Structured, non-blocking logging for the editor engine and the REST views.
+
+Call sites log an event name plus fields instead of formatting a string:
+
+    logger = get_logger(__name__)
+    logger.info('ws.connect', 'Connected', channel=self.channel_name, doc=self.doc_key)
+
+Records go through QueuedStreamHandler, which only enqueues them; a
+background thread formats and writes them, so a slow stdout never stalls
+the event loop.  SamplingFilter keeps 1 in N records of the events listed
+in settings.LOG_SAMPLING.  Levels are set per logger in settings.LOGGING.
+"""
+import atexit
+import json
+import logging
+import queue
+import threading
+import time
+from logging.handlers import QueueHandler, QueueListener
+
+
+class EventLogger:
+    """Thin wrapper around a stdlib logger that logs `event` with fields."""
+
+    def __init__(self, name):
+        self.logger = logging.getLogger(name)
+
+    def _log(self, level, event, message, fields, exc_info=False):
+        if self.logger.isEnabledFor(level):
+            self.logger.log(
+                level, message, exc_info=exc_info, stacklevel=3,
+                extra={'event': event, 'fields': fields},
+            )
+
+    def debug(self, event, message, **fields):
+        self._log(logging.DEBUG, event, message, fields)
+
+    def info(self, event, message, **fields):
+        self._log(logging.INFO, event, message, fields)
+
+    def warning(self, event, message, **fields):
+        self._log(logging.WARNING, event, message, fields)
+
+    def error(self, event, message, **fields):
+        self._log(logging.ERROR, event, message, fields)
+
+    def exception(self, event, message, **fields):
+        self._log(logging.ERROR, event, message, fields, exc_info=True)
+
+
+def get_logger(name) -> EventLogger:
+    return EventLogger(name)
+
+
+class StructuredFormatter(logging.Formatter):
+    """One JSON object per line (`style='json'`) or `key=value` text."""
+
+    def __init__(self, style='json'):
+        super().__init__()
+        self.output_style = style
+
+    def format(self, record):
+        entry = {
+            'ts': time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(record.created))
+                  + f'.{int(record.msecs):03d}Z',
+            'level': record.levelname,
+            'logger': record.name,
+            'event': getattr(record, 'event', None),
+            'message': record.getMessage(),
+        }
+        entry.update(getattr(record, 'fields', None) or {})
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+
+        if self.output_style == 'json':
+            return json.dumps(entry, default=str)
+        return ' '.join(
+            f'{key}={value!r}' if isinstance(value, str) and ' ' in value else f'{key}={value}'
+            for key, value in entry.items() if value is not None
+        )
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Keep 1 in N records of high-frequency events.  `rates` maps an event
+    name to the fraction to keep (default: settings.LOG_SAMPLING); records
+    at WARNING and above are never dropped.
+    """
+
+    def __init__(self, rates=None):
+        super().__init__()
+        if rates is None:
+            from django.conf import settings
+            rates = getattr(settings, 'LOG_SAMPLING', {})
+        self.every = {
+            event: max(1, round(1 / rate)) for event, rate in rates.items() if rate > 0
+        }
+        self.muted = {event for event, rate in rates.items() if rate <= 0}
+        self.counts = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        event = getattr(record, 'event', None)
+        if event is None or record.levelno >= logging.WARNING:
+            return True
+        if event in self.muted:
+            return False
+        every = self.every.get(event)
+        if every is None or every == 1:
+            return True
+        with self._lock:
+            count = self.counts.get(event, 0)
+            self.counts[event] = count + 1
+        if count % every:
+            return False
+        record.fields = {**(getattr(record, 'fields', None) or {}), 'sampled_1_in': every}
+        return True
+
+
+class QueuedStreamHandler(QueueHandler):
+    """
+    Enqueue records on the calling thread and write them to a stream from a
+    listener thread.  Formatting happens on the listener thread too.
+    """
+
+    def __init__(self, stream=None):
+        super().__init__(queue.SimpleQueue())
+        self.target = logging.StreamHandler(stream)
+        self.listener = QueueListener(self.queue, self.target)
+        self.listener.start()
+        atexit.register(self.listener.stop)
+
+    def setFormatter(self, fmt):
+        super().setFormatter(fmt)
+        self.target.setFormatter(fmt)
+
+    def prepare(self, record):
+        # The listener lives in this process, so the record (and exc_info)
+        # can be handed over as is; only freeze the message arguments.
+        record.msg = record.getMessage()
+        record.args = None
+        return record
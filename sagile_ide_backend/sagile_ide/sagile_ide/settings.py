@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -189,3 +190,127 @@ CHANNEL_LAYERS = {
         "BACKEND": "channels.layers.InMemoryChannelLayer"
     }
 }
+
+# Collaborative editor document ownership. Run one daphne process per worker
+# with SAGILE_EDITOR_WORKER_ID=0..N-1, the same SAGILE_EDITOR_WORKER_COUNT and
+# a channel layer shared by all of them (e.g. channels_redis). Each live
+# document is then held by exactly one worker; the others forward frames to it.
+EDITOR_WORKER_ID = int(os.environ.get('SAGILE_EDITOR_WORKER_ID', 0))
+EDITOR_WORKER_COUNT = int(os.environ.get('SAGILE_EDITOR_WORKER_COUNT', 1))
+EDITOR_CHANNEL_LAYER = 'default'
+
+# CRDT updates produced within this many milliseconds are merged into one
+# broadcast per document (0 = merge per event-loop tick).
+EDITOR_BROADCAST_WINDOW_MS = 10
+
+# Awareness (cursors, selections) is merged server-side and fanned out as one
+# batch per document per interval.
+EDITOR_AWARENESS_INTERVAL_MS = 100
+
+# How long a project's repository root path stays cached in-process. Entries
+# are also invalidated whenever a Repository is saved or deleted.
+REPOSITORY_PATH_CACHE_TTL_SECONDS = 300
+
+# Live documents idle for EDITOR_IDLE_EVICT_SECONDS are flushed and unloaded
+# from memory (and reloaded on their next frame); above the memory budget the
+# least recently active documents are unloaded first.
+EDITOR_MEMORY_BUDGET_BYTES = 256 * 1024 * 1024
+EDITOR_IDLE_EVICT_SECONDS = 300
+
+# Write-behind saving of live documents: a document is written once it has
+# been quiet for the debounce, and at the latest max-staleness seconds after
+# its first unsaved change. Disk writes run on a bounded thread pool.
+EDITOR_SAVE_DEBOUNCE_SECONDS = 2
+EDITOR_SAVE_MAX_STALENESS_SECONDS = 10
+EDITOR_FLUSH_IO_WORKERS = 4
+# A failed write is retried after the debounce, doubling per consecutive
+# failure up to this many seconds.
+EDITOR_SAVE_RETRY_MAX_SECONDS = 60
+
+# Clients connecting with ?compress=zlib receive editor frames of at least
+# this many bytes (typically the initial sync of a large file) zlib-compressed.
+EDITOR_COMPRESS_MIN_BYTES = 64 * 1024
+
+# Live documents with no edits for this many seconds have their .ystate/.ylog
+# sidecars compacted once (see also `manage.py compact_crdt_history`).
+EDITOR_COMPACT_IDLE_SECONDS = 60
+
+# Version snapshots of live documents (.yhist): at most one per interval while
+# a file is edited, plus one when it goes idle; every Nth is a full keyframe.
+EDITOR_SNAPSHOT_INTERVAL_SECONDS = 300
+EDITOR_SNAPSHOT_KEYFRAME_EVERY = 20
+
+# Set to a directory to record inbound editor sync frames as one trace file
+# per document (replay with `manage.py replay_editor_trace`). Off by default.
+EDITOR_TRACE_DIR = os.environ.get('SAGILE_EDITOR_TRACE_DIR') or None
+
+# Editor metrics are served in Prometheus format at /metrics to scrapers that
+# send "Authorization: Bearer <token>"; without a token the endpoint is closed.
+EDITOR_METRICS_TOKEN = os.environ.get('SAGILE_EDITOR_METRICS_TOKEN') or None
+
+# Per-connection send queue limits for room broadcasts. A client that falls
+# further behind has its queued updates dropped and receives one diff from
+# its last known state instead.
+EDITOR_OUTBOUND_QUEUE_FRAMES = 256
+EDITOR_OUTBOUND_QUEUE_BYTES = 4 * 1024 * 1024
+
+# Size-aware opening of files in the live editor: files of at least
+# EDITOR_READ_ONLY_MIN_BYTES are read-only and served in byte ranges of up to
+# EDITOR_RANGE_MAX_BYTES; files of at least EDITOR_CHUNKED_BOOTSTRAP_MIN_BYTES
+# are loaded into the editor in chunks without blocking other documents.
+EDITOR_READ_ONLY_MIN_BYTES = 16 * 1024 * 1024
+EDITOR_CHUNKED_BOOTSTRAP_MIN_BYTES = 1024 * 1024
+EDITOR_RANGE_MAX_BYTES = 1024 * 1024
+
+# When a worker shuts down, live documents with unsaved edits are flushed
+# concurrently; the worker waits at most this many seconds for them.
+EDITOR_SHUTDOWN_DEADLINE_SECONDS = 10
+
+# Files changed on disk while open in the editor (git checkout, REST writes)
+# are merged into the live document as a minimal diff.  Loaded documents are
+# stat()ed this often (0 disables polling); changed regions spanning more
+# lines than the limit are replaced whole instead of diffed line by line.
+EDITOR_DISK_CHECK_SECONDS = 5
+EDITOR_RECONCILE_LINE_DIFF_MAX_LINES = 20000
+
+# Editor WebSockets are authorized from the session cookie and project
+# membership (projects/ws_auth.py); answers are cached for this long so
+# reconnect storms do not turn into one MongoDB query per socket.
+EDITOR_WS_AUTH_CACHE_TTL_SECONDS = 30
+
+# Who has which file open (GET /api/projects/<id>/presence/ and "presence"
+# messages on project sockets): changes are pushed at most once per interval;
+# with several workers each re-sends its entries every refresh interval.
+EDITOR_PRESENCE_INTERVAL_MS = 250
+EDITOR_PRESENCE_REFRESH_SECONDS = 30
+
+# Structured logging (see sagile_ide/log.py). Records are written from a
+# background thread; LOG_SAMPLING keeps only a fraction of high-frequency
+# events (WARNING and above are always kept).
+LOG_LEVEL = os.environ.get('SAGILE_LOG_LEVEL', 'INFO')
+LOG_FORMAT = os.environ.get('SAGILE_LOG_FORMAT', 'json')
+LOG_SAMPLING = {
+    'doc.saved': 0.1,
+    'session.users': 0.1,
+}
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'filters': {
+        'sampling': {'()': 'sagile_ide.log.SamplingFilter'},
+    },
+    'formatters': {
+        'structured': {'()': 'sagile_ide.log.StructuredFormatter', 'style': LOG_FORMAT},
+    },
+    'handlers': {
+        'queued_console': {
+            '()': 'sagile_ide.log.QueuedStreamHandler',
+            'formatter': 'structured',
+            'filters': ['sampling'],
+        },
+    },
+    'loggers': {
+        'projects': {'handlers': ['queued_console'], 'level': LOG_LEVEL, 'propagate': False},
+        'repositories': {'handlers': ['queued_console'], 'level': LOG_LEVEL, 'propagate': False},
+    },
+}
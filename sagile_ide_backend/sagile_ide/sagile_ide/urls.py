@@ -16,6 +16,7 @@ Including another URLconf
 """
 from django.contrib import admin
 from django.urls import path, include
+from projects.views import editor_metrics_prometheus_view
 
 urlpatterns = [
     path('admin/', admin.site.urls),
@@ -23,4 +24,5 @@ urlpatterns = [
     path('api/projects/', include('projects.urls')),
     path('api/repositories/', include('repositories.urls')),
     path('api/tasks/', include('tasks.urls')),
+    path('metrics', editor_metrics_prometheus_view, name='editor_metrics_prometheus'),
 ]